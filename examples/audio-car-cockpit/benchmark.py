@@ -0,0 +1,291 @@
+"""End-to-end voice latency benchmark, without browser nor GPU.
+
+Replays utterances into `/ws-audio` against local stand-ins (see `src/stubs.py`):
+a fake audio server, a stub llama-server with scripted tool calls, and a headless
+cockpit answering the RPCs. Reports per-stage latency percentiles and throughput.
+
+Usage:
+    uv run benchmark.py --sessions 8 --turns 20
+    uv run benchmark.py --utterances recordings/utterances.jsonl
+    uv run benchmark.py --streaming
+
+With `--streaming`, the driver audio is streamed in real time as the driver speaks, and
+the recording stops `--release-ms` after the end of speech. Latencies are measured from
+the end of the recording in both modes.
+
+Each line of the utterances file is:
+    {"audio": "turn_1.wav", "transcript": "...", "tool_call": "media.play()", "response": "..."}
+with `audio` relative to the file, and optional: a synthetic WAV is used if missing.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import hashlib
+import io
+import json
+import math
+import os
+import tempfile
+import time
+import wave
+from array import array
+from collections import defaultdict
+from pathlib import Path
+
+import websockets
+
+from src.audio_transport import AudioKind, pack_audio_frame
+from src.stubs import (
+    BackgroundServer,
+    FakeCockpit,
+    StubDelays,
+    Utterance,
+    create_audio_stub,
+    create_lm_stub,
+    wav_frames,
+)
+from src.utils import find_available_port
+
+COCKPIT_NAME = "bench"
+
+DEFAULT_UTTERANCES = [
+    ("Open all the windows.", "carWindows.openAll()", "Opening all the windows for you."),
+    ("Play some music.", "media.play()", "Playing your music now. Enjoy the ride!"),
+    ("Set the temperature to 21 degrees.", "climate.setTarget(temperature=21)", "Temperature set to 21 degrees."),
+    ("Is the front left window open?", 'carWindows.get(id="fl")', "Let me check the front left window for you."),
+    (
+        "Navigate to the airport.",
+        'navigation.setDestination(destination="airport")',
+        "Setting the route to the airport.",
+    ),
+    ("Tell me a joke.", None, "I am focused on driving, but I can play some music if you like."),
+]
+
+# Latencies reported, relative to the driver audio being sent, in order of the pipeline
+STAGES = {
+    "asr_first_text": "ASR first text",
+    "driver_caption": "ASR complete",
+    "first_audio": "First audio",
+    "model_caption": "Model caption",
+    "done": "End to end",
+}
+
+
+def synthetic_wav(transcript: str, sample_rate: int = 16000) -> bytes:
+    """16 bits WAV of a tone, as long as the transcript would be spoken, unique per transcript.
+
+    Loud enough to be taken for speech by the endpointing of streamed audio.
+    """
+    n_samples = sample_rate * max(1, len(transcript) // 15)
+    # A few samples derived from the transcript, so the stub ASR can tell utterances apart
+    signature = hashlib.sha256(transcript.encode()).digest()
+    tone = array("h", (int(4000 * math.sin(2 * math.pi * 220 * i / sample_rate)) for i in range(n_samples)))
+
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(signature + tone.tobytes()[len(signature) :])
+    return buffer.getvalue()
+
+
+def load_utterances(path: Path | None) -> list[Utterance]:
+    if path is None:
+        return [
+            Utterance(transcript=transcript, tool_call=tool_call, response=response, wav=synthetic_wav(transcript))
+            for transcript, tool_call, response in DEFAULT_UTTERANCES
+        ]
+
+    utterances = []
+    for line in path.read_text().splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        wav = (path.parent / item["audio"]).read_bytes() if item.get("audio") else synthetic_wav(item["transcript"])
+        utterances.append(
+            Utterance(
+                transcript=item["transcript"], tool_call=item.get("tool_call"), response=item["response"], wav=wav
+            )
+        )
+    return utterances
+
+
+def percentile(values: list[float], q: float) -> float:
+    """Nearest-rank percentile."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))]
+
+
+async def stream_utterance(ws, utterance: Utterance, release_ms: float, frame_ms: int = 20) -> None:
+    """Stream the driver audio in real time, then silence until the recording stops."""
+    with wave.open(io.BytesIO(utterance.wav), "rb") as reader:
+        sample_rate = reader.getframerate()
+    pcm = wav_frames(utterance.wav)
+    frame_bytes = sample_rate * frame_ms // 1000 * 2
+    pcm += bytes(int(sample_rate * release_ms / 1000) * 2)
+
+    await ws.send(json.dumps({"mode": "start", "sample_rate": sample_rate}))
+    t0 = time.perf_counter()
+    for i, offset in enumerate(range(0, len(pcm), frame_bytes)):
+        frame = pack_audio_frame(AudioKind.PCM_S16, pcm[offset : offset + frame_bytes], sample_rate, bits_per_sample=16)
+        await ws.send(frame)
+        await asyncio.sleep(max(0.0, t0 + (i + 1) * frame_ms / 1000 - time.perf_counter()))
+    await ws.send(json.dumps({"mode": "end"}))
+
+
+async def run_turn(ws, utterance: Utterance, release_ms: float | None = None) -> dict[str, float]:
+    """Send one utterance and timestamp each stage until the turn is done, in ms.
+
+    Streamed when `release_ms` is set, the time between the end of speech and of the recording.
+    """
+    timings: dict[str, float] = {}
+    if release_ms is None:
+        await ws.send(pack_audio_frame(AudioKind.WAV, utterance.wav, 16000, bits_per_sample=16))
+    else:
+        await stream_utterance(ws, utterance, release_ms)
+    t_sent = time.perf_counter()
+
+    def mark(stage: str) -> None:
+        timings.setdefault(stage, (time.perf_counter() - t_sent) * 1000)
+
+    async for message in ws:
+        if isinstance(message, bytes):
+            mark("first_audio")
+            continue
+
+        data = json.loads(message)
+        match data["type"]:
+            case "text":
+                mark("asr_first_text")
+            case "caption":
+                mark(f"{data['role']}_caption")
+            case "audio":
+                mark("first_audio")
+            case "error":
+                raise RuntimeError(data["data"])
+            case "done":
+                mark("done")
+                return timings
+    raise ConnectionError("Audio websocket closed during the turn")
+
+
+async def run_session(
+    url: str, utterances: list[Utterance], turns: int, offset: int, release_ms: float | None = None
+) -> list[dict[str, float]]:
+    results = []
+    async with websockets.connect(url, max_size=None) as ws:
+        await ws.send(json.dumps({"mode": "config", "binary": True, "codecs": [], "cockpit": COCKPIT_NAME}))
+        json.loads(await ws.recv())
+        for i in range(turns):
+            results.append(await run_turn(ws, utterances[(offset + i) % len(utterances)], release_ms))
+    return results
+
+
+async def run_benchmark(
+    base_url: str, utterances: list[Utterance], sessions: int, turns: int, release_ms: float | None = None
+) -> tuple[list, float]:
+    cockpit = FakeCockpit(url=f"{base_url}/ws?cockpit={COCKPIT_NAME}")
+    ready = asyncio.Event()
+    cockpit_task = asyncio.create_task(cockpit.run(ready))
+    await ready.wait()
+
+    # Warmup, not measured
+    await run_session(f"{base_url}/ws-audio", utterances, turns=1, offset=0, release_ms=release_ms)
+
+    t0 = time.perf_counter()
+    results = await asyncio.gather(
+        *(
+            run_session(f"{base_url}/ws-audio", utterances, turns, offset=i, release_ms=release_ms)
+            for i in range(sessions)
+        )
+    )
+    elapsed = time.perf_counter() - t0
+
+    cockpit_task.cancel()
+    return [timings for session in results for timings in session], elapsed
+
+
+def report(results: list[dict[str, float]], elapsed: float, sessions: int) -> None:
+    by_stage = defaultdict(list)
+    for timings in results:
+        for stage, value in timings.items():
+            by_stage[stage].append(value)
+
+    print(f"\n{len(results)} turns, {sessions} concurrent sessions, {elapsed:.1f}s")
+    print(f"Throughput: {len(results) / elapsed:.2f} turns/s\n")
+    print(f"{'Stage (ms)':<16}{'p50':>8}{'p90':>8}{'p99':>8}{'max':>8}{'n':>6}")
+    for stage, label in STAGES.items():
+        values = by_stage.get(stage)
+        if not values:
+            continue
+        p50, p90, p99 = (percentile(values, q) for q in (50, 90, 99))
+        print(f"{label:<16}{p50:>8.0f}{p90:>8.0f}{p99:>8.0f}{max(values):>8.0f}{len(values):>6}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=4, help="Concurrent /ws-audio sessions")
+    parser.add_argument("--turns", type=int, default=10, help="Turns per session")
+    parser.add_argument("--utterances", type=Path, default=None, help="JSONL file of utterances to replay")
+    parser.add_argument("--asr-token-ms", type=float, default=10, help="Stub ASR delay per token")
+    parser.add_argument("--lm-token-ms", type=float, default=15, help="Stub LLM delay per token")
+    parser.add_argument("--tts-chunk-ms", type=float, default=40, help="Stub TTS delay per audio chunk")
+    parser.add_argument("--lm-parallel", type=int, default=2, help="Tool calling slots, requests beyond wait")
+    parser.add_argument("--no-fast-path", action="store_true", help="Always go through the tool calling model")
+    parser.add_argument("--no-tts-cache", action="store_true", help="Always synthesize speech")
+    parser.add_argument("--streaming", action="store_true", help="Stream the driver audio while speaking")
+    parser.add_argument("--release-ms", type=float, default=400, help="Recording kept after the speech, streaming")
+    parser.add_argument("--trace", type=Path, default=None, help="JSONL file receiving the server-side spans")
+    parser.add_argument("--verbose", action="store_true", help="Show the server logs")
+    args = parser.parse_args()
+
+    utterances = load_utterances(args.utterances)
+    delays = StubDelays(
+        asr_token_s=args.asr_token_ms / 1000,
+        lm_token_s=args.lm_token_ms / 1000,
+        tts_chunk_s=args.tts_chunk_ms / 1000,
+    )
+
+    port_audio, port_lm, port_demo = (find_available_port(None) for _ in range(3))
+    # Set before importing the server, settings are read at import
+    os.environ |= {
+        "DEMO_URL": f"http://127.0.0.1:{port_demo}",
+        "AUDIO_SERVER_PORT": str(port_audio),
+        "LM_SERVER_PORT": str(port_lm),
+        "SPAWN_AUDIO_SERVER": "false",
+        "LM_PARALLEL": str(args.lm_parallel),
+        "FAST_PATH": str(not args.no_fast_path).lower(),
+        "TTS_CACHE": str(not args.no_tts_cache).lower(),
+        # Runs do not share cached speech
+        "TTS_CACHE_DIR": tempfile.mkdtemp(prefix="tts-cache-"),
+        "OPEN_BROWSER": "false",
+    }
+    if args.trace is not None:
+        os.environ["TRACE_FILE"] = str(args.trace)
+    from server import app
+
+    # Each server runs in its own thread and event loop, like separate processes
+    logs = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    with (
+        logs,
+        BackgroundServer(create_audio_stub(utterances, delays), port_audio),
+        BackgroundServer(create_lm_stub({u.transcript: u.completion() for u in utterances}, delays), port_lm),
+        BackgroundServer(app, port_demo),
+    ):
+        results, elapsed = asyncio.run(
+            run_benchmark(
+                f"ws://127.0.0.1:{port_demo}",
+                utterances,
+                args.sessions,
+                args.turns,
+                release_ms=args.release_ms if args.streaming else None,
+            )
+        )
+
+    report(results, elapsed, args.sessions)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""Offline tool calling evaluation: accuracy and latency of the tool calling model.
+
+Runs a JSONL dataset of utterances with their expected tool call through `ToolCallingRuntime`,
+and scores the calls parsed with `function_to_args`:
+- exact match: same function and arguments, or no call when none is expected,
+- function accuracy: same function, or no call when none is expected,
+- argument accuracy: arguments with the expected value, out of the expected and predicted
+  ones, counted when the function is right.
+Also reports the tokens in and out, and latency percentiles of the tool call and the whole
+completion.
+
+Usage:
+    uv run evaluate.py --port 8989 --record eval/runs/recording.jsonl
+    uv run evaluate.py --replay eval/recording.jsonl --min-exact 0.9
+
+With `--port`, requests go to a running llama-server (e.g. the one of `make serve`), and
+`--record` saves the raw completions (under `eval/runs/`, ignored by git, or to `eval/recording.jsonl`
+to update the reference recording). With `--replay`, a stub llama-server answers with the
+recorded completions (see `src/stubs.py`): no model nor GPU needed, to check the runtime
+and the scoring, or compare recordings, on a laptop.
+
+Each line of the dataset is:
+    {"utterance": "Open the front left window.", "function": "carWindows.set", "args": {"id": "fl", "open": true}}
+with `function` null when no tool call is expected.
+"""
+
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import sys
+import time
+from contextlib import aclosing
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from benchmark import percentile
+from src.llamacpp_inference import ToolCallingRuntime, function_to_args
+from src.pipeline import TOOL_CALL_END, ToolCallStreamParser
+from src.stubs import BackgroundServer, StubDelays, create_lm_stub
+from src.utils import find_available_port
+
+DEFAULT_DATASET = Path(__file__).parent / "eval" / "tool_calls.jsonl"
+
+
+@dataclass(kw_only=True)
+class Case:
+    utterance: str
+    function: str | None
+    args: dict = field(default_factory=dict)
+
+
+def _same_value(a: object, b: object) -> bool:
+    # 21 and 21.0 are the same temperature, but True is not 1
+    if isinstance(a, bool) or isinstance(b, bool):
+        return a is b
+    return a == b
+
+
+@dataclass(kw_only=True)
+class Result:
+    case: Case
+    # Raw completion, special tokens included
+    completion: str
+    function: str | None = None
+    args: dict = field(default_factory=dict)
+    parse_error: str | None = None
+    tokens_in: int = 0
+    tokens_out: int = 0
+    tool_call_ms: float | None = None
+    total_ms: float = 0.0
+
+    @property
+    def function_match(self) -> bool:
+        return self.parse_error is None and self.function == self.case.function
+
+    @property
+    def exact_match(self) -> bool:
+        return self.function_match and self.argument_accuracy == 1.0
+
+    @property
+    def argument_accuracy(self) -> float:
+        if not self.function_match:
+            return 0.0
+        names = self.case.args.keys() | self.args.keys()
+        if not names:
+            return 1.0
+        right = sum(
+            name in self.args and name in self.case.args and _same_value(self.args[name], self.case.args[name])
+            for name in names
+        )
+        return right / len(names)
+
+    def predicted(self) -> str:
+        if self.parse_error is not None:
+            return f"unparsable {self.parse_error}"
+        if self.function is None:
+            return "no call"
+        return f"{self.function}({self.args})"
+
+
+def load_dataset(path: Path) -> list[Case]:
+    cases = []
+    for line in path.read_text().splitlines():
+        if not line.strip():
+            continue
+        item = json.loads(line)
+        cases.append(Case(utterance=item["utterance"], function=item.get("function"), args=item.get("args") or {}))
+    return cases
+
+
+async def run_case(runtime: ToolCallingRuntime, case: Case, semaphore: asyncio.Semaphore) -> Result:
+    usage: dict = {}
+    completion = ""
+    tool_call_ms = None
+    async with semaphore:
+        t0 = time.perf_counter()
+        async with aclosing(runtime.stream_content(case.utterance, usage=usage)) as deltas:
+            async for delta in deltas:
+                completion += delta
+                if tool_call_ms is None and TOOL_CALL_END in completion:
+                    tool_call_ms = (time.perf_counter() - t0) * 1000
+        total_ms = (time.perf_counter() - t0) * 1000
+
+    result = Result(
+        case=case,
+        completion=completion,
+        tokens_in=usage.get("tokens_evaluated", 0),
+        tokens_out=usage.get("tokens_predicted", 0),
+        tool_call_ms=tool_call_ms,
+        total_ms=total_ms,
+    )
+
+    # Same parsing as the voice pipeline
+    parser = ToolCallStreamParser()
+    parser.feed(completion)
+    parser.flush()
+    if parser.tool_call is not None:
+        try:
+            result.function, result.args = function_to_args(parser.tool_call)
+        except Exception as e:
+            result.parse_error = f"{parser.tool_call!r} ({type(e).__name__})"
+    return result
+
+
+async def run_eval(runtime: ToolCallingRuntime, cases: list[Case], concurrency: int) -> tuple[list[Result], float]:
+    semaphore = asyncio.Semaphore(concurrency)
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(run_case(runtime, case, semaphore) for case in cases))
+    return list(results), time.perf_counter() - t0
+
+
+def report(results: list[Result], elapsed: float, concurrency: int) -> None:
+    n = len(results)
+    exact = sum(result.exact_match for result in results)
+
+    print(f"\n{n} utterances, concurrency {concurrency}, {elapsed:.1f}s")
+    print(f"{'Exact match':<20}{exact / n:>8.1%}  ({exact}/{n})")
+    print(f"{'Function accuracy':<20}{sum(result.function_match for result in results) / n:>8.1%}")
+    print(f"{'Argument accuracy':<20}{sum(result.argument_accuracy for result in results) / n:>8.1%}")
+    print(f"{'Unparsable calls':<20}{sum(result.parse_error is not None for result in results):>8}")
+    for label, tokens in (
+        ("Tokens in", [result.tokens_in for result in results]),
+        ("Tokens out", [result.tokens_out for result in results]),
+    ):
+        print(f"{label:<20}{sum(tokens):>8}  ({sum(tokens) / n:.0f}/request)")
+
+    print(f"\n{'Latency (ms)':<16}{'p50':>8}{'p90':>8}{'p99':>8}{'max':>8}{'n':>6}")
+    for label, values in (
+        ("Tool call", [result.tool_call_ms for result in results if result.tool_call_ms is not None]),
+        ("Completion", [result.total_ms for result in results]),
+    ):
+        if not values:
+            continue
+        p50, p90, p99 = (percentile(values, q) for q in (50, 90, 99))
+        print(f"{label:<16}{p50:>8.0f}{p90:>8.0f}{p99:>8.0f}{max(values):>8.0f}{len(values):>6}")
+
+    failures = [result for result in results if not result.exact_match]
+    if failures:
+        print("\nMismatches:")
+    for result in failures:
+        expected = f"{result.case.function}({result.case.args})" if result.case.function else "no call"
+        print(f"  '{result.case.utterance}': expected {expected}, got {result.predicted()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("dataset", type=Path, nargs="?", default=DEFAULT_DATASET, help="JSONL file of utterances")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--port", type=int, help="Port of a running llama-server")
+    target.add_argument("--replay", type=Path, help="JSONL file of recorded completions, served by a stub")
+    parser.add_argument("--host", default="localhost", help="Host of the llama-server")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requests in flight")
+    parser.add_argument("--record", type=Path, default=None, help="Save the raw completions to this JSONL file")
+    parser.add_argument("--no-grammar", action="store_true", help="Decode without the tool call grammar")
+    parser.add_argument("--lm-token-ms", type=float, default=15, help="Stub LLM delay per token, with --replay")
+    parser.add_argument("--min-exact", type=float, default=0.0, help="Exit with an error below this exact match")
+    parser.add_argument("--verbose", action="store_true", help="Show the runtime logs")
+    args = parser.parse_args()
+
+    cases = load_dataset(args.dataset)
+
+    with contextlib.ExitStack() as stack:
+        if not args.verbose:
+            stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+        host, port = args.host, args.port
+        if args.replay is not None:
+            recorded = [json.loads(line) for line in args.replay.read_text().splitlines() if line.strip()]
+            completions = {item["utterance"]: item["completion"] for item in recorded}
+            host, port = "127.0.0.1", find_available_port(None)
+            stack.enter_context(
+                BackgroundServer(create_lm_stub(completions, StubDelays(lm_token_s=args.lm_token_ms / 1000)), port)
+            )
+
+        runtime = ToolCallingRuntime(port=port, host=host, grammar=not args.no_grammar)
+        results, elapsed = asyncio.run(run_eval(runtime, cases, args.concurrency))
+
+    if args.record is not None:
+        args.record.parent.mkdir(parents=True, exist_ok=True)
+        with args.record.open("w") as f:
+            for result in results:
+                f.write(json.dumps({"utterance": result.case.utterance, "completion": result.completion}) + "\n")
+
+    report(results, elapsed, args.concurrency)
+
+    exact = sum(result.exact_match for result in results) / len(results)
+    if exact < args.min_exact:
+        print(f"\nExact match {exact:.1%} below {args.min_exact:.1%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
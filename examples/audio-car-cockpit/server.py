@@ -1,87 +1,186 @@
+import asyncio
 import base64
+import json
+import time
+import uuid
 import webbrowser
-from contextlib import asynccontextmanager
+from collections.abc import Awaitable, Callable
+from contextlib import AsyncExitStack, aclosing, asynccontextmanager
 from pathlib import Path
 
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
-from fastapi.responses import FileResponse, HTMLResponse, JSONResponse
-from openai import AsyncOpenAI
-
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from src.audio_codec import negotiate_codec, opus_to_wav, pcm_to_wav
+from src.audio_runtime import AudioRuntime
+from src.audio_transport import (
+    SEND_TIMEOUT,
+    AudioKind,
+    TTSAudioEncoder,
+    is_client_stalled,
+    send_audio_message,
+    unpack_audio_frame,
+)
 from src.checklist import create_checklist_router
-from src.connection_manager import ConnectionManager
+from src.connection_manager import ConnectionManager, RPCError
+from src.conversation import Conversation, Conversations
+from src.fast_path import ToolCallCache
 from src.functions import create_functions_router
-from src.llamacpp_inference import ToolCallingRuntime, function_to_args, spawn_server
+from src.llamacpp_inference import function_to_args
+from src.pipeline import VoiceTurn
+from src.runtime_pool import PoolFull, RuntimePool
+from src.runtime_process import StartupTimings
 from src.settings import p_env
+from src.static_assets import StaticAssets
+from src.streaming_asr import Endpointer, StreamingUtterance
+from src.tracing import Tracer, render_counter
+from src.tts_cache import TTSCache, stream_tts
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Setting up...")
+    timings = StartupTimings()
 
     # Prepare inference runtimes
-    with (
-        spawn_server(file_name="LiquidAI/LFM2-1.2B-Tool-GGUF:Q8_0") as (_, port_lm),
-    ):
-        app.state.tcr = ToolCallingRuntime(port=port_lm)
+    if p_env.LM_SERVER_PORT is not None:
+        pool = RuntimePool(
+            ports=[p_env.LM_SERVER_PORT],
+            parallel=p_env.LM_PARALLEL,
+            max_queue=p_env.LM_MAX_QUEUE,
+            timings=timings,
+            grammar=p_env.TOOL_GRAMMAR,
+        )
+    else:
+        pool = RuntimePool(
+            file_name="LiquidAI/LFM2-1.2B-Tool-GGUF:Q8_0",
+            n_servers=p_env.LM_SERVERS,
+            parallel=p_env.LM_PARALLEL,
+            max_queue=p_env.LM_MAX_QUEUE,
+            timings=timings,
+            grammar=p_env.TOOL_GRAMMAR,
+        )
+    audio = AudioRuntime(
+        port=p_env.AUDIO_SERVER_PORT,
+        threads=p_env.AUDIO_SERVER_THREADS,
+        spawn=p_env.SPAWN_AUDIO_SERVER,
+        standby=p_env.AUDIO_STANDBY,
+        timings=timings,
+    )
+
+    async with AsyncExitStack() as stack:
+        stack.callback(tracer.close)
+        # Both models load concurrently, ready in the time of the slowest one
+        async with asyncio.TaskGroup() as tg:
+            tg.create_task(stack.enter_async_context(pool))
+            tg.create_task(stack.enter_async_context(audio))
+        timings.report()
+        app.state.pool = pool
+        app.state.audio = audio
 
         _url = p_env.DEMO_URL.unicode_string()
-        print(f"Ready, opening: {_url}")
-        webbrowser.open(_url, new=0, autoraise=True)
+        if p_env.OPEN_BROWSER:
+            print(f"Ready, opening: {_url}")
+            webbrowser.open(_url, new=0, autoraise=True)
+        else:
+            print(f"Ready: {_url}")
         yield
 
 
 # Initialize FastAPI app and connection manager
 app = FastAPI(lifespan=lifespan, title="Cockpit demo")
 manager = ConnectionManager()
+fast_path = ToolCallCache() if p_env.FAST_PATH else None
+tts_cache = TTSCache(cache_dir=p_env.TTS_CACHE_DIR) if p_env.TTS_CACHE else None
+# Conversations of the sessions named by the clients, which outlive their connections
+conversations = Conversations(max_tokens=p_env.CONVERSATION_MAX_TOKENS) if p_env.MULTI_TURN else None
+tracer = Tracer(trace_file=p_env.TRACE_FILE)
 
 # Static files directory
 static_dir = Path(__file__).parent / "static"
 static_dir.mkdir(exist_ok=True)
+# Loaded once and precompressed, see `src.static_assets`
+static_assets = StaticAssets(static_dir, reload=p_env.STATIC_RELOAD)
 
 
 # Static file endpoints
 @app.get("/favicon.ico", include_in_schema=False)
-async def favicon():
-    return FileResponse((Path("static") / "favicon.ico"))
+async def favicon(request: Request):
+    return static_assets.response(request, "favicon.ico")
 
 
 @app.get("/style.css", include_in_schema=False)
-async def style():
-    return FileResponse((Path("static") / "style.css"))
+async def style(request: Request):
+    return static_assets.response(request, "style.css")
 
 
 @app.get("/script.js", include_in_schema=False)
-async def script():
-    return FileResponse((Path("static") / "script.js"))
+async def script(request: Request):
+    return static_assets.response(request, "script.js")
 
 
 @app.get("/shader-logo.js", include_in_schema=False)
-async def shader_logo():
-    return FileResponse((Path("static") / "shader-logo.js"))
+async def shader_logo(request: Request):
+    return static_assets.response(request, "shader-logo.js")
 
 
 @app.get("/")
-async def get_index():
-    index_path = static_dir / "index.html"
-    return HTMLResponse(index_path.read_text())
+async def get_index(request: Request):
+    return static_assets.response(request, "index.html")
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    # Prometheus text exposition format
+    text = tracer.render()
+    if fast_path is not None:
+        text += render_counter("cockpit_fast_path_hits_total", "Commands answered by the fast path.", fast_path.hits)
+        text += render_counter("cockpit_fast_path_misses_total", "Commands sent to the model.", fast_path.misses)
+    if tts_cache is not None:
+        text += render_counter("cockpit_tts_cache_hits_total", "Sentences replayed from the cache.", tts_cache.hits)
+        text += render_counter("cockpit_tts_cache_misses_total", "Sentences synthesized.", tts_cache.misses)
+    return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
 
 
 # Tool calling example endpoints
 @app.get("/toolcall/single/{query}")
-async def tool_calling_single_turn(query: str):
-    tcr: ToolCallingRuntime = app.state.tcr
-
-    tool_call, text = tcr.completion(query)
+async def tool_calling_single_turn(query: str, cockpit: str | None = None):
+    pool: RuntimePool = app.state.pool
+
+    hit = fast_path.lookup(query) if fast_path is not None else None
+    if hit is not None:
+        tool_call, text = hit.tool_call, hit.response
+    else:
+        try:
+            async with pool.acquire(session=cockpit) as slot:
+                with tracer.span("tool_call", session=cockpit):
+                    tool_call, text = await asyncio.to_thread(slot.completion, query)
+        except PoolFull as e:
+            return JSONResponse(status_code=503, content={"error": str(e)})
 
     if tool_call is not None:
-        func_name, args = function_to_args(tool_call)
+        try:
+            func_name, args = function_to_args(tool_call)
+        except Exception as e:
+            return JSONResponse(status_code=422, content={"tool_call": tool_call, "error": f"Invalid tool call: {e}"})
 
-        if not manager.active_connections:
+        ws = manager.resolve(cockpit)
+        if ws is None:
             print("No active cockpit connections")
         else:
-            ws = manager.active_connections[0]
-            result = await manager.send_rpc_request(ws, func_name, args)
+            try:
+                with tracer.span("rpc", session=cockpit):
+                    result = await manager.send_rpc_request(ws, func_name, args)
+            except RPCError as e:
+                if hit is not None:
+                    fast_path.forget(hit)
+                return JSONResponse(status_code=502, content={"tool_call": tool_call, "error": str(e)})
             print(f"Function call result:\n{result}")
+            if fast_path is not None:
+                if result:
+                    fast_path.learn(query, tool_call, text)
+                elif hit is not None:
+                    fast_path.forget(hit)
 
     return JSONResponse(content={"tool_call": tool_call, "text": text})
 
@@ -94,7 +193,8 @@ app.include_router(create_checklist_router(manager))
 # WebSocket endpoint for cockpit control
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    # Several cockpits can be connected, named with `/ws?cockpit=<name>`
+    await manager.connect(websocket, name=websocket.query_params.get("cockpit"))
     try:
         while True:
             data = await websocket.receive_text()
@@ -103,161 +203,295 @@ async def websocket_endpoint(websocket: WebSocket):
         manager.disconnect(websocket)
 
 
+def asr_messages(audio_b64: str) -> list[dict]:
+    return [
+        {"role": "system", "content": "Perform ASR."},
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "input_audio",
+                    "input_audio": {
+                        "data": audio_b64,
+                        "format": "wav",
+                    },
+                }
+            ],
+        },
+    ]
+
+
+async def transcribe(
+    audio: AudioRuntime, audio_b64: str, on_text: Callable[[str], Awaitable[None]] | None = None
+) -> str:
+    """Transcribe a WAV file, passing each piece of text to `on_text` as it streams."""
+    stream = await audio.stream_chat(asr_messages(audio_b64))
+
+    transcribed_text = ""
+    # Closed on cancellation, the audio server stops right away
+    async with stream:
+        async for chunk in stream:
+            delta = chunk.choices[0].delta
+
+            if delta.content:
+                _text_content = delta.content  # .rstrip("<|im_end|>")
+                transcribed_text += _text_content
+                if on_text is not None:
+                    await on_text(_text_content)
+    return transcribed_text
+
+
 # WebSocket endpoint for audio (STT/TTS)
 @app.websocket("/ws-audio")
 async def websocket_audio_endpoint(websocket: WebSocket):
     await websocket.accept()
-    audio_client = AsyncOpenAI(base_url=f"http://127.0.0.1:{p_env.AUDIO_SERVER_PORT}/v1", api_key="dummy")
+    # The audio server instance is picked per request, to follow restarts
+    audio: AudioRuntime = app.state.audio
+    pool: RuntimePool = app.state.pool
 
     voice = "US female"
+    # Set by the client in a "config" message, legacy clients get base64 audio in JSON
+    binary = False
+    codec = "pcm"
+    cockpit = None
+    # Tool calls of this session go to the same runtime slot when possible, to reuse its cache.
+    # Replaced by the id of the client session, if it sends one, as the web UI opens a
+    # connection per utterance.
+    session = uuid.uuid4().hex
+    client_session = False
+    # Previous exchanges, so that the driver can refer to them ("a bit warmer")
+    conversation = Conversation(max_tokens=p_env.CONVERSATION_MAX_TOKENS) if p_env.MULTI_TURN else None
+    # Utterance being streamed by the client, between the "start" message and its end
+    utterance: StreamingUtterance | None = None
+    utterance_rate = 16000
+    # Request being processed (voice turn or TTS), in its own task so that messages are
+    # still read meanwhile: the next request or a "cancel" message aborts it (barge-in)
+    current: asyncio.Task | None = None
+    # Task reading the messages, ended when the client stops reading what is sent to it
+    connection = asyncio.current_task()
+    stalled = False
+
+    async def transcribe_pcm(pcm: bytes) -> str:
+        return await transcribe(audio, base64.b64encode(pcm_to_wav(pcm, utterance_rate)).decode("utf-8"))
+
+    async def send_partial(text: str, stable: str) -> None:
+        await websocket.send_json({"type": "partial", "text": text, "stable": stable})
+
+    async def prefill(stable: str) -> None:
+        # The tool calling prompt is evaluated while the driver is still talking
+        history = conversation.messages() if conversation is not None else None
+        if await pool.prefill(session, stable, history):
+            print(f"[AUDIO] Prefilled: '{stable}'")
+
+    async def recognize(
+        t_received: float, request_id: str, audio_b64: str | None, streamed: StreamingUtterance | None
+    ) -> str:
+        if streamed is not None:
+            with tracer.span("asr_total", session=session, request_id=request_id):
+                transcribed_text = await streamed.finish()
+            print(f"[AUDIO] Streamed {streamed.duration_ms}ms of audio")
+            return transcribed_text
+
+        print("\n[AUDIO] Starting ASR (Speech-to-Text)...")
+        first_text = True
+
+        async def on_text(text: str) -> None:
+            nonlocal first_text
+            if first_text:
+                tracer.record("asr_first_token", t_received, session=session, request_id=request_id)
+                first_text = False
+            await websocket.send_json({"type": "text", "data": text})
+
+        assert audio_b64 is not None
+        transcribed_text = await transcribe(audio, audio_b64, on_text)
+        tracer.record("asr_total", t_received, session=session, request_id=request_id)
+        return transcribed_text
+
+    async def respond(
+        t_received: float,
+        request_id: str,
+        audio_b64: str | None = None,
+        streamed: StreamingUtterance | None = None,
+    ) -> None:
+        transcribed_text = await recognize(t_received, request_id, audio_b64, streamed)
+
+        # Process through tool calling and then TTS, pipelined sentence by sentence
+        if transcribed_text:
+            print(f"[AUDIO] Transcribed: {transcribed_text}")
+
+            # Send User caption
+            await websocket.send_json({"type": "caption", "role": "driver", "text": transcribed_text})
+
+            turn = VoiceTurn(
+                websocket=websocket,
+                audio_client=audio.client(),
+                pool=pool,
+                session=session,
+                conversation=conversation,
+                tracer=tracer,
+                request_id=request_id,
+                fast_path=fast_path,
+                tts_cache=tts_cache,
+                manager=manager,
+                voice=voice,
+                cockpit=cockpit,
+                binary=binary,
+                codec=codec,
+                t_start=t_received,
+            )
+            await turn.run(transcribed_text)
+
+    async def speak(text: str) -> None:
+        print(f"\n[AUDIO] Starting TTS (Text-to-Speech) with voice '{voice}': '{text}'")
+        encoder = TTSAudioEncoder(binary, codec)
+        async with aclosing(stream_tts(audio.client(), voice, text, tts_cache)) as chunks:
+            async for chunk_data in chunks:
+                # Sent as soon as a frame is complete, for low latency
+                for audio_message in encoder.encode(chunk_data):
+                    await send_audio_message(websocket, audio_message, SEND_TIMEOUT)
+        for audio_message in encoder.flush():
+            await send_audio_message(websocket, audio_message, SEND_TIMEOUT)
+
+    async def run_request(request: Awaitable[None]) -> None:
+        nonlocal stalled
+        try:
+            await request
+            await websocket.send_json({"type": "done"})
+        except Exception as e:
+            if is_client_stalled(e):
+                # Not even a close frame would get through: the connection is dropped, and
+                # closed by the server once the handler returns
+                print("[AUDIO] Client stalled, dropping the connection")
+                stalled = True
+                if connection is not None:
+                    connection.cancel()
+                return
+            print(f"[AUDIO] Error: {e}")
+            await websocket.send_json({"type": "error", "data": str(e)})
+
+    def start(request: Awaitable[None]) -> None:
+        nonlocal current
+        current = asyncio.create_task(run_request(request))
+
+    async def cancel() -> None:
+        """Abort the request in progress, if any.
+
+        Its LLM and TTS streams are closed as the task unwinds, which stops the generation
+        on the servers and frees the tool calling slot. Audio not sent yet is dropped, and
+        the client is told to drop what it has queued.
+        """
+        nonlocal current
+        if current is None or current.done():
+            return
+        current.cancel()
+        await asyncio.wait([current])
+        current = None
+        print("[AUDIO] Request in progress cancelled")
+        await websocket.send_json({"type": "cancelled"})
 
     try:
         while True:
-            data = await websocket.receive_json()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+
+            # The driver audio is sent as soon as the recording stops
+            t_received = time.perf_counter()
+            request_id = uuid.uuid4().hex[:12]
+
+            if message.get("bytes") is not None:
+                # Binary frame: header + WAV or Opus, encoded once for the OpenAI-style request
+                header, payload = unpack_audio_frame(message["bytes"])
+                if header.kind == AudioKind.PCM_S16:
+                    # Streamed driver audio, dropped if the utterance already ended
+                    if utterance is None or not utterance.feed(payload):
+                        continue
+                    print("[AUDIO] End of utterance detected")
+                    await websocket.send_json({"type": "endpoint"})
+                    data = {"mode": "end"}
+                else:
+                    if header.kind == AudioKind.OPUS:
+                        payload = opus_to_wav(payload, header.sample_rate)
+                    elif header.kind != AudioKind.WAV:
+                        raise ValueError(f"Unexpected audio frame from client: {header.kind.name}")
+                    data = {"mode": "asr"}
+                    audio_b64 = base64.b64encode(payload).decode("utf-8")
+            else:
+                data = json.loads(message["text"])
+                # Already base64, passed through as is
+                audio_b64 = data.get("audio")
+
             mode = data.get("mode", "asr")
             text = data.get("text")
-            audio_b64 = data.get("audio")
-
-            wav_data = base64.b64decode(audio_b64) if audio_b64 else None
-
-            # Build messages based on mode
-            if mode == "asr":
-                print("\n[AUDIO] Starting ASR (Speech-to-Text)...")
-                if wav_data is None:
-                    continue
-                messages = [
-                    {"role": "system", "content": "Perform ASR."},
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "input_audio",
-                                "input_audio": {
-                                    "data": base64.b64encode(wav_data).decode("utf-8"),
-                                    "format": "wav",
-                                },
-                            }
-                        ],
-                    },
-                ]
-            else:  # tts
-                voice = data.get("voice", None) or voice
-                print(f"\n[AUDIO] Starting TTS (Text-to-Speech) with voice '{voice}': '{text}'")
-                messages = [
-                    {
-                        "role": "system",
-                        "content": f"Perform TTS. Use the {voice} voice.",
-                    },
-                    {"role": "user", "content": text},
-                ]
-
-            # Stream response
-            stream = await audio_client.chat.completions.create(
-                model="",
-                messages=messages,
-                stream=True,
-                max_tokens=512,
-            )
-
-            transcribed_text = ""
-
-            async for chunk in stream:
-                delta = chunk.choices[0].delta
-
-                if delta.content:
-                    _text_content = delta.content  # .rstrip("<|im_end|>")
-                    transcribed_text += _text_content
-                    await websocket.send_json({"type": "text", "data": _text_content})
-
-                if hasattr(delta, "audio_chunk") and delta.audio_chunk:
-                    chunk_data = delta.audio_chunk["data"]
-                    # Send audio chunk immediately for low latency
-                    await websocket.send_json({"type": "audio", "data": chunk_data, "sample_rate": 24000})
-
-            # If ASR mode, process through tool calling and then TTS
-            if mode == "asr" and transcribed_text:
-                print(f"[AUDIO] Transcribed: {transcribed_text}")
-
-                # Send User caption
-                await websocket.send_json({"type": "caption", "role": "driver", "text": transcribed_text})
-
-                # Process through tool calling runtime
-                print("[AUDIO] Processing through tool calling model...")
-                tcr: ToolCallingRuntime = app.state.tcr
-                tool_call, response_text = tcr.completion(transcribed_text)
-
-                formatted_tool_name = None
-                tool_call_valid = True
-
-                # Execute function call if present
-                if tool_call is not None:
-                    print(f"[AUDIO] Tool call detected: {tool_call}")
-                    formatted_tool_name = tool_call
-                    try:
-                        func_name, args = function_to_args(tool_call)
-                        formatted_tool_name = func_name
-
-                        if not manager.active_connections:
-                            print("[AUDIO] No active cockpit connections")
-                            response_text = "Sorry, the cockpit is not connected."
-                        else:
-                            ws = manager.active_connections[0]
-                            result = await manager.send_rpc_request(ws, func_name, args)
-                            if result is not None:
-                                tool_call_valid = result
-                            print(f"[AUDIO] Function call result: {result}")
-                    except Exception as e:
-                        print(f"[AUDIO] Function call error: {e}")
-                        # Override response with error message
-                        response_text = f"Sorry, the model called the non-existing function: {tool_call}"
-                        tool_call_valid = False
-                else:
-                    print("[AUDIO] No tool call detected")
-
-                # Send caption
-                await websocket.send_json(
-                    {
-                        "type": "caption",
-                        "role": "model",
-                        "text": response_text,
-                        "tool": formatted_tool_name,
-                        "tool_valid": tool_call_valid,
-                    }
-                )
 
-                # Send the response text to TTS
+            if mode == "config":
                 voice = data.get("voice", None) or voice
-                print(f"[AUDIO] Sending to TTS with voice '{voice}': '{response_text}'")
-                tts_messages = [
-                    {
-                        "role": "system",
-                        "content": f"Perform TTS. Use the {voice} voice.",
-                    },
-                    {"role": "user", "content": response_text},
-                ]
-
-                tts_stream = await audio_client.chat.completions.create(
-                    model="",
-                    messages=tts_messages,
-                    stream=True,
-                    max_tokens=512,
+                binary = data.get("binary", binary)
+                cockpit = data.get("cockpit", None) or cockpit
+                if isinstance(name := data.get("session"), str) and 0 < len(name) <= 64:
+                    pool.end_session(session)
+                    session, client_session = f"client-{name}", True
+                    if conversations is not None:
+                        conversation = conversations.get(session)
+                codec = negotiate_codec(data.get("codecs", [])) if binary else "pcm"
+                print(f"[AUDIO] Client config: binary={binary}, codec={codec}")
+                # Streaming ASR needs binary frames of driver audio
+                await websocket.send_json({"type": "config", "binary": binary, "codec": codec, "streaming": binary})
+                continue
+
+            if mode == "cancel":
+                if utterance is not None:
+                    utterance.close()
+                    utterance = None
+                await cancel()
+                continue
+
+            if mode == "end":
+                # End of a streamed utterance, detected above or sent by the client
+                if utterance is not None:
+                    start(respond(t_received, request_id, streamed=utterance))
+                    utterance = None
+                continue
+
+            # Any other request supersedes the one in progress: the driver speaks again
+            await cancel()
+            voice = data.get("voice", None) or voice
+
+            if mode == "tts":
+                start(speak(text))
+            elif mode == "start":
+                print("\n[AUDIO] Streaming ASR (Speech-to-Text)...")
+                if utterance is not None:
+                    utterance.close()
+                utterance_rate = data.get("sample_rate", 16000)
+                utterance = StreamingUtterance(
+                    transcribe_pcm,
+                    sample_rate=utterance_rate,
+                    on_partial=send_partial,
+                    on_stable=prefill if p_env.SPECULATIVE_PREFILL else None,
+                    endpointer=Endpointer(utterance_rate, endpoint_ms=p_env.ENDPOINT_SILENCE_MS),
+                    max_duration_ms=p_env.MAX_UTTERANCE_MS,
                 )
-
-                async for chunk in tts_stream:
-                    delta = chunk.choices[0].delta
-
-                    if hasattr(delta, "audio_chunk") and delta.audio_chunk:
-                        chunk_data = delta.audio_chunk["data"]
-                        # Send audio chunk immediately for low latency
-                        await websocket.send_json({"type": "audio", "data": chunk_data, "sample_rate": 24000})
-
-            await websocket.send_json({"type": "done"})
+            elif audio_b64 is not None:
+                start(respond(t_received, request_id, audio_b64=audio_b64))
 
     except WebSocketDisconnect:
         pass
+    except asyncio.CancelledError:
+        if not stalled:
+            raise
     except Exception as e:
         print(f"[AUDIO] Error: {e}")
         await websocket.send_json({"type": "error", "data": str(e)})
+    finally:
+        if utterance is not None:
+            utterance.close()
+        if current is not None:
+            current.cancel()
+            await asyncio.wait([current])
+        # The slot of a client session is kept for its next connection
+        if not client_session:
+            pool.end_session(session)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,102 @@
+"""Optional Opus compression for the /ws-audio stream.
+
+Requires `opuslib` and the libopus shared library (`uv sync --group opus`). Without them,
+`OPUS_AVAILABLE` is False and the negotiation falls back to WAV/PCM.
+"""
+
+import io
+import struct
+import wave
+
+try:
+    import opuslib
+except Exception:  # Optional dependency, opuslib also raises a bare Exception when libopus is missing
+    opuslib = None
+
+OPUS_AVAILABLE = opuslib is not None
+
+# Opus only encodes fixed size frames: 2.5, 5, 10, 20, 40 or 60 ms
+OPUS_FRAME_MS = 20
+# Upper bound of a decoded packet, per the Opus spec
+OPUS_MAX_PACKET_MS = 120
+
+_PACKET_LENGTH = struct.Struct("<H")
+_FLOAT32_BYTES = 4
+
+
+def negotiate_codec(offered: list[str]) -> str:
+    """Pick the codec for a session from the ones offered by the client."""
+    if "opus" in offered and OPUS_AVAILABLE:
+        return "opus"
+    return "pcm"
+
+
+def pack_opus_packets(packets: list[bytes]) -> bytes:
+    """Concatenate Opus packets, each prefixed by its length (u16, little-endian)."""
+    return b"".join(_PACKET_LENGTH.pack(len(p)) + p for p in packets)
+
+
+def unpack_opus_packets(payload: bytes | memoryview) -> list[bytes]:
+    packets = []
+    offset = 0
+    while offset < len(payload):
+        (length,) = _PACKET_LENGTH.unpack_from(payload, offset)
+        offset += _PACKET_LENGTH.size
+        packets.append(bytes(payload[offset : offset + length]))
+        offset += length
+    return packets
+
+
+class OpusStreamEncoder:
+    """Encode mono float32 PCM chunks of any length into frame-aligned Opus packets.
+
+    Samples that do not fill a whole frame are kept for the next call, `flush`
+    pads the last frame with silence.
+    """
+
+    def __init__(self, sample_rate: int, bitrate: int = 24000):
+        if opuslib is None:
+            raise RuntimeError("Opus support requires `opuslib`, install it with `uv sync --group opus`")
+
+        self._encoder = opuslib.Encoder(sample_rate, 1, opuslib.APPLICATION_VOIP)
+        self._encoder.bitrate = bitrate
+        self.frame_samples = sample_rate * OPUS_FRAME_MS // 1000
+        self._frame_bytes = self.frame_samples * _FLOAT32_BYTES
+        self._pending = bytearray()
+
+    def encode(self, pcm_f32: bytes) -> list[bytes]:
+        self._pending += pcm_f32
+        packets = []
+        while len(self._pending) >= self._frame_bytes:
+            frame = bytes(self._pending[: self._frame_bytes])
+            del self._pending[: self._frame_bytes]
+            packets.append(self._encoder.encode_float(frame, self.frame_samples))
+        return packets
+
+    def flush(self) -> list[bytes]:
+        if not self._pending:
+            return []
+        self._pending += bytes(self._frame_bytes - len(self._pending))
+        return self.encode(b"")
+
+
+def opus_to_wav(payload: bytes | memoryview, sample_rate: int) -> bytes:
+    """Decode length-prefixed mono Opus packets into a 16 bits WAV file, as expected for ASR."""
+    if opuslib is None:
+        raise RuntimeError("Opus support requires `opuslib`, install it with `uv sync --group opus`")
+
+    decoder = opuslib.Decoder(sample_rate, 1)
+    max_frame_samples = sample_rate * OPUS_MAX_PACKET_MS // 1000
+    pcm = b"".join(decoder.decode(packet, max_frame_samples) for packet in unpack_opus_packets(payload))
+    return pcm_to_wav(pcm, sample_rate)
+
+
+def pcm_to_wav(pcm: bytes | memoryview, sample_rate: int) -> bytes:
+    """Wrap mono 16 bits PCM into a WAV file."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
@@ -0,0 +1,251 @@
+import asyncio
+from contextlib import suppress
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import httpx
+from openai import APIConnectionError, AsyncOpenAI, AsyncStream
+from openai.types.chat import ChatCompletionChunk
+
+from src.runtime_process import RuntimeProcess, StartupTimings, start_runtime
+from src.utils import find_available_port, is_port_in_use
+
+# Same layout as prepared by `make llama-liquid-audio/llama-liquid-audio-server LFM2.5-Audio-1.5B-GGUF`
+AUDIO_SERVER_EXECUTABLE = Path("llama-liquid-audio/llama-liquid-audio-server")
+AUDIO_MODEL_DIR = Path("LFM2.5-Audio-1.5B-GGUF")
+
+
+def audio_server_command(port: int, threads: int, host: str = "127.0.0.1") -> list[str]:
+    return [
+        str(AUDIO_SERVER_EXECUTABLE.resolve()),
+        "-m",
+        str(AUDIO_MODEL_DIR / "LFM2.5-Audio-1.5B-Q8_0.gguf"),
+        "-mm",
+        str(AUDIO_MODEL_DIR / "mmproj-LFM2.5-Audio-1.5B-Q8_0.gguf"),
+        "-mv",
+        str(AUDIO_MODEL_DIR / "vocoder-LFM2.5-Audio-1.5B-Q8_0.gguf"),
+        "--tts-speaker-file",
+        str(AUDIO_MODEL_DIR / "tokenizer-LFM2.5-Audio-1.5B-Q8_0.gguf"),
+        "-t",
+        str(threads),
+        "--host",
+        host,
+        "--port",
+        str(port),
+    ]
+
+
+async def warmup_audio(client: AsyncOpenAI) -> None:
+    """Short TTS request, the first one is much slower than the following ones."""
+    stream = await client.chat.completions.create(
+        model="",
+        messages=[
+            {"role": "system", "content": "Perform TTS. Use the US female voice."},
+            {"role": "user", "content": "Ready."},
+        ],
+        stream=True,
+        max_tokens=64,
+    )
+    async for _ in stream:
+        pass
+
+
+@dataclass(kw_only=True, eq=False)
+class AudioInstance:
+    name: str
+    host: str
+    port: int
+    # None when the server is not managed by the cockpit server, and cannot be restarted
+    process: RuntimeProcess | None = None
+    healthy: bool = True
+    # Consecutive failed liveness checks
+    failures: int = 0
+    client: AsyncOpenAI = field(init=False)
+
+    def __post_init__(self):
+        # No retries nor long timeouts, a failing instance is replaced instead
+        self.client = AsyncOpenAI(
+            base_url=f"http://{self.host}:{self.port}/v1", api_key="dummy", max_retries=0, timeout=30.0
+        )
+
+
+class AudioRuntime:
+    """LFM2.5-Audio server for ASR and TTS, supervised.
+
+    Spawned with the cockpit server when `spawn` is set, unless a server already listens
+    on `port` (e.g. started with `make audioserver`), in which case it is used as is.
+
+    Each instance is checked every `health_interval`: after `max_failures` failed checks,
+    or as soon as the process exits, it is restarted, retrying with an exponential
+    backoff. With `standby`, a second instance is kept ready, and takes the requests
+    while the primary one restarts.
+    """
+
+    def __init__(
+        self,
+        port: int,
+        threads: int = 4,
+        spawn: bool = True,
+        standby: bool = False,
+        host: str = "127.0.0.1",
+        timings: StartupTimings | None = None,
+        health_interval: float = 1.0,
+        max_failures: int = 2,
+        min_backoff: float = 1.0,
+        max_backoff: float = 30.0,
+    ):
+        self.port = port
+        self.threads = threads
+        self.spawn = spawn
+        self.standby = standby
+        self.host = host
+        self.timings = timings or StartupTimings()
+        self.health_interval = health_interval
+        self.max_failures = max_failures
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        self.instances: list[AudioInstance] = []
+        self._supervisors: list[asyncio.Task] = []
+
+    def client(self) -> AsyncOpenAI:
+        """Client of the first healthy instance: the primary, unless it is being restarted."""
+        for instance in self.instances:
+            if instance.healthy:
+                return instance.client
+        return self.instances[0].client
+
+    def report_failure(self, client: AsyncOpenAI) -> None:
+        """A request failed: route the next ones elsewhere until the instance passes a check again."""
+        for instance in self.instances:
+            if instance.client is client:
+                instance.healthy = False
+
+    async def stream_chat(self, messages: list[dict], max_tokens: int = 512) -> AsyncStream[ChatCompletionChunk]:
+        """Streamed chat completion, retried once on another instance if the server cannot be reached."""
+        client = self.client()
+        try:
+            return await client.chat.completions.create(model="", messages=messages, stream=True, max_tokens=max_tokens)
+        except APIConnectionError:
+            self.report_failure(client)
+            if (fallback := self.client()) is client:
+                raise
+            print("[AUDIO] Audio server unreachable, retrying on the standby")
+            return await fallback.chat.completions.create(
+                model="", messages=messages, stream=True, max_tokens=max_tokens
+            )
+
+    async def _start(self, instance: AudioInstance) -> None:
+        print(f"Waiting for {AUDIO_SERVER_EXECUTABLE} ({instance.name}) to start...")
+        with self.timings.phase(f"audio {instance.name} healthy"):
+            process = await start_runtime(
+                f"llama-liquid-audio-server ({instance.name})",
+                audio_server_command(instance.port, self.threads, self.host),
+                instance.port,
+                health_url=f"http://{self.host}:{instance.port}/health",
+                # The custom runner may not provide the health endpoint
+                ready_on_listening=True,
+            )
+        try:
+            with self.timings.phase(f"audio {instance.name} warmup"):
+                await warmup_audio(instance.client)
+        except BaseException:
+            await process.terminate()
+            raise
+        instance.process = process
+
+    async def __aenter__(self) -> "AudioRuntime":
+        primary = AudioInstance(name="primary", host=self.host, port=self.port)
+        self.instances = [primary]
+        managed = []
+        if self.spawn and not is_port_in_use(self.port, self.host):
+            managed.append(primary)
+        else:
+            print(f"Using the audio server on port {self.port}")
+        if self.spawn and self.standby:
+            standby = AudioInstance(name="standby", host=self.host, port=find_available_port(self.port + 1))
+            self.instances.append(standby)
+            managed.append(standby)
+
+        # Instances start concurrently, and none is left running on failure
+        tasks = [asyncio.create_task(self._start(instance)) for instance in managed]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await self._terminate()
+            raise
+
+        if primary not in managed:
+            try:
+                with self.timings.phase("audio warmup"):
+                    await warmup_audio(primary.client)
+            except Exception as e:
+                # External server, it may be started later
+                print(f"Audio server warmup failed: {e}")
+
+        self._supervisors = [asyncio.create_task(self._supervise(instance)) for instance in self.instances]
+        return self
+
+    async def _terminate(self) -> None:
+        for instance in self.instances:
+            if instance.process is not None:
+                await instance.process.terminate()
+
+    async def __aexit__(self, *exc) -> None:
+        for task in self._supervisors:
+            task.cancel()
+        await asyncio.gather(*self._supervisors, return_exceptions=True)
+        await self._terminate()
+
+    async def _is_alive(self, instance: AudioInstance) -> bool:
+        try:
+            async with httpx.AsyncClient() as client:
+                r = await client.get(f"http://{self.host}:{instance.port}/health", timeout=2.0)
+        except httpx.HTTPError:
+            return False
+        # The custom runner may not provide the health endpoint, a 404 still shows it responds
+        return r.status_code < 500
+
+    async def _supervise(self, instance: AudioInstance) -> None:
+        backoff = self.min_backoff
+        while True:
+            if instance.process is not None and not instance.process.exited:
+                # Wait for the next check, waking up right away if the process exits
+                with suppress(TimeoutError):
+                    await asyncio.wait_for(instance.process.wait_exited(), self.health_interval)
+            else:
+                await asyncio.sleep(self.health_interval)
+
+            exited = instance.process is not None and instance.process.exited
+            if not exited and await self._is_alive(instance):
+                if not instance.healthy:
+                    print(f"[AUDIO] Audio server ({instance.name}) is back")
+                instance.healthy = True
+                instance.failures = 0
+                backoff = self.min_backoff
+                continue
+
+            instance.failures += 1
+            if not exited and instance.failures < self.max_failures:
+                continue
+            if instance.healthy:
+                print(f"[AUDIO] Audio server ({instance.name}) is down")
+            instance.healthy = False
+            if instance.process is None:
+                continue
+
+            await instance.process.terminate()
+            try:
+                await self._start(instance)
+            except Exception as e:
+                print(f"[AUDIO] Failed to restart the audio server ({instance.name}), next try in {backoff:.0f}s: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(2 * backoff, self.max_backoff)
+                continue
+            print(f"[AUDIO] Audio server ({instance.name}) restarted")
+            instance.healthy = True
+            instance.failures = 0
+            backoff = self.min_backoff
@@ -0,0 +1,151 @@
+"""Binary framing of audio over the /ws-audio WebSocket.
+
+Each binary frame is a small fixed header followed by the raw payload:
+
+    offset  size  field
+    0       1     kind (see `AudioKind`)
+    1       1     channels
+    2       2     bits per sample
+    4       4     sample rate (Hz)
+    8       ...   payload
+
+All fields are little-endian. The same layout is parsed in `static/script.js`.
+"""
+
+import asyncio
+import base64
+import struct
+from dataclasses import dataclass
+from enum import IntEnum
+
+from fastapi import WebSocket
+
+from src.audio_codec import OpusStreamEncoder, pack_opus_packets
+
+AUDIO_HEADER = struct.Struct("<BBHI")
+
+TTS_SAMPLE_RATE = 24000
+
+# Duration of the outgoing audio frames, whatever the size of the chunks from the audio server
+FRAME_MS = 40
+
+# A client not reading a single frame in this time is considered stalled
+SEND_TIMEOUT = 5.0
+
+_FLOAT32_BYTES = 4
+
+
+class AudioKind(IntEnum):
+    # Complete WAV file, driver audio sent for ASR
+    WAV = 1
+    # Raw mono float32 PCM, synthesized speech
+    PCM_F32 = 2
+    # Length-prefixed Opus packets, either direction (see `src.audio_codec`)
+    OPUS = 3
+    # Raw mono int16 PCM, driver audio streamed while speaking (see `src.streaming_asr`)
+    PCM_S16 = 4
+
+
+@dataclass(frozen=True, slots=True)
+class AudioFrameHeader:
+    kind: AudioKind
+    channels: int
+    bits_per_sample: int
+    sample_rate: int
+
+
+def pack_audio_frame(
+    kind: AudioKind,
+    payload: bytes,
+    sample_rate: int,
+    channels: int = 1,
+    bits_per_sample: int = 32,
+) -> bytes:
+    return AUDIO_HEADER.pack(kind, channels, bits_per_sample, sample_rate) + payload
+
+
+def unpack_audio_frame(frame: bytes) -> tuple[AudioFrameHeader, memoryview]:
+    if len(frame) < AUDIO_HEADER.size:
+        raise ValueError(f"Audio frame too short: {len(frame)} bytes")
+
+    kind, channels, bits_per_sample, sample_rate = AUDIO_HEADER.unpack_from(frame)
+    header = AudioFrameHeader(
+        kind=AudioKind(kind),
+        channels=channels,
+        bits_per_sample=bits_per_sample,
+        sample_rate=sample_rate,
+    )
+    return header, memoryview(frame)[AUDIO_HEADER.size :]
+
+
+class ClientStalled(Exception):
+    """The client did not read the audio sent to it in time."""
+
+
+class TTSAudioEncoder:
+    """Wrap TTS chunks from the audio server for one client, in the negotiated format.
+
+    The audio server streams base64 float32 PCM in chunks of varying size. They are
+    coalesced into frames of `frame_ms`, so that the number of messages (and the cost of
+    sending them) is a fixed rate per second of audio:
+    - JSON clients get each frame base64 encoded,
+    - binary clients get it as PCM or as Opus packets.
+    """
+
+    def __init__(self, binary: bool, codec: str = "pcm", frame_ms: int = FRAME_MS):
+        self.binary = binary
+        self._opus = OpusStreamEncoder(TTS_SAMPLE_RATE) if binary and codec == "opus" else None
+        self._frame_bytes = TTS_SAMPLE_RATE * frame_ms // 1000 * _FLOAT32_BYTES
+        self._pending = bytearray()
+
+    def encode(self, chunk_b64: str) -> list[bytes | dict]:
+        self._pending += base64.b64decode(chunk_b64)
+        messages = []
+        while len(self._pending) >= self._frame_bytes:
+            messages += self._frame(bytes(self._pending[: self._frame_bytes]))
+            del self._pending[: self._frame_bytes]
+        return messages
+
+    def flush(self) -> list[bytes | dict]:
+        """Last partial frame, at the end of the stream."""
+        messages = self._frame(bytes(self._pending)) if self._pending else []
+        self._pending.clear()
+        if self._opus is not None:
+            messages += self._opus_frames(self._opus.flush())
+        return messages
+
+    def _frame(self, pcm: bytes) -> list[bytes | dict]:
+        if not self.binary:
+            return [{"type": "audio", "data": base64.b64encode(pcm).decode("utf-8"), "sample_rate": TTS_SAMPLE_RATE}]
+        if self._opus is None:
+            return [pack_audio_frame(AudioKind.PCM_F32, pcm, TTS_SAMPLE_RATE)]
+        return self._opus_frames(self._opus.encode(pcm))
+
+    @staticmethod
+    def _opus_frames(packets: list[bytes]) -> list[bytes | dict]:
+        if not packets:
+            return []
+        return [pack_audio_frame(AudioKind.OPUS, pack_opus_packets(packets), TTS_SAMPLE_RATE, bits_per_sample=0)]
+
+
+async def send_audio_message(websocket: WebSocket, message: bytes | dict, timeout: float | None = None) -> None:
+    """Send a message, raising `ClientStalled` if it is not written within `timeout`.
+
+    The send waits while the buffers to the client are full, which is the backpressure
+    on the stages producing the audio.
+    """
+    try:
+        async with asyncio.timeout(timeout):
+            if isinstance(message, bytes):
+                await websocket.send_bytes(message)
+            else:
+                await websocket.send_json(message)
+    except TimeoutError:
+        raise ClientStalled(f"Client did not read for {timeout}s") from None
+
+
+def is_client_stalled(error: BaseException) -> bool:
+    """Whether the error, possibly grouped by a task group, comes from a stalled client."""
+    if isinstance(error, BaseExceptionGroup):
+        return error.subgroup(ClientStalled) is not None
+    return isinstance(error, ClientStalled)
@@ -12,34 +12,33 @@ def create_checklist_router(manager: ConnectionManager) -> APIRouter:
     """Create and configure the checklist testing router."""
 
     @router.get("/checklist/quick-check")
-    async def quick_check():
+    async def quick_check(cockpit: str | None = None):
         """
         Quick system check - tests a few basic functions:
         - Open and close front-right window
         - Set climate temperature
         - Get system state
         """
-        if not manager.active_connections:
+        ws = manager.resolve(cockpit)
+        if ws is None:
             return JSONResponse(
                 status_code=503,
                 content={"status": "error", "message": "No active cockpit connections"},
             )
-
-        ws = manager.active_connections[0]
         results = []
 
         try:
-            # Test 1: Open front-right window
-            results.append(
-                {
-                    "test": "Open front-right window",
-                    "result": await manager.send_rpc_request(ws, "carWindows.set", {"id": "fr", "open": True}),
-                }
+            # Test 1: Open front-right window, and check its state in the same round trip
+            opened, window_state = await manager.send_rpc_batch(
+                ws,
+                [
+                    ("carWindows.set", {"id": "fr", "open": True}),
+                    ("carWindows.get", {"id": "fr"}),
+                ],
             )
-            await asyncio.sleep(0.5)
+            results.append({"test": "Open front-right window", "result": opened})
 
             # Test 2: Check window state
-            window_state = await manager.send_rpc_request(ws, "carWindows.get", {"id": "fr"})
             results.append(
                 {
                     "test": "Verify window opened",
@@ -48,26 +47,21 @@ def create_checklist_router(manager: ConnectionManager) -> APIRouter:
                 }
             )
 
-            # Test 3: Close window
-            results.append(
-                {
-                    "test": "Close front-right window",
-                    "result": await manager.send_rpc_request(ws, "carWindows.set", {"id": "fr", "open": False}),
-                }
+            # Test 3: Close window, then set and verify climate temperature
+            closed, target_set, climate_state = await manager.send_rpc_batch(
+                ws,
+                [
+                    ("carWindows.set", {"id": "fr", "open": False}),
+                    ("climate.setTarget", {"temperature": 22}),
+                    ("climate.get", {}),
+                ],
             )
-            await asyncio.sleep(0.5)
+            results.append({"test": "Close front-right window", "result": closed})
 
             # Test 4: Set climate temperature
-            results.append(
-                {
-                    "test": "Set temperature to 22°C",
-                    "result": await manager.send_rpc_request(ws, "climate.setTarget", {"temperature": 22}),
-                }
-            )
-            await asyncio.sleep(0.5)
+            results.append({"test": "Set temperature to 22°C", "result": target_set})
 
             # Test 5: Verify climate state
-            climate_state = await manager.send_rpc_request(ws, "climate.get", {})
             results.append(
                 {
                     "test": "Verify temperature set",
@@ -95,7 +89,7 @@ def create_checklist_router(manager: ConnectionManager) -> APIRouter:
             )
 
     @router.get("/checklist/full-system")
-    async def full_system_check():
+    async def full_system_check(cockpit: str | None = None):
         """
         Comprehensive system test - exercises all major functions:
         - All window controls
@@ -103,28 +97,27 @@ def create_checklist_router(manager: ConnectionManager) -> APIRouter:
         - Climate controls
         - Navigation controls
         """
-        if not manager.active_connections:
+        ws = manager.resolve(cockpit)
+        if ws is None:
             return JSONResponse(
                 status_code=503,
                 content={"status": "error", "message": "No active cockpit connections"},
             )
-
-        ws = manager.active_connections[0]
         results = []
 
         try:
             # === WINDOWS TESTS ===
-            # Test opening all windows
-            results.append(
-                {
-                    "test": "Open all windows",
-                    "result": await manager.send_rpc_request(ws, "carWindows.openAll", {}),
-                }
+            # Open all windows and read them back, in one round trip
+            opened, windows, closed, toggled = await manager.send_rpc_batch(
+                ws,
+                [
+                    ("carWindows.openAll", {}),
+                    ("carWindows.get", {}),
+                    ("carWindows.closeAll", {}),
+                    ("carWindows.toggle", {"id": "rl"}),
+                ],
             )
-            await asyncio.sleep(0.5)
-
-            # Verify all windows open
-            windows = await manager.send_rpc_request(ws, "carWindows.get", {})
+            results.append({"test": "Open all windows", "result": opened})
             results.append(
                 {
                     "test": "Verify all windows open",
@@ -132,28 +125,21 @@ def create_checklist_router(manager: ConnectionManager) -> APIRouter:
                     "passed": all(windows.values()),
                 }
             )
-
-            # Close all windows
-            results.append(
-                {
-                    "test": "Close all windows",
-                    "result": await manager.send_rpc_request(ws, "carWindows.closeAll", {}),
-                }
-            )
-            await asyncio.sleep(0.5)
-
-            # Test individual window toggle
-            results.append(
-                {
-                    "test": "Toggle rear-left window",
-                    "result": await manager.send_rpc_request(ws, "carWindows.toggle", {"id": "rl"}),
-                }
-            )
-            await asyncio.sleep(0.3)
+            results.append({"test": "Close all windows", "result": closed})
+            results.append({"test": "Toggle rear-left window", "result": toggled})
 
             # === MEDIA TESTS ===
-            # Get initial media state
-            media_state = await manager.send_rpc_request(ws, "media.get", {})
+            media_state, played, playing_state, next_track, previous_track, paused = await manager.send_rpc_batch(
+                ws,
+                [
+                    ("media.get", {}),
+                    ("media.play", {}),
+                    ("media.get", {}),
+                    ("media.next", {}),
+                    ("media.previous", {}),
+                    ("media.pause", {}),
+                ],
+            )
             results.append(
                 {
                     "test": "Get media state",
@@ -161,74 +147,32 @@ def create_checklist_router(manager: ConnectionManager) -> APIRouter:
                     "passed": "track" in media_state,
                 }
             )
-
-            # Play media
-            results.append(
-                {
-                    "test": "Play media",
-                    "result": await manager.send_rpc_request(ws, "media.play", {}),
-                }
-            )
-            await asyncio.sleep(0.5)
-
-            # Verify playing
-            media_state = await manager.send_rpc_request(ws, "media.get", {})
+            results.append({"test": "Play media", "result": played})
             results.append(
                 {
                     "test": "Verify media playing",
-                    "result": media_state.get("isPlaying"),
-                    "passed": media_state.get("isPlaying"),
-                }
-            )
-
-            # Next track
-            results.append(
-                {
-                    "test": "Next track",
-                    "result": await manager.send_rpc_request(ws, "media.next", {}),
-                }
-            )
-            await asyncio.sleep(0.3)
-
-            # Previous track
-            results.append(
-                {
-                    "test": "Previous track",
-                    "result": await manager.send_rpc_request(ws, "media.previous", {}),
+                    "result": playing_state.get("isPlaying"),
+                    "passed": playing_state.get("isPlaying"),
                 }
             )
-            await asyncio.sleep(0.3)
-
-            # Pause
-            results.append(
-                {
-                    "test": "Pause media",
-                    "result": await manager.send_rpc_request(ws, "media.pause", {}),
-                }
-            )
-            await asyncio.sleep(0.3)
+            results.append({"test": "Next track", "result": next_track})
+            results.append({"test": "Previous track", "result": previous_track})
+            results.append({"test": "Pause media", "result": paused})
 
             # === CLIMATE TESTS ===
-            # Set target temperature
-            results.append(
-                {
-                    "test": "Set temperature to 24°C",
-                    "result": await manager.send_rpc_request(ws, "climate.setTarget", {"temperature": 24}),
-                }
+            # Set, verify, and reset to defaults
+            target_set, fan_set, climate, *_ = await manager.send_rpc_batch(
+                ws,
+                [
+                    ("climate.setTarget", {"temperature": 24}),
+                    ("climate.setFan", {"level": 3}),
+                    ("climate.get", {}),
+                    ("climate.setTarget", {"temperature": 23}),
+                    ("climate.setFan", {"level": 2}),
+                ],
             )
-            await asyncio.sleep(0.3)
-
-            # Set fan level
-            results.append(
-                {
-                    "test": "Set fan to level 3",
-                    "result": await manager.send_rpc_request(ws, "climate.setFan", {"level": 3}),
-                }
-            )
-            await asyncio.sleep(0.3)
-
-            # Verify climate state
-            climate = await manager.send_rpc_request(ws, "climate.get", {})
+            results.append({"test": "Set temperature to 24°C", "result": target_set})
+            results.append({"test": "Set fan to level 3", "result": fan_set})
             results.append(
                 {
                     "test": "Verify climate settings",
@@ -237,22 +181,16 @@ def create_checklist_router(manager: ConnectionManager) -> APIRouter:
                 }
             )
 
-            # Reset to defaults
-            await manager.send_rpc_request(ws, "climate.setTarget", {"temperature": 23})
-            await manager.send_rpc_request(ws, "climate.setFan", {"level": 2})
-
             # === NAVIGATION TESTS ===
-            # Set destination
-            results.append(
-                {
-                    "test": "Set navigation destination",
-                    "result": await manager.send_rpc_request(ws, "navigation.setDestination", {}),
-                }
+            destination_set, nav_state, started = await manager.send_rpc_batch(
+                ws,
+                [
+                    ("navigation.setDestination", {}),
+                    ("navigation.get", {}),
+                    ("navigation.start", {}),
+                ],
             )
-            await asyncio.sleep(0.3)
-
-            # Get navigation state
-            nav_state = await manager.send_rpc_request(ws, "navigation.get", {})
+            results.append({"test": "Set navigation destination", "result": destination_set})
             results.append(
                 {
                     "test": "Verify route generated",
@@ -260,33 +198,20 @@ def create_checklist_router(manager: ConnectionManager) -> APIRouter:
                     "passed": nav_state.get("totalSteps", 0) > 0,
                 }
             )
+            results.append({"test": "Start navigation", "result": started})
 
-            # Start navigation
-            results.append(
-                {
-                    "test": "Start navigation",
-                    "result": await manager.send_rpc_request(ws, "navigation.start", {}),
-                }
-            )
+            # Let the guidance run for a bit
             await asyncio.sleep(1.0)
 
-            # Pause navigation
-            results.append(
-                {
-                    "test": "Pause navigation",
-                    "result": await manager.send_rpc_request(ws, "navigation.pause", {}),
-                }
-            )
-            await asyncio.sleep(0.3)
-
-            # Clear navigation
-            results.append(
-                {
-                    "test": "Clear navigation",
-                    "result": await manager.send_rpc_request(ws, "navigation.clear", {}),
-                }
+            paused, cleared = await manager.send_rpc_batch(
+                ws,
+                [
+                    ("navigation.pause", {}),
+                    ("navigation.clear", {}),
+                ],
             )
-            await asyncio.sleep(0.3)
+            results.append({"test": "Pause navigation", "result": paused})
+            results.append({"test": "Clear navigation", "result": cleared})
 
             # === FINAL STATE CHECK ===
             final_state = await manager.send_rpc_request(ws, "system.getState", {})
@@ -0,0 +1,74 @@
+import asyncio
+import copy
+from typing import Any
+
+# Read-only functions answered from the mirror: method -> state section (None for the whole state)
+MIRRORED_READS: dict[str, str | None] = {
+    "carWindows.get": "windows",
+    "media.get": "media",
+    "climate.get": "climate",
+    "navigation.get": "navigation",
+    "audio.get": "audio",
+    "system.getState": None,
+}
+
+# Returned by `CockpitState.read` when the call cannot be answered from the mirror
+NOT_MIRRORED = object()
+
+
+class CockpitState:
+    """Server-side mirror of the state of one cockpit.
+
+    The frontend sends a full `state.snapshot` when it connects, then a `state.update`
+    notification with the changed fields after every change. Each update bumps the
+    version, and the frontend flushes pending updates before answering an RPC. RPC
+    responses carry the version once the call is applied, and the connection manager
+    waits for the mirror to reach it, so the mirror is up to date as soon as a write
+    request returns.
+    """
+
+    def __init__(self):
+        self.state: dict[str, dict] = {}
+        self.version = 0
+        self.synced = False
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def apply_snapshot(self, version: int, state: dict) -> None:
+        self.state = state
+        self.version = version
+        self.synced = True
+        self._notify()
+
+    def apply_update(self, version: int, diff: dict) -> None:
+        """Merge the changed fields, `diff` is {section: {field: value}}."""
+        for section, fields in diff.items():
+            self.state.setdefault(section, {}).update(fields)
+        self.version = version
+        self._notify()
+
+    def read(self, method: str, params: dict | None = None) -> Any:
+        if not self.synced or method not in MIRRORED_READS:
+            return NOT_MIRRORED
+
+        section = MIRRORED_READS[method]
+        if section is None:
+            return copy.deepcopy(self.state)
+
+        value = self.state.get(section)
+        if value is None:
+            return NOT_MIRRORED
+        if method == "carWindows.get" and params and params.get("id"):
+            window = value.get(params["id"])
+            # Unknown ids are left to the cockpit, which answers with the error
+            return NOT_MIRRORED if window is None else copy.deepcopy(window)
+        return copy.deepcopy(value)
+
+    async def wait_for_version(self, version: int, timeout: float = 2.0) -> None:
+        """Wait until the mirror has caught up with `version`, as acknowledged in an RPC response."""
+        async with asyncio.timeout(timeout):
+            while self.version < version:
+                await self._changed.wait()
@@ -1,41 +1,100 @@
 import asyncio
+import itertools
 import json
 from typing import Any
 
 from fastapi import WebSocket
 
+from src.cockpit_state import NOT_MIRRORED, CockpitState
+
+
+class RPCError(Exception):
+    """Error returned by a cockpit, or no response in time."""
+
 
 class ConnectionManager:
-    def __init__(self):
+    def __init__(self, timeout: float = 2.0):
+        self.timeout = timeout
         self.active_connections: list[WebSocket] = []
+        # Connected cockpits by name, in connection order
+        self.cockpits: dict[str, WebSocket] = {}
+        # Server-side mirror of each cockpit state, to answer reads without a round trip
+        self.states: dict[WebSocket, CockpitState] = {}
         # Track pending requests: request_id -> Future
         self.pending_requests: dict[int, asyncio.Future] = {}
+        # Latest state version acknowledged in an RPC response, per cockpit
+        self.acked_versions: dict[WebSocket, int] = {}
+        # Monotonic ids, unique for the lifetime of the server
+        self._request_ids = itertools.count(1)
+        self._cockpit_ids = itertools.count(1)
 
-    async def connect(self, websocket: WebSocket):
+    async def connect(self, websocket: WebSocket, name: str | None = None) -> str:
         await websocket.accept()
+        if not name or name in self.cockpits:
+            name = f"cockpit-{next(self._cockpit_ids)}"
         self.active_connections.append(websocket)
+        self.cockpits[name] = websocket
+        self.states[websocket] = CockpitState()
+        print(f"Cockpit connected: {name}")
+        return name
 
     def disconnect(self, websocket: WebSocket):
         if websocket in self.active_connections:
             self.active_connections.remove(websocket)
+        self.states.pop(websocket, None)
+        self.acked_versions.pop(websocket, None)
+        for name, ws in list(self.cockpits.items()):
+            if ws is websocket:
+                del self.cockpits[name]
+                print(f"Cockpit disconnected: {name}")
+
+    def resolve(self, cockpit: str | None = None) -> WebSocket | None:
+        """Websocket of the given cockpit, or of the first connected one if not specified."""
+        if cockpit is not None:
+            return self.cockpits.get(cockpit)
+        return self.active_connections[0] if self.active_connections else None
+
+    def state(self, cockpit: str | None = None) -> CockpitState | None:
+        """State mirror of the given cockpit, or of the first connected one if not specified."""
+        websocket = self.resolve(cockpit)
+        return None if websocket is None else self.states.get(websocket)
 
-    async def send_message(self, websocket: WebSocket, message: dict):
+    async def send_message(self, websocket: WebSocket, message: dict | list):
         await websocket.send_text(json.dumps(message))
 
+    def _resolve_response(self, websocket: WebSocket, response: dict) -> None:
+        if isinstance(response.get("stateVersion"), int):
+            version = max(response["stateVersion"], self.acked_versions.get(websocket, 0))
+            self.acked_versions[websocket] = version
+        future = self.pending_requests.pop(response["id"])
+        if future.done():
+            return
+        if "result" in response:
+            future.set_result(response["result"])
+        elif "error" in response:
+            future.set_exception(RPCError(f"RPC Error: {response['error']}"))
+        else:
+            future.set_result(None)
+
     async def handle_websocket_message(self, websocket: WebSocket, data: str):
         """Handle incoming WebSocket message - dispatch to appropriate handler"""
         try:
             message = json.loads(data)
 
-            # Check if this is a response to a pending request
-            if "id" in message and message["id"] in self.pending_requests:
-                future = self.pending_requests.pop(message["id"])
-                if "result" in message:
-                    future.set_result(message["result"])
-                elif "error" in message:
-                    future.set_exception(Exception(f"RPC Error: {message['error']}"))
-                else:
-                    future.set_result(None)
+            # Responses to a batch request come back as a single array
+            responses = message if isinstance(message, list) else [message]
+            if responses and all(isinstance(r, dict) and r.get("id") in self.pending_requests for r in responses):
+                for response in responses:
+                    self._resolve_response(websocket, response)
+            elif isinstance(message, dict) and message.get("method") in ("state.snapshot", "state.update"):
+                # State notifications from the cockpit
+                state = self.states.get(websocket)
+                if state is not None:
+                    params = message.get("params", {})
+                    if message["method"] == "state.snapshot":
+                        state.apply_snapshot(params["version"], params["state"])
+                    else:
+                        state.apply_update(params["version"], params["diff"])
             else:
                 # This is a regular message, echo it back
                 await websocket.send_text(data)
@@ -48,41 +107,118 @@ class ConnectionManager:
             }
             await self.send_message(websocket, error_response)
 
-    async def send_rpc_request(
-        self,
-        websocket: WebSocket,
-        method: str,
-        params: dict | None = None,
-        request_id: int | None = None,
-    ) -> Any:
-        """Send a JSON-RPC request and wait for response"""
-        if params is None:
-            params = {}
+    def _new_request(
+        self, method: str, params: dict | None, request_id: int | None = None
+    ) -> tuple[dict, asyncio.Future]:
         if request_id is None:
-            # Generate a unique request ID
-            request_id = id(params) + int(asyncio.get_event_loop().time() * 1000000)
+            request_id = next(self._request_ids)
 
         # Create a Future to wait for the response
-        future = asyncio.Future()
+        future = asyncio.get_running_loop().create_future()
         self.pending_requests[request_id] = future
 
         message = {
             "jsonrpc": "2.0",
             "id": request_id,
             "method": method,
-            "params": params,
+            "params": params or {},
         }
+        return message, future
 
+    async def _wait(self, messages: list[dict], futures: list[asyncio.Future], return_exceptions: bool) -> list[Any]:
         try:
-            await self.send_message(websocket, message)
-            # Wait for the response with timeout
-            result = await asyncio.wait_for(future, timeout=2.0)
-            return result
-        except asyncio.TimeoutError:
-            # Clean up the pending request
-            self.pending_requests.pop(request_id, None)
-            raise Exception("Request timeout")
-        except Exception as e:
-            # Clean up the pending request
-            self.pending_requests.pop(request_id, None)
-            raise e
+            async with asyncio.timeout(self.timeout):
+                return await asyncio.gather(*futures, return_exceptions=return_exceptions)
+        except TimeoutError:
+            raise RPCError("Request timeout") from None
+        finally:
+            # Clean up the pending requests
+            for message in messages:
+                self.pending_requests.pop(message["id"], None)
+
+    async def _sync_mirror(self, websocket: WebSocket) -> None:
+        """Wait until the state mirror includes the writes acknowledged by the cockpit."""
+        state = self.states.get(websocket)
+        version = self.acked_versions.get(websocket)
+        if state is None or version is None or state.version >= version:
+            return
+        try:
+            await state.wait_for_version(version, timeout=self.timeout)
+        except TimeoutError:
+            # Reads go to the cockpit until the next snapshot
+            print(f"State mirror stuck at version {state.version}, expected {version}")
+            state.synced = False
+
+    async def send_rpc_request(
+        self,
+        websocket: WebSocket,
+        method: str,
+        params: dict | None = None,
+        request_id: int | None = None,
+        use_mirror: bool = True,
+    ) -> Any:
+        """Send a JSON-RPC request and wait for response
+
+        Reads of the cockpit state are answered from the server-side mirror when it is
+        in sync, without any round trip. Set `use_mirror=False` to always ask the cockpit.
+        Other calls return once the mirror includes their changes.
+        """
+        if use_mirror and (state := self.states.get(websocket)) is not None:
+            result = state.read(method, params)
+            if result is not NOT_MIRRORED:
+                return result
+
+        message, future = self._new_request(method, params, request_id)
+        await self.send_message(websocket, message)
+        (result,) = await self._wait([message], [future], return_exceptions=False)
+        # A read of the mirror right after a write sees it
+        await self._sync_mirror(websocket)
+        return result
+
+    async def send_rpc_batch(
+        self,
+        websocket: WebSocket,
+        calls: list[tuple[str, dict | None]],
+        return_exceptions: bool = False,
+    ) -> list[Any]:
+        """Send several JSON-RPC requests in a single batch message, one round trip.
+
+        The cockpit executes them in order. Results are returned in the same order, as
+        with `asyncio.gather`, errors are raised unless `return_exceptions` is set.
+        """
+        requests = [self._new_request(method, params) for method, params in calls]
+        messages = [message for message, _ in requests]
+        await self.send_message(websocket, messages)
+        results = await self._wait(messages, [future for _, future in requests], return_exceptions)
+        await self._sync_mirror(websocket)
+        return results
+
+    async def call(self, method: str, params: dict | None = None, cockpit: str | None = None) -> Any:
+        """Send a JSON-RPC request to the given cockpit, or the first connected one."""
+        websocket = self.resolve(cockpit)
+        if websocket is None:
+            raise RPCError(f"Cockpit not connected: {cockpit or 'any'}")
+        return await self.send_rpc_request(websocket, method, params)
+
+    async def batch(
+        self,
+        calls: list[tuple[str, dict | None]],
+        cockpit: str | None = None,
+        return_exceptions: bool = False,
+    ) -> list[Any]:
+        websocket = self.resolve(cockpit)
+        if websocket is None:
+            raise RPCError(f"Cockpit not connected: {cockpit or 'any'}")
+        return await self.send_rpc_batch(websocket, calls, return_exceptions)
+
+    async def broadcast(self, method: str, params: dict | None = None) -> dict[str, Any]:
+        """Send a JSON-RPC request to all cockpits concurrently.
+
+        Returns the result for each cockpit name, or the exception if it failed.
+        """
+        names = list(self.cockpits)
+        results = await asyncio.gather(
+            *(self.send_rpc_request(self.cockpits[name], method, params) for name in names),
+            return_exceptions=True,
+        )
+        return dict(zip(names, results))
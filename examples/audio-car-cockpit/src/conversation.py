@@ -0,0 +1,118 @@
+import time
+from collections import OrderedDict
+
+# Rough estimate for English text and tool calls, when llama-server did not report the token counts
+_CHARS_PER_TOKEN = 3
+
+
+def _estimate_tokens(messages: list[dict]) -> int:
+    return sum(len(message["content"]) for message in messages) // _CHARS_PER_TOKEN + 1
+
+
+class Conversation:
+    """Past exchanges of a /ws-audio session, for follow-ups like "a bit warmer".
+
+    Each exchange is the user message, the raw model completion (tool call included) and
+    the tool result. The history only grows at the end, so that the prompt of a turn
+    starts with the prompt and completion of the previous one: on the slot of the session
+    (see `src.runtime_pool`), llama-server only evaluates the tool result and the new
+    user message.
+
+    Once the context of the last turn exceeds `max_tokens`, the oldest exchanges are
+    dropped down to `truncate_to` of it, so that the prefix changes (and the whole history
+    is evaluated again) only once in a while. After `max_idle_s` without a turn, the
+    conversation starts over.
+    """
+
+    def __init__(self, max_tokens: int = 3072, max_idle_s: float = 300.0, truncate_to: float = 0.75):
+        self.max_tokens = max_tokens
+        self.max_idle_s = max_idle_s
+        self.truncate_to = truncate_to
+
+        self.exchanges: list[list[dict]] = []
+        # Tokens of each exchange, from the growth of the context when llama-server reported it
+        self._sizes: list[int] = []
+        # Tokens in the context after the last turn, system prompt included
+        self.tokens = 0
+        self._last_turn = time.monotonic()
+
+    def messages(self) -> list[dict]:
+        """History to put between the system prompt and the next user message."""
+        if self.exchanges and self.idle():
+            print("[AUDIO] Conversation idle, starting over")
+            self.clear()
+        return [message for exchange in self.exchanges for message in exchange]
+
+    def idle(self) -> bool:
+        return time.monotonic() - self._last_turn > self.max_idle_s
+
+    def clear(self) -> None:
+        self.exchanges = []
+        self._sizes = []
+        self.tokens = 0
+
+    def add(self, user: str, assistant: str, tool_result: str | None = None, usage: dict | None = None) -> None:
+        """Append a completed turn, `usage` being the token counts reported by llama-server, if any."""
+        exchange = [
+            {"role": "user", "content": user},
+            {"role": "assistant", "content": assistant},
+        ]
+        if tool_result is not None:
+            exchange.append({"role": "tool", "content": tool_result})
+        size = _estimate_tokens(exchange)
+        if usage is not None and "tokens_evaluated" in usage:
+            tokens = usage["tokens_evaluated"] + usage.get("tokens_predicted", 0)
+            if self.exchanges:
+                # The first turn grows the context by the system prompt as well
+                size = max(tokens - self.tokens, size)
+            self.tokens = tokens
+        else:
+            self.tokens += size
+
+        self.exchanges.append(exchange)
+        self._sizes.append(size)
+        self._last_turn = time.monotonic()
+
+        if self.tokens > self.max_tokens:
+            self._truncate()
+
+    def _truncate(self) -> None:
+        target = self.max_tokens * self.truncate_to
+        dropped = 0
+        # The last exchange is kept, it is the one follow-ups refer to
+        while self.tokens > target and len(self.exchanges) > 1:
+            del self.exchanges[0]
+            self.tokens -= self._sizes.pop(0)
+            dropped += 1
+        print(f"[AUDIO] Conversation over {self.max_tokens} tokens, {dropped} oldest exchange(s) dropped")
+
+
+class Conversations:
+    """Conversations of the voice sessions, kept across /ws-audio connections.
+
+    The web UI opens a connection per utterance, and names its session with an id in its
+    "config" message, so that the next utterance continues the same conversation. Sessions
+    idle for `max_idle_s` are dropped, and the least recently used ones beyond
+    `max_sessions`.
+    """
+
+    def __init__(self, max_tokens: int = 3072, max_idle_s: float = 300.0, max_sessions: int = 256):
+        self.max_tokens = max_tokens
+        self.max_idle_s = max_idle_s
+        self.max_sessions = max_sessions
+        self._conversations: OrderedDict[str, Conversation] = OrderedDict()
+
+    def get(self, session: str) -> Conversation:
+        """Conversation of a session, started if new or expired."""
+        for name, conversation in list(self._conversations.items()):
+            if conversation.idle():
+                del self._conversations[name]
+
+        conversation = self._conversations.get(session)
+        if conversation is None:
+            conversation = Conversation(max_tokens=self.max_tokens, max_idle_s=self.max_idle_s)
+            self._conversations[session] = conversation
+        self._conversations.move_to_end(session)
+        while len(self._conversations) > self.max_sessions:
+            self._conversations.popitem(last=False)
+        return conversation
@@ -0,0 +1,154 @@
+import re
+from collections import OrderedDict
+from dataclasses import dataclass
+
+_PUNCTUATION = re.compile(r"[^\w\s.]|\.(?!\d)")
+
+# Words that do not change the meaning of a cockpit command
+FILLER_WORDS = frozenset(
+    "a an the please can could would will you me my for i want like to just now hey ok okay some".split()
+)
+
+
+# Words deciding the arguments of a call: a command differing by one of them is another command,
+# however similar the rest. Values are the canonical forms, "opened" meaning the same as "open"
+_STATE_WORDS = {
+    "on": "on",
+    "off": "off",
+    "open": "open",
+    "opened": "open",
+    "opening": "open",
+    "close": "close",
+    "closed": "close",
+    "closing": "close",
+    "shut": "close",
+    "up": "up",
+    "down": "down",
+}
+_ZONE_WORDS = frozenset("front rear back left right driver passenger all every both".split())
+_NUMBER_WORDS = frozenset("zero one two three four five six seven eight nine ten half".split())
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def key_words(words: tuple[str, ...]) -> tuple[str, ...]:
+    """Numbers, on/off and open/close words and zones of a command, sorted."""
+    keys = []
+    for word in words:
+        if word in _STATE_WORDS:
+            keys.append(_STATE_WORDS[word])
+        elif word in _ZONE_WORDS or word in _NUMBER_WORDS or _NUMBER.fullmatch(word):
+            keys.append(word)
+    return tuple(sorted(keys))
+
+
+def normalize(text: str) -> str:
+    """Lowercase, without punctuation nor extra whitespace: "Open the windows!" -> "open the windows"."""
+    return " ".join(_PUNCTUATION.sub(" ", text.replace("<|im_end|>", "").lower()).split())
+
+
+def _same_word(a: str, b: str) -> bool:
+    """Equal, or inflections of one another: "window" and "windows"."""
+    if a == b:
+        return True
+    short, long = sorted((a, b), key=len)
+    return len(short) >= 4 and long.startswith(short) and len(long) - len(short) <= 2
+
+
+@dataclass(kw_only=True, frozen=True)
+class CachedToolCall:
+    # Normalized utterance it was learned from
+    key: str
+    tool_call: str
+    response: str
+
+
+@dataclass(kw_only=True)
+class _Entry:
+    cached: CachedToolCall
+    words: tuple[str, ...]
+    key_words: tuple[str, ...]
+
+
+class ToolCallCache:
+    """Fast path answering repeated cockpit commands without the tool calling model.
+
+    Two levels, on utterances whose tool call ran successfully on the cockpit:
+    - exact match of the normalized transcript,
+    - nearest neighbour by similarity of the content words (Dice coefficient, filler
+      words ignored, inflections matched), above `threshold`, among the utterances with
+      the same numbers, on/off and open/close words and zones: "21"/"22", "on"/"off" or
+      "left"/"right" always miss, however long the rest of the command.
+
+    Holds at most `max_entries`, least recently used first out.
+    """
+
+    def __init__(self, max_entries: int = 256, threshold: float = 0.85):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def _content_words(key: str) -> tuple[str, ...]:
+        return tuple(word for word in key.split() if word not in FILLER_WORDS)
+
+    @staticmethod
+    def _similarity(a: tuple[str, ...], b: tuple[str, ...]) -> float:
+        if not a or not b:
+            return 0.0
+        remaining = list(b)
+        matched = 0
+        for word in a:
+            for i, other in enumerate(remaining):
+                if _same_word(word, other):
+                    matched += 1
+                    del remaining[i]
+                    break
+        return 2 * matched / (len(a) + len(b))
+
+    def _nearest(self, key: str) -> str | None:
+        words = self._content_words(key)
+        keys = key_words(words)
+        best_key, best_similarity = None, self.threshold
+        for candidate_key, candidate in self._entries.items():
+            if candidate.key_words != keys:
+                continue
+            similarity = self._similarity(words, candidate.words)
+            if similarity >= best_similarity:
+                best_key, best_similarity = candidate_key, similarity
+        return best_key
+
+    def lookup(self, utterance: str) -> CachedToolCall | None:
+        key = normalize(utterance)
+        if key not in self._entries:
+            key = self._nearest(key) if key else None
+        if key is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return self._entries[key].cached
+
+    def learn(self, utterance: str, tool_call: str, response: str) -> None:
+        """Remember an utterance whose tool call succeeded."""
+        key = normalize(utterance)
+        if not key:
+            return
+        words = self._content_words(key)
+        self._entries[key] = _Entry(
+            cached=CachedToolCall(key=key, tool_call=tool_call, response=response),
+            words=words,
+            key_words=key_words(words),
+        )
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def forget(self, cached: CachedToolCall) -> None:
+        """Drop an entry whose tool call failed when replayed."""
+        self._entries.pop(cached.key, None)
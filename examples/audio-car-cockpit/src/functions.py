@@ -10,12 +10,13 @@ def create_functions_router(manager: ConnectionManager) -> APIRouter:
     """Create and configure the functions API router."""
 
     @router.get("/functions.json")
-    async def get_functions():
+    async def get_functions(cockpit: str | None = None):
         """
         Get all available cockpit functions in JSON format.
         Fetches definitions from the frontend via WebSocket.
         """
-        if not manager.active_connections:
+        ws = manager.resolve(cockpit)
+        if ws is None:
             return JSONResponse(
                 status_code=503,
                 content={
@@ -24,8 +25,6 @@ def create_functions_router(manager: ConnectionManager) -> APIRouter:
                 },
             )
 
-        ws = manager.active_connections[0]
-
         try:
             functions = await manager.send_rpc_request(ws, "system.getFunctions", {})
             return JSONResponse(content={"functions": functions})
@@ -36,7 +35,7 @@ def create_functions_router(manager: ConnectionManager) -> APIRouter:
             )
 
     @router.get("/debug/get-functions-matching/{query}")
-    async def debug_get_functions_matching(query: str):
+    async def debug_get_functions_matching(query: str, cockpit: str | None = None):
         """
         Debug endpoint: Search for functions matching a query string.
         Prints results to terminal and returns JSON response.
@@ -44,7 +43,8 @@ def create_functions_router(manager: ConnectionManager) -> APIRouter:
         Args:
             query: Search string to match against function names (case-insensitive)
         """
-        if not manager.active_connections:
+        ws = manager.resolve(cockpit)
+        if ws is None:
             print("\n[DEBUG] No active connections. Please open the UI in a browser first.\n")
             return JSONResponse(
                 status_code=503,
@@ -54,8 +54,6 @@ def create_functions_router(manager: ConnectionManager) -> APIRouter:
                 },
             )
 
-        ws = manager.active_connections[0]
-
         try:
             # Fetch all functions from the frontend
             all_functions = await manager.send_rpc_request(ws, "system.getFunctions", {})
@@ -1,17 +1,14 @@
 import ast
 import json
-import signal
-import subprocess
-from collections.abc import Generator
-from contextlib import contextmanager
 from dataclasses import dataclass
 from pathlib import Path
-from time import sleep
 from typing import AsyncGenerator, overload
 
 import httpx
 from httpx_retries import Retry, RetryTransport
 
+from src.runtime_process import RuntimeProcess, start_runtime
+from src.tool_grammar import tool_call_grammar
 from src.utils import find_available_port
 
 
@@ -54,12 +51,23 @@ def function_to_args(call_str: str) -> tuple[str, dict]:
     return func_name, args
 
 
-def spawn_embedding_runtime(
+# Context size of each parallel slot of llama-server, the system prompt alone takes about half of it
+# and the rest holds the conversation, see `src.conversation`
+CTX_SIZE_PER_SLOT = 4096
+
+
+async def spawn_embedding_runtime(
     file_name: str | Path,
-) -> tuple[subprocess.Popen, int]:
-    """Spawns the llama-server process."""
+    parallel: int = 1,
+    port: int | None = None,
+) -> RuntimeProcess:
+    """Spawns the llama-server process, and waits until it is healthy.
+
+    With `parallel` > 1, the server decodes several requests at once with continuous
+    batching, each slot keeping its own context (and KV cache) of `CTX_SIZE_PER_SLOT`.
+    """
 
-    port = find_available_port(preferred_port=8989)
+    port = port or find_available_port(preferred_port=8989)
     host = "127.0.0.1"
     executable = str((Path.cwd() / "llama-server").resolve())
 
@@ -69,82 +77,24 @@ def spawn_embedding_runtime(
         host,
         "--port",
         str(port),
-        "--log-disable",
         "--no-perf",
         "--n-gpu-layers",
         "9999",
         "--mlock",
         "--ctx-size",
-        "2048",
+        str(CTX_SIZE_PER_SLOT * parallel),
+        "--parallel",
+        str(parallel),
         # Special tokens output enabled
         "--special",
         "-hf",
         str(file_name),
     ]
 
-    try:
-        # Use Popen for non-blocking execution
-        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
-
-    except FileNotFoundError:
-        raise FileNotFoundError(f"{executable} command not found. Please ensure it is installed and in your PATH.")
-
-    # Wait for server to be ready
+    # Wait for server to be ready, logs are read to detect it early
     print(f"Waiting for {executable} to start, serving {file_name}...")
     # https://github.com/ggml-org/llama.cpp/tree/master/tools/server#api-endpoints
-    health_url = f"http://{host}:{port}/health"
-    _tries, _sleep = 300, 0.5
-    for _ in range(_tries):
-        try:
-            r = httpx.get(health_url, timeout=1.0)
-            if r.status_code == 200:
-                break
-        except httpx.HTTPError:
-            pass
-        sleep(_sleep)
-    else:
-        process.terminate()
-        stdout, stderr = process.communicate()
-        raise RuntimeError(
-            f"{executable} failed to become healthy after {_tries * _sleep:.1f}s.\n"
-            f"Stdout: {stdout.decode(errors='ignore')}\n"
-            f"Stderr: {stderr.decode(errors='ignore')}"
-        )
-
-    if process.poll() is not None:  # Process terminated prematurely
-        stdout, stderr = process.communicate()
-        raise RuntimeError(
-            f"{executable} failed to start. Return code: {process.returncode}\n"
-            f"Stdout: {stdout.decode(errors='ignore')}\n"
-            f"Stderr: {stderr.decode(errors='ignore')}"
-        )
-
-    print(f"`{executable}` running on port {port} (PID: {process.pid})")
-    return process, port
-
-
-@contextmanager
-def spawn_server(
-    file_name: str | Path,
-) -> Generator[tuple[subprocess.Popen, int], None, None]:
-    embedding_process, embedding_port = spawn_embedding_runtime(file_name)
-    try:
-        yield embedding_process, embedding_port
-    finally:
-        embedding_process.terminate()
-        try:
-            # Wait for graceful shutdown
-            embedding_process.wait(timeout=4)
-            print("llama-server terminated gracefully.")
-        except subprocess.TimeoutExpired:
-            try:
-                # One more chance
-                embedding_process.send_signal(signal.SIGTERM)
-                embedding_process.wait(timeout=4)
-            except subprocess.TimeoutExpired:
-                print("llama-server did not terminate in time, killing...")
-                embedding_process.kill()
-                embedding_process.wait()
+    return await start_runtime("llama-server", command, port, health_url=f"http://{host}:{port}/health")
 
 
 @dataclass(kw_only=True)
@@ -152,11 +102,14 @@ class ToolCallingRuntime:
     port: int
     host: str = "localhost"
     max_tokens: int = 4096
+    # Constrain decoding to the functions of the catalog and their arguments
+    grammar: bool = True
 
     def __post_init__(self):
         self.client = httpx.Client(transport=RetryTransport(retry=Retry(total=3, backoff_factor=0.1)))
+        self.aclient = httpx.AsyncClient(transport=RetryTransport(retry=Retry(total=3, backoff_factor=0.1)))
 
-        self.default_completion_params: dict[str, float | int | bool] = {
+        self.default_completion_params: dict[str, float | int | bool | str] = {
             "temperature": 0.0,
             "n_predict": 512,
         }
@@ -169,6 +122,10 @@ class ToolCallingRuntime:
         # Prepare as a string with a flat layout
         self.all_functions_no_indent: str = json.dumps(self.list_functions, indent=2, ensure_ascii=False)
 
+        if self.grammar:
+            # Hallucinated functions or arguments cannot be generated, see `src.tool_grammar`
+            self.default_completion_params["grammar"] = tool_call_grammar(self.all_functions_no_indent)
+
         _instructions = (
             """If you call a function, also output a brief message for the user. The message should be concise."""
         )
@@ -179,9 +136,10 @@ class ToolCallingRuntime:
 
 {_instructions}"""
 
-        self._last_messages: list[dict] = []
+        self.warmup()
 
-        # Warmup
+    def warmup(self) -> None:
+        """Load the weights and evaluate the system prompt, before the first real request."""
         print("Inference warming...", end=" ")
         _ = self.completion("Turn on the audio.")
         print("Done")
@@ -189,15 +147,19 @@ class ToolCallingRuntime:
     def __del__(self):
         self.client.close()
 
+    def _template_messages(self, content: str, history: list[dict] | None = None) -> dict:
+        return {
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                *(history or []),
+                {"role": "user", "content": content},
+            ]
+        }
+
     def _apply_template(self, content: str) -> str:
         response = self.client.post(
             f"http://{self.host}:{self.port}/apply-template",
-            json={
-                "messages": [
-                    {"role": "system", "content": self.system_prompt},
-                    {"role": "user", "content": content},
-                ]
-            },
+            json=self._template_messages(content),
             headers={"Content-Type": "application/json"},
             timeout=3.0,
         )
@@ -205,12 +167,28 @@ class ToolCallingRuntime:
         formatted_prompt: str = response.json().get("prompt")
         return formatted_prompt
 
-    def _completion(self, content: str) -> tuple[str | None, str]:
+    async def _apply_template_async(self, content: str, history: list[dict] | None = None) -> str:
+        response = await self.aclient.post(
+            f"http://{self.host}:{self.port}/apply-template",
+            json=self._template_messages(content, history),
+            headers={"Content-Type": "application/json"},
+            timeout=3.0,
+        )
+        response.raise_for_status()
+        formatted_prompt: str = response.json().get("prompt")
+        return formatted_prompt
+
+    def _slot_params(self, id_slot: int | None) -> dict[str, int]:
+        # Pin the request to a server slot, to reuse its KV cache, see `src.runtime_pool`
+        return {} if id_slot is None else {"id_slot": id_slot}
+
+    def _completion(self, content: str, id_slot: int | None = None) -> tuple[str | None, str]:
         formatted_prompt = self._apply_template(content)
 
         response = self.client.post(
             f"http://{self.host}:{self.port}/completion",
             json=self.default_completion_params
+            | self._slot_params(id_slot)
             | {
                 "prompt": formatted_prompt,
             },
@@ -256,21 +234,88 @@ class ToolCallingRuntime:
                 async for x in r.aiter_text():
                     yield x
 
+    async def stream_content(
+        self,
+        content: str,
+        id_slot: int | None = None,
+        history: list[dict] | None = None,
+        usage: dict | None = None,
+    ) -> AsyncGenerator[str, None]:
+        """Stream the generated text, one decoded piece at a time.
+
+        Unlike `completion(..., stream=True)`, the SSE framing is parsed and only the
+        `content` of each event is yielded, special tokens included. `history` goes between
+        the system prompt and `content`, see `src.conversation`. `usage` is filled with the
+        token counts of the final event: `tokens_evaluated` in the prompt, `tokens_predicted`,
+        and `prompt_n` actually evaluated, the rest being in the KV cache of the slot.
+        """
+
+        formatted_prompt = await self._apply_template_async(content, history)
+
+        async with self.aclient.stream(
+            "post",
+            f"http://{self.host}:{self.port}/completion",
+            json=self.default_completion_params
+            | self._slot_params(id_slot)
+            | {
+                "prompt": formatted_prompt,
+                "stream": True,
+            },
+            headers={"Content-Type": "application/json"},
+            timeout=30.0,
+        ) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if not line.startswith("data: "):
+                    continue
+                event = json.loads(line.removeprefix("data: "))
+                if event.get("content"):
+                    yield event["content"]
+                if event.get("stop"):
+                    if usage is not None:
+                        usage.update({key: value for key, value in event.items() if key.startswith("tokens_")})
+                        usage.update(event.get("timings", {}))
+                    break
+
+    async def prefill(self, content: str, id_slot: int | None = None, history: list[dict] | None = None) -> None:
+        """Evaluate the prompt into the KV cache of the slot, without generating.
+
+        The next request on the slot starting with the same prompt prefix only evaluates the rest.
+        """
+        formatted_prompt = await self._apply_template_async(content, history)
+        response = await self.aclient.post(
+            f"http://{self.host}:{self.port}/completion",
+            json=self.default_completion_params
+            | self._slot_params(id_slot)
+            | {
+                "prompt": formatted_prompt,
+                "n_predict": 0,
+                "cache_prompt": True,
+            },
+            headers={"Content-Type": "application/json"},
+            timeout=5.0,
+        )
+        response.raise_for_status()
+
     @overload
     def completion(
         self,
         content: str,
+        *,
+        id_slot: int | None = None,
     ) -> tuple[str | None, str]: ...
 
     @overload
     def completion(self, content: str, stream: bool = True) -> AsyncGenerator[str, None]: ...
 
-    def completion(self, content: str, stream: bool = False) -> tuple[str | None, str] | AsyncGenerator[str, None]:
+    def completion(
+        self, content: str, stream: bool = False, id_slot: int | None = None
+    ) -> tuple[str | None, str] | AsyncGenerator[str, None]:
         try:
             if stream:
                 return self._completion_stream(content)
             else:
-                return self._completion(content)
+                return self._completion(content, id_slot)
         except httpx.HTTPStatusError as e:
             print(f"Failed on:\n{content}\n{e}")
             raise
@@ -0,0 +1,337 @@
+import asyncio
+import json
+import re
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import aclosing
+from dataclasses import dataclass, field
+
+from fastapi import WebSocket
+from openai import AsyncOpenAI
+
+from src.audio_transport import SEND_TIMEOUT, TTSAudioEncoder, send_audio_message
+from src.connection_manager import ConnectionManager
+from src.conversation import Conversation
+from src.fast_path import ToolCallCache
+from src.llamacpp_inference import function_to_args
+from src.runtime_pool import PoolFull, RuntimePool
+from src.tracing import Tracer
+from src.tts_cache import TTSCache, stream_tts
+
+TOOL_CALL_START = "<|tool_call_start|>"
+TOOL_CALL_END = "<|tool_call_end|>"
+IM_END = "<|im_end|>"
+
+# Split after sentence punctuation followed by whitespace
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?;:])\s+")
+
+
+class SentenceSplitter:
+    """Accumulate streamed text and emit complete sentences as soon as they end.
+
+    Sentences shorter than `min_chars` are merged with the following one, so TTS
+    is not started on fragments like "OK."
+    """
+
+    def __init__(self, min_chars: int = 12):
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, text: str) -> list[str]:
+        self._buffer += text
+        *complete, self._buffer = _SENTENCE_BOUNDARY.split(self._buffer)
+
+        sentences = []
+        pending = ""
+        for sentence in complete:
+            pending = f"{pending} {sentence}" if pending else sentence
+            if len(pending) >= self.min_chars:
+                sentences.append(pending)
+                pending = ""
+        if pending:
+            self._buffer = f"{pending} {self._buffer}" if self._buffer else pending
+        return sentences
+
+    def flush(self) -> str | None:
+        rest, self._buffer = self._buffer.strip(), ""
+        return rest or None
+
+
+class ToolCallStreamParser:
+    """Separate the tool call from the spoken text in a streamed LFM2 tool completion.
+
+    The model emits `<|tool_call_start|>[fn(args)]<|tool_call_end|>text<|im_end|>`.
+    `feed` returns the text to be spoken, and `tool_call` is set once the closing tag
+    has been seen.
+    """
+
+    def __init__(self):
+        self._raw = ""
+        self._in_tool_call = False
+        self._detected = False
+        self.tool_call: str | None = None
+
+    @property
+    def tool_call_ready(self) -> bool:
+        return self.tool_call is not None
+
+    def feed(self, delta: str) -> str:
+        self._raw += delta
+
+        if not self._detected:
+            if TOOL_CALL_START in self._raw:
+                text, self._raw = self._raw.split(TOOL_CALL_START, maxsplit=1)
+                self._detected = True
+                self._in_tool_call = True
+                return self._clean(text) + self.feed("")
+            if TOOL_CALL_START.startswith(self._raw.lstrip()):
+                # Could still be the start of a tool call
+                return ""
+            self._detected = True
+
+        if self._in_tool_call:
+            if TOOL_CALL_END not in self._raw:
+                return ""
+            tool_call, self._raw = self._raw.split(TOOL_CALL_END, maxsplit=1)
+            self.tool_call = tool_call.strip().lstrip("[").rstrip("]")
+            self._in_tool_call = False
+
+        text, self._raw = self._raw, ""
+        return self._clean(text)
+
+    def flush(self) -> str:
+        if self._in_tool_call:
+            print(f"[AUDIO] Incomplete tool call dropped: {self._raw}")
+            self._raw = ""
+            return ""
+        text, self._raw = self._raw, ""
+        return self._clean(text)
+
+    @staticmethod
+    def _clean(text: str) -> str:
+        return text.replace(IM_END, "")
+
+
+@dataclass(kw_only=True)
+class VoiceTurn:
+    """One driver request: tool calling LLM -> cockpit RPC -> TTS, as a pipeline.
+
+    Stages are linked by bounded queues:
+        generate (LLM stream, sentence split) -> synthesize (TTS per sentence) -> send (websocket)
+    so that the first sentence is spoken while the following ones are still generated.
+    """
+
+    websocket: WebSocket
+    audio_client: AsyncOpenAI
+    pool: RuntimePool
+    manager: ConnectionManager
+    voice: str
+    # Scheduling key in the runtime pool, for slot affinity
+    session: str | None = None
+    # Past exchanges of the session, the turn is single-turn without it
+    conversation: Conversation | None = None
+    # Spans of the stages, keyed by session and request id
+    tracer: Tracer = field(default_factory=Tracer)
+    request_id: str | None = None
+    # Cache of confirmed tool calls, checked before the tool calling model
+    fast_path: ToolCallCache | None = None
+    # Synthesized speech of repeated sentences
+    tts_cache: TTSCache | None = None
+    # Cockpit receiving the tool calls, the first connected one if not set
+    cockpit: str | None = None
+    # Send synthesized audio as binary frames instead of base64 in JSON
+    binary: bool = False
+    # Codec negotiated with the client, for binary audio frames
+    codec: str = "pcm"
+    # Reference time for latency reporting, usually when the driver audio was received
+    t_start: float = field(default_factory=time.perf_counter)
+    queue_size: int = 4
+    # A client not reading for this long fails the turn with `ClientStalled`
+    send_timeout: float = SEND_TIMEOUT
+
+    def __post_init__(self):
+        self._sentences: asyncio.Queue[str | None] = asyncio.Queue(maxsize=self.queue_size)
+        # Messages to be sent to the client, the only writer to the websocket is `_send`. Bounded
+        # to a few seconds of audio frames: synthesis waits for a slow client instead of buffering
+        self._outgoing: asyncio.Queue[dict | bytes | None] = asyncio.Queue(maxsize=self.queue_size * 16)
+        self.t_first_audio: float | None = None
+        # Result of the tool call on the cockpit, as the tool message of the conversation
+        self.tool_result: str | None = None
+
+    def _record(self, stage: str, start: float, end: float | None = None, error: str | None = None) -> None:
+        self.tracer.record(stage, start, end, session=self.session, request_id=self.request_id, error=error)
+
+    async def run(self, transcribed_text: str) -> None:
+        """Process the request, cancellable at any point: the streams of every stage are closed."""
+        try:
+            async with asyncio.TaskGroup() as tg:
+                tg.create_task(self._generate(transcribed_text))
+                tg.create_task(self._synthesize())
+                tg.create_task(self._send())
+        except asyncio.CancelledError:
+            # Barge-in, counted with the failed turns
+            self._record("turn", self.t_start, error="cancelled")
+            raise
+        self._record("turn", self.t_start)
+
+    async def _execute_tool_call(self, tool_call: str) -> tuple[str, bool, str | None]:
+        """Run the tool call on the cockpit.
+
+        Returns the displayed tool name, whether the call is valid, and a text
+        overriding the model response, if any.
+        """
+        print(f"[AUDIO] Tool call detected: {tool_call}")
+        try:
+            func_name, args = function_to_args(tool_call)
+        except Exception as e:
+            print(f"[AUDIO] Function call error: {e}")
+            return tool_call, False, f"Sorry, the model called the non-existing function: {tool_call}"
+
+        ws = self.manager.resolve(self.cockpit)
+        if ws is None:
+            print("[AUDIO] No active cockpit connections")
+            return func_name, True, "Sorry, the cockpit is not connected."
+
+        try:
+            with self.tracer.span("rpc", session=self.session, request_id=self.request_id):
+                result = await self.manager.send_rpc_request(ws, func_name, args)
+        except Exception as e:
+            print(f"[AUDIO] Function call error: {e}")
+            return func_name, False, f"Sorry, the model called the non-existing function: {tool_call}"
+
+        print(f"[AUDIO] Function call result: {result}")
+        self.tool_result = json.dumps(result, ensure_ascii=False)
+        return func_name, True if result is None else bool(result), None
+
+    async def _generate(self, transcribed_text: str) -> None:
+        splitter = SentenceSplitter()
+
+        async def speak(text: str) -> None:
+            for sentence in splitter.feed(text):
+                await self._sentences.put(sentence)
+
+        hit = self.fast_path.lookup(transcribed_text) if self.fast_path is not None else None
+        if hit is not None:
+            print(f"[AUDIO] Fast path hit: {hit.tool_call}")
+            formatted_tool_name, tool_call_valid, override_text = await self._execute_tool_call(hit.tool_call)
+            if not tool_call_valid:
+                # Not replayed again, the model gets the next similar command
+                self.fast_path.forget(hit)
+            response_text = override_text or hit.response
+            await speak(response_text)
+            if override_text is None and self.conversation is not None:
+                completion = f"{TOOL_CALL_START}[{hit.tool_call}]{TOOL_CALL_END}{hit.response}"
+                self.conversation.add(transcribed_text, completion, self.tool_result)
+        else:
+            formatted_tool_name, tool_call_valid, response_text = await self._run_model(transcribed_text, speak)
+
+        if rest := splitter.flush():
+            await self._sentences.put(rest)
+
+        # Caption goes before the end marker, so that it is sent before the stream closes
+        print(f"[AUDIO] Model response: '{response_text}'")
+        await self._outgoing.put(
+            {
+                "type": "caption",
+                "role": "model",
+                "text": response_text,
+                "tool": formatted_tool_name,
+                "tool_valid": tool_call_valid,
+            }
+        )
+        await self._sentences.put(None)
+
+    async def _run_model(
+        self, transcribed_text: str, speak: Callable[[str], Awaitable[None]]
+    ) -> tuple[str | None, bool, str]:
+        """Stream the tool calling model, running the tool call as soon as it is complete.
+
+        Returns the displayed tool name if any, whether the call is valid, and the response text.
+        """
+        parser = ToolCallStreamParser()
+        history = self.conversation.messages() if self.conversation is not None else []
+        # Raw completion, tool call included, for the conversation
+        completion = ""
+        usage: dict = {}
+
+        formatted_tool_name = None
+        tool_call_valid = True
+        override_text = None
+        response_text = ""
+
+        print("[AUDIO] Processing through tool calling model...")
+        t_queued = time.perf_counter()
+        try:
+            async with (
+                self.pool.acquire(self.session) as slot,
+                aclosing(slot.stream_content(transcribed_text, history, usage)) as deltas,
+            ):
+                t_acquired = time.perf_counter()
+                self._record("lm_queue", t_queued, t_acquired)
+                async for delta in deltas:
+                    completion += delta
+                    text = parser.feed(delta)
+
+                    if parser.tool_call_ready and formatted_tool_name is None:
+                        self._record("tool_call", t_acquired)
+                        formatted_tool_name, tool_call_valid, override_text = await self._execute_tool_call(
+                            parser.tool_call
+                        )
+                        if override_text is not None:
+                            response_text = override_text
+                            await speak(override_text)
+                            # The model text is not relevant anymore, no need to wait for it
+                            break
+
+                    if text:
+                        response_text += text
+                        await speak(text)
+        except PoolFull as e:
+            print(f"[AUDIO] {e}")
+            override_text = response_text = "Sorry, I am busy right now. Please try again in a moment."
+            await speak(override_text)
+
+        if override_text is None:
+            if text := parser.flush():
+                response_text += text
+                await speak(text)
+            if formatted_tool_name is None:
+                print("[AUDIO] No tool call detected")
+            elif self.fast_path is not None and not history and tool_call_valid and self.tool_result is not None:
+                # The tool call succeeded on the cockpit, next time the model can be skipped. Only
+                # learned without history, follow-ups may depend on the previous exchanges
+                self.fast_path.learn(transcribed_text, parser.tool_call, response_text.strip())
+
+            if "tokens_evaluated" in usage:
+                print(f"[AUDIO] Prompt: {usage['tokens_evaluated']} tokens, {usage.get('prompt_n', '?')} evaluated")
+            if self.conversation is not None:
+                self.conversation.add(transcribed_text, completion.replace(IM_END, ""), self.tool_result, usage)
+
+        return formatted_tool_name, tool_call_valid, response_text.strip()
+
+    async def _synthesize(self) -> None:
+        # A single encoder for the whole turn, to keep Opus frames aligned across sentences
+        encoder = TTSAudioEncoder(self.binary, self.codec)
+        while (sentence := await self._sentences.get()) is not None:
+            print(f"[AUDIO] Sending to TTS with voice '{self.voice}': '{sentence}'")
+            t_sentence = time.perf_counter()
+            first_chunk = True
+            async with aclosing(stream_tts(self.audio_client, self.voice, sentence, self.tts_cache)) as chunks:
+                async for chunk_data in chunks:
+                    if first_chunk:
+                        first_chunk = False
+                        self._record("tts_first_audio", t_sentence)
+                    if self.t_first_audio is None:
+                        self.t_first_audio = time.perf_counter()
+                        self._record("first_audio", self.t_start, self.t_first_audio)
+                        print(f"[AUDIO] Time to first audio: {(self.t_first_audio - self.t_start) * 1000:.0f}ms")
+                    for message in encoder.encode(chunk_data):
+                        await self._outgoing.put(message)
+
+        for message in encoder.flush():
+            await self._outgoing.put(message)
+        await self._outgoing.put(None)
+
+    async def _send(self) -> None:
+        while (message := await self._outgoing.get()) is not None:
+            await send_audio_message(self.websocket, message, self.send_timeout)
@@ -0,0 +1,271 @@
+import asyncio
+import time
+from collections import OrderedDict
+from collections.abc import AsyncGenerator, AsyncIterator
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+
+import httpx
+
+from src.llamacpp_inference import ToolCallingRuntime, spawn_embedding_runtime
+from src.runtime_process import RuntimeProcess, StartupTimings
+from src.utils import find_available_port
+
+
+class PoolFull(Exception):
+    """No slot became free in time, or too many requests are already waiting."""
+
+
+@dataclass(kw_only=True, eq=False)
+class LMServer:
+    port: int
+    runtime: ToolCallingRuntime
+    # None when the server is not managed by the pool, and cannot be restarted
+    process: RuntimeProcess | None = None
+    healthy: bool = True
+    # Consecutive failed health checks
+    failures: int = 0
+
+
+@dataclass(kw_only=True, eq=False)
+class Slot:
+    """One parallel slot of a llama-server, handling one request at a time."""
+
+    server: LMServer
+    id_slot: int
+    busy: bool = False
+    last_used: float = field(default_factory=time.monotonic)
+
+    def stream_content(
+        self, content: str, history: list[dict] | None = None, usage: dict | None = None
+    ) -> AsyncGenerator[str, None]:
+        return self.server.runtime.stream_content(content, id_slot=self.id_slot, history=history, usage=usage)
+
+    def completion(self, content: str) -> tuple[str | None, str]:
+        return self.server.runtime.completion(content, id_slot=self.id_slot)
+
+    async def prefill(self, content: str, history: list[dict] | None = None) -> None:
+        await self.server.runtime.prefill(content, id_slot=self.id_slot, history=history)
+
+
+class RuntimePool:
+    """Several llama-server processes and/or parallel slots, shared by all sessions.
+
+    The scheduler gives each request a free slot, preferably the one last used by the
+    same session, whose KV cache already holds the conversation prefix. Otherwise the
+    least recently used slot is taken, to keep the caches of other sessions. When all
+    slots are busy, up to `max_queue` requests wait for `queue_timeout`, others are
+    rejected with `PoolFull`.
+
+    Managed servers are health checked every `health_interval`, and restarted after
+    `max_failures` consecutive failed checks, or as soon as the process has exited.
+    """
+
+    def __init__(
+        self,
+        *,
+        file_name: str | Path | None = None,
+        n_servers: int = 1,
+        parallel: int = 1,
+        ports: list[int] | None = None,
+        max_queue: int = 8,
+        queue_timeout: float = 10.0,
+        health_interval: float = 5.0,
+        max_failures: int = 3,
+        timings: StartupTimings | None = None,
+        grammar: bool = True,
+    ):
+        assert (file_name is None) != (ports is None), "Set either `file_name` to spawn servers, or `ports`"
+        self.file_name = file_name
+        self.n_servers = n_servers if ports is None else len(ports)
+        self.parallel = parallel
+        self.ports = ports
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.health_interval = health_interval
+        self.max_failures = max_failures
+        self.timings = timings or StartupTimings()
+        self.grammar = grammar
+
+        self.servers: list[LMServer] = []
+        self.slots: list[Slot] = []
+        # Last slot used by each session, oldest first
+        self._affinity: OrderedDict[str, Slot] = OrderedDict()
+        self._waiting = 0
+        self._released = asyncio.Event()
+        self._monitor: asyncio.Task | None = None
+
+    @property
+    def runtime(self) -> ToolCallingRuntime:
+        """Runtime of the first server, for calls outside of the scheduler."""
+        return self.servers[0].runtime
+
+    async def _spawn_all(self) -> list[RuntimeProcess]:
+        # Distinct ports picked upfront, so that the servers start concurrently
+        ports: list[int] = []
+        for i in range(self.n_servers):
+            port = find_available_port(preferred_port=8989 + i)
+            while port in ports:
+                port = find_available_port(preferred_port=None)
+            ports.append(port)
+
+        tasks = [asyncio.create_task(spawn_embedding_runtime(self.file_name, self.parallel, port)) for port in ports]
+        try:
+            return list(await asyncio.gather(*tasks))
+        except BaseException:
+            # Do not leave the servers which did start
+            for task in tasks:
+                task.cancel()
+            for result in await asyncio.gather(*tasks, return_exceptions=True):
+                if isinstance(result, RuntimeProcess):
+                    await result.terminate()
+            raise
+
+    async def __aenter__(self) -> "RuntimePool":
+        processes: list[RuntimeProcess | None]
+        if self.ports is None:
+            with self.timings.phase("LM servers healthy"):
+                spawned = await self._spawn_all()
+            processes, ports = list(spawned), [process.port for process in spawned]
+        else:
+            processes, ports = [None] * len(self.ports), self.ports
+
+        try:
+            # Warmup of the runtimes in parallel
+            with self.timings.phase("LM warmup"):
+                runtimes = await asyncio.gather(
+                    *(asyncio.to_thread(ToolCallingRuntime, port=port, grammar=self.grammar) for port in ports)
+                )
+        except BaseException:
+            for process in processes:
+                if process is not None:
+                    await process.terminate()
+            raise
+
+        self.servers = [
+            LMServer(port=port, runtime=runtime, process=process)
+            for port, runtime, process in zip(ports, runtimes, processes)
+        ]
+        self.slots = [Slot(server=server, id_slot=i) for server in self.servers for i in range(self.parallel)]
+        print(f"Tool calling pool: {len(self.servers)} server(s) x {self.parallel} slot(s)")
+
+        self._monitor = asyncio.create_task(self._health_checks())
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        if self._monitor is not None:
+            self._monitor.cancel()
+        for server in self.servers:
+            if server.process is not None:
+                await server.process.terminate()
+
+    def _notify(self) -> None:
+        self._released.set()
+        self._released = asyncio.Event()
+
+    def _pick(self, session: str | None) -> Slot | None:
+        free = [slot for slot in self.slots if not slot.busy and slot.server.healthy]
+        if not free:
+            return None
+        if session is not None and (slot := self._affinity.get(session)) is not None:
+            if not slot.busy and slot.server.healthy:
+                return slot
+        return min(free, key=lambda slot: slot.last_used)
+
+    @asynccontextmanager
+    async def acquire(self, session: str | None = None, wait: bool = True) -> AsyncIterator[Slot]:
+        """A free slot for the duration of the context, waiting for one if `wait` is set."""
+        slot = self._pick(session)
+        if slot is None:
+            if not wait:
+                raise PoolFull("No tool calling slot free")
+            if self._waiting >= self.max_queue:
+                raise PoolFull(f"Tool calling runtime busy, {self._waiting} requests already waiting")
+
+            self._waiting += 1
+            try:
+                async with asyncio.timeout(self.queue_timeout):
+                    while (slot := self._pick(session)) is None:
+                        await self._released.wait()
+            except TimeoutError:
+                raise PoolFull(f"No tool calling slot free after {self.queue_timeout}s") from None
+            finally:
+                self._waiting -= 1
+
+        slot.busy = True
+        if session is not None:
+            self._affinity[session] = slot
+            self._affinity.move_to_end(session)
+            # Old sessions are forgotten, their cache is likely overwritten anyway
+            while len(self._affinity) > 4 * len(self.slots):
+                self._affinity.popitem(last=False)
+        try:
+            yield slot
+        finally:
+            slot.busy = False
+            slot.last_used = time.monotonic()
+            self._notify()
+
+    async def prefill(self, session: str, content: str, history: list[dict] | None = None) -> bool:
+        """Speculatively evaluate the prompt of `content`, after the `history` of the session, on its slot.
+
+        Only done when a slot is free right away, returns whether it was.
+        """
+        try:
+            async with self.acquire(session, wait=False) as slot:
+                await slot.prefill(content, history)
+        except PoolFull:
+            return False
+        except httpx.HTTPError as e:
+            print(f"Speculative prefill failed: {e}")
+            return False
+        return True
+
+    def end_session(self, session: str) -> None:
+        self._affinity.pop(session, None)
+
+    async def _is_healthy(self, server: LMServer) -> bool:
+        try:
+            r = await server.runtime.aclient.get(f"http://{server.runtime.host}:{server.port}/health", timeout=2.0)
+            return r.status_code == 200
+        except httpx.HTTPError:
+            return False
+
+    async def _restart(self, server: LMServer) -> None:
+        print(f"llama-server on port {server.port} is not healthy, restarting...")
+        server.healthy = False
+        # The KV cache of its slots is lost
+        for session, slot in list(self._affinity.items()):
+            if slot.server is server:
+                del self._affinity[session]
+
+        assert server.process is not None
+        await server.process.terminate()
+        server.process = await spawn_embedding_runtime(self.file_name, self.parallel)
+        server.port = server.runtime.port = server.process.port
+        # Same warmup as at startup, the first request would otherwise pay for it
+        await asyncio.to_thread(server.runtime.warmup)
+        server.healthy = True
+        server.failures = 0
+        self._notify()
+
+    async def _health_checks(self) -> None:
+        while True:
+            await asyncio.sleep(self.health_interval)
+            for server in self.servers:
+                exited = server.process is not None and server.process.exited
+                if not exited and await self._is_healthy(server):
+                    server.failures = 0
+                    continue
+
+                server.failures += 1
+                if server.process is None:
+                    print(f"llama-server on port {server.port} is not healthy")
+                    continue
+                if not exited and server.failures < self.max_failures:
+                    continue
+                try:
+                    await self._restart(server)
+                except Exception as e:
+                    print(f"Failed to restart llama-server: {e}")
@@ -0,0 +1,148 @@
+import asyncio
+import re
+import time
+from collections import deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+
+import httpx
+
+# Logged by llama.cpp servers once the HTTP server accepts connections
+LISTENING_LOG = re.compile(r"listening", re.IGNORECASE)
+
+
+class StartupTimings:
+    """Duration of each startup phase, relative to the start of the server."""
+
+    def __init__(self):
+        self.t0 = time.perf_counter()
+        self.phases: list[tuple[str, float, float]] = []
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter() - self.t0
+        yield
+        self.phases.append((name, start, time.perf_counter() - self.t0))
+
+    def report(self) -> None:
+        print("Startup phases:")
+        for name, start, end in sorted(self.phases, key=lambda p: p[1]):
+            print(f"  {name:<28} {start:6.1f}s -> {end:6.1f}s  ({end - start:.1f}s)")
+        print(f"  {'total':<28} {time.perf_counter() - self.t0:22.1f}s")
+
+
+class RuntimeProcess:
+    """An inference server subprocess, with its log stream read continuously.
+
+    The log is kept (last lines only) for error messages, and watched for the line
+    telling that the server listens, to probe its health right away instead of
+    waiting for the next poll.
+    """
+
+    def __init__(self, name: str, process: asyncio.subprocess.Process, port: int):
+        self.name = name
+        self.process = process
+        self.port = port
+        self.log: deque[str] = deque(maxlen=50)
+        self.listening = asyncio.Event()
+        self._reader = asyncio.create_task(self._read_log())
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    @property
+    def exited(self) -> bool:
+        return self.process.returncode is not None
+
+    async def wait_exited(self) -> None:
+        # Shielded, cancelling the wait does not stop reading the log
+        await asyncio.shield(self._reader)
+
+    async def _read_log(self) -> None:
+        assert self.process.stdout is not None
+        async for raw in self.process.stdout:
+            line = raw.decode(errors="ignore").rstrip()
+            self.log.append(line)
+            if not self.listening.is_set() and LISTENING_LOG.search(line):
+                self.listening.set()
+        await self.process.wait()
+
+    def _error(self, message: str) -> RuntimeError:
+        log = "\n".join(self.log)
+        return RuntimeError(f"{self.name} {message}.\nLog:\n{log}")
+
+    async def wait_ready(self, health_url: str, timeout: float, ready_on_listening: bool = False) -> None:
+        """Wait until `health_url` answers 200.
+
+        With `ready_on_listening`, for servers without a health endpoint, any answer
+        other than 503 after the listening log line is enough.
+        """
+        listening = asyncio.create_task(self.listening.wait())
+        try:
+            async with httpx.AsyncClient() as client, asyncio.timeout(timeout):
+                while True:
+                    if self.exited:
+                        raise self._error(f"exited with code {self.process.returncode}")
+
+                    try:
+                        status = (await client.get(health_url, timeout=1.0)).status_code
+                    except httpx.HTTPError:
+                        status = None
+                    if status == 200 or (ready_on_listening and self.listening.is_set() and status not in (None, 503)):
+                        return
+
+                    if self.listening.is_set():
+                        # Loading the model, should not be long
+                        await asyncio.sleep(0.05)
+                    else:
+                        # Wake up on the listening line, or if the process exits
+                        await asyncio.wait([listening, self._reader], timeout=0.5)
+        except TimeoutError:
+            raise self._error(f"failed to become healthy after {timeout:.0f}s") from None
+        finally:
+            listening.cancel()
+
+    async def terminate(self) -> None:
+        if not self.exited:
+            self.process.terminate()
+            try:
+                # Wait for graceful shutdown
+                await asyncio.wait_for(self.process.wait(), timeout=4)
+                print(f"{self.name} terminated gracefully.")
+            except TimeoutError:
+                print(f"{self.name} did not terminate in time, killing...")
+                self.process.kill()
+                await self.process.wait()
+        await self._reader
+
+
+async def start_runtime(
+    name: str,
+    command: list[str],
+    port: int,
+    health_url: str,
+    timeout: float = 150.0,
+    ready_on_listening: bool = False,
+) -> RuntimeProcess:
+    """Spawn an inference server and wait until it is ready, terminating it on failure."""
+    executable = command[0]
+    if not Path(executable).exists():
+        raise FileNotFoundError(f"{executable} command not found. Please ensure it is installed and in your PATH.")
+
+    process = await asyncio.create_subprocess_exec(
+        *command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        start_new_session=True,
+    )
+    runtime = RuntimeProcess(name, process, port)
+    try:
+        await runtime.wait_ready(health_url, timeout, ready_on_listening)
+    except BaseException:
+        await runtime.terminate()
+        raise
+
+    print(f"`{executable}` running on port {port} (PID: {runtime.pid})")
+    return runtime
@@ -1,3 +1,5 @@
+from pathlib import Path
+
 from pydantic import HttpUrl
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
@@ -7,6 +9,37 @@ class PydanticSettings(BaseSettings, case_sensitive=False):
 
     DEMO_URL: HttpUrl
     AUDIO_SERVER_PORT: int
+    # Start the audio server with the cockpit server, unless it already runs on AUDIO_SERVER_PORT
+    SPAWN_AUDIO_SERVER: bool = True
+    AUDIO_SERVER_THREADS: int = 4
+    # Second audio server taking the requests while the first one restarts, doubles the memory used
+    AUDIO_STANDBY: bool = False
+    # Use an already running llama-server instead of spawning one, e.g. a stub for benchmarks
+    LM_SERVER_PORT: int | None = None
+    # Tool calling runtime pool: processes, parallel slots per process, and queued requests
+    LM_SERVERS: int = 1
+    LM_PARALLEL: int = 2
+    LM_MAX_QUEUE: int = 8
+    # Grammar-constrained tool calls, only functions of functions.json with valid arguments
+    TOOL_GRAMMAR: bool = True
+    # Answer repeated commands from a cache of confirmed tool calls, without the model
+    FAST_PATH: bool = True
+    # Synthesized speech of repeated sentences, kept in memory and spilled to disk
+    TTS_CACHE: bool = True
+    TTS_CACHE_DIR: Path | None = Path(".cache/tts")
+    # Streaming ASR: trailing silence ending an utterance, longest utterance, and tool calling prompt
+    # prefilled while speaking
+    ENDPOINT_SILENCE_MS: int = 700
+    MAX_UTTERANCE_MS: int = 15000
+    SPECULATIVE_PREFILL: bool = True
+    # Follow-up commands: history of each session in the prompt, truncated over this many tokens of context
+    MULTI_TURN: bool = True
+    CONVERSATION_MAX_TOKENS: int = 3072
+    OPEN_BROWSER: bool = True
+    # Reload the files of the cockpit UI when they change, for development
+    STATIC_RELOAD: bool = False
+    # Append a JSON line per pipeline span to this file, see /metrics for the aggregated latencies
+    TRACE_FILE: Path | None = None
 
 
 p_env = PydanticSettings()  # type:ignore[reportCallIssue]
@@ -0,0 +1,153 @@
+"""Static files of the cockpit UI, served from memory.
+
+Each file is read once, with its gzip and brotli variants precomputed (brotli needs the
+optional `brotli` package, `uv sync --group compression`). Responses carry an ETag, and
+`If-None-Match` is answered with 304. `index.html` references the other files with their
+content hash as query (`script.js?v=...`): the browser caches these for good, and only
+revalidates the page itself.
+
+With `reload`, files modified on disk are loaded again, for development.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:  # Optional dependency
+    brotli = None
+
+INDEX = "index.html"
+
+# Preferred first, "identity" being the file as is
+_CODINGS = ("br", "gzip", "identity")
+
+# Compression does not pay off for smaller files
+_MIN_COMPRESS_BYTES = 512
+
+_IMMUTABLE = "public, max-age=31536000, immutable"
+_REVALIDATE = "no-cache"
+
+# References to local files in the page: href="style.css", src="script.js"
+_REFERENCE = re.compile(r'\b(href|src)="([^"/:?#]+)"')
+
+
+@dataclass(kw_only=True, frozen=True)
+class Asset:
+    media_type: str
+    # Content hash, also the version of the file in the references of the page
+    version: str
+    mtime_ns: int
+    # Body per content coding, only the ones smaller than the file
+    bodies: dict[str, bytes]
+
+    def etag(self, coding: str) -> str:
+        return f'"{self.version}"' if coding == "identity" else f'"{self.version}-{coding}"'
+
+
+def _compress(body: bytes) -> dict[str, bytes]:
+    bodies = {"identity": body}
+    if len(body) < _MIN_COMPRESS_BYTES:
+        return bodies
+    compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        compressed["br"] = brotli.compress(body, quality=11)
+    return bodies | {coding: data for coding, data in compressed.items() if len(data) < len(body)}
+
+
+def _accepted_codings(header: str) -> set[str]:
+    """Content codings of an Accept-Encoding header, without the ones refused with q=0."""
+    codings = {"identity"}
+    for item in header.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        quality = params.strip().removeprefix("q=")
+        try:
+            refused = bool(params) and float(quality) == 0
+        except ValueError:
+            refused = False
+        if coding and not refused:
+            codings.add(coding)
+    return codings
+
+
+class StaticAssets:
+    """Files of `directory`, held in memory and served with their compressed variants."""
+
+    def __init__(self, directory: Path, reload: bool = False):
+        self.directory = directory
+        self.reload = reload
+        self._assets: dict[str, Asset] = {}
+        self._load_all()
+
+    def _load(self, path: Path, body: bytes | None = None) -> Asset:
+        body = path.read_bytes() if body is None else body
+        media_type, _ = mimetypes.guess_type(path.name)
+        return Asset(
+            media_type=media_type or "application/octet-stream",
+            version=hashlib.sha256(body).hexdigest()[:16],
+            mtime_ns=path.stat().st_mtime_ns,
+            bodies=_compress(body),
+        )
+
+    def _versioned_index(self, path: Path) -> bytes:
+        def reference(match: re.Match) -> str:
+            attribute, name = match.groups()
+            if (asset := self._assets.get(name)) is None:
+                return match.group(0)
+            return f'{attribute}="{name}?v={asset.version}"'
+
+        return _REFERENCE.sub(reference, path.read_text()).encode()
+
+    def _load_all(self) -> None:
+        paths = [path for path in sorted(self.directory.iterdir()) if path.is_file()]
+        # The page last, it references the versions of the other files
+        for path in paths:
+            if path.name != INDEX:
+                self._assets[path.name] = self._load(path)
+        if (index := self.directory / INDEX).is_file():
+            self._assets[INDEX] = self._load(index, self._versioned_index(index))
+
+    def _changed(self) -> bool:
+        for path in self.directory.iterdir():
+            asset = self._assets.get(path.name)
+            if path.is_file() and (asset is None or asset.mtime_ns != path.stat().st_mtime_ns):
+                return True
+        return False
+
+    def get(self, name: str) -> Asset | None:
+        if self.reload and self._changed():
+            self._assets = {}
+            self._load_all()
+        return self._assets.get(name)
+
+    def response(self, request: Request, name: str) -> Response:
+        asset = self.get(name)
+        if asset is None:
+            return Response(status_code=404)
+
+        accepted = _accepted_codings(request.headers.get("accept-encoding", ""))
+        coding = next(coding for coding in _CODINGS if coding in asset.bodies and coding in accepted)
+
+        # Versioned references of the page do not change, anything else is revalidated
+        versioned = request.query_params.get("v") == asset.version and not self.reload
+        headers = {
+            "ETag": asset.etag(coding),
+            "Cache-Control": _IMMUTABLE if versioned else _REVALIDATE,
+            "Vary": "Accept-Encoding",
+        }
+
+        # Any variant is the same content, whichever the client got before
+        known = {tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")}
+        if "*" in known or known & {asset.etag(coding) for coding in asset.bodies}:
+            return Response(status_code=304, headers=headers)
+
+        if coding != "identity":
+            headers["Content-Encoding"] = coding
+        return Response(content=asset.bodies[coding], media_type=asset.media_type, headers=headers)
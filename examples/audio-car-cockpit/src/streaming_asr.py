@@ -0,0 +1,206 @@
+"""Streaming ASR on /ws-audio: driver audio pushed while speaking, endpointed on the server.
+
+The audio server only transcribes complete recordings, so the audio received so far is
+transcribed again at regular intervals for partial transcripts. Words agreed on by two
+consecutive partials form the stable prefix, on which the tool calling prompt can be
+prefilled. As soon as the driver pauses, the whole utterance is transcribed: if the pause
+turns out to be the end of the utterance, the final transcript is then already there.
+"""
+
+import asyncio
+import math
+import sys
+from array import array
+from collections.abc import Awaitable, Callable
+
+# Bytes per sample of the streamed PCM
+_SAMPLE_BYTES = 2
+
+
+def _common_prefix(a: list[str], b: list[str]) -> list[str]:
+    prefix = []
+    for word_a, word_b in zip(a, b):
+        if word_a != word_b:
+            break
+        prefix.append(word_a)
+    return prefix
+
+
+class Endpointer:
+    """Energy based voice activity detection on mono 16 bits PCM, in frames of `frame_ms`.
+
+    A frame is speech when its level is above `threshold_db` (dBFS) and `margin_db` above
+    the noise floor, tracked on the other frames. After some speech, `pause_ms` of
+    trailing silence is a pause, `endpoint_ms` the end of the utterance.
+    """
+
+    def __init__(
+        self,
+        sample_rate: int = 16000,
+        frame_ms: int = 20,
+        threshold_db: float = -45.0,
+        margin_db: float = 10.0,
+        pause_ms: int = 250,
+        endpoint_ms: int = 700,
+    ):
+        self.frame_samples = sample_rate * frame_ms // 1000
+        self.frame_ms = frame_ms
+        self.threshold_db = threshold_db
+        self.margin_db = margin_db
+        self.pause_ms = pause_ms
+        self.endpoint_ms = endpoint_ms
+
+        self.noise_db = threshold_db - margin_db
+        # Frames of speech so far, changes whenever the driver speaks again
+        self.speech_frames = 0
+        self.silence_ms = 0
+        self._pending = b""
+
+    @property
+    def speaking(self) -> bool:
+        return self.speech_frames > 0 and self.silence_ms < self.pause_ms
+
+    @property
+    def paused(self) -> bool:
+        return self.speech_frames > 0 and self.silence_ms >= self.pause_ms
+
+    @property
+    def ended(self) -> bool:
+        return self.speech_frames > 0 and self.silence_ms >= self.endpoint_ms
+
+    def _level_db(self, frame: bytes) -> float:
+        samples = array("h", frame)
+        if sys.byteorder != "little":
+            samples.byteswap()
+        energy = sum(s * s for s in samples) / len(samples)
+        return 10 * math.log10(energy / 32768**2 + 1e-12)
+
+    def feed(self, pcm: bytes) -> None:
+        data = self._pending + pcm
+        frame_bytes = self.frame_samples * _SAMPLE_BYTES
+        n_frames = len(data) // frame_bytes
+        self._pending = data[n_frames * frame_bytes :]
+
+        for i in range(n_frames):
+            level = self._level_db(data[i * frame_bytes : (i + 1) * frame_bytes])
+            if level > max(self.threshold_db, self.noise_db + self.margin_db):
+                self.speech_frames += 1
+                self.silence_ms = 0
+            else:
+                self.silence_ms += self.frame_ms
+                # Slow follower of the background level
+                self.noise_db += 0.05 * (level - self.noise_db)
+
+
+class StreamingUtterance:
+    """One utterance streamed by the client, transcribed incrementally.
+
+    `transcribe` turns mono 16 bits PCM into text. `on_partial` receives each partial
+    transcript with its stable prefix, `on_stable` the stable prefix when it grows.
+    The utterance ends after `max_duration_ms` even without a pause, e.g. in a noisy cabin,
+    as every transcription covers the whole audio so far.
+    """
+
+    def __init__(
+        self,
+        transcribe: Callable[[bytes], Awaitable[str]],
+        sample_rate: int = 16000,
+        on_partial: Callable[[str, str], Awaitable[None]] | None = None,
+        on_stable: Callable[[str], Awaitable[None]] | None = None,
+        partial_interval_ms: int = 600,
+        endpointer: Endpointer | None = None,
+        max_duration_ms: int = 15000,
+    ):
+        self.transcribe = transcribe
+        self.sample_rate = sample_rate
+        self.on_partial = on_partial
+        self.on_stable = on_stable
+        self.partial_interval_ms = partial_interval_ms
+        self.endpointer = endpointer or Endpointer(sample_rate)
+        self.max_duration_ms = max_duration_ms
+        self._max_bytes = max_duration_ms * sample_rate // 1000 * _SAMPLE_BYTES
+
+        self.pcm = bytearray()
+        self._partial_at = 0
+        self._partial: asyncio.Task | None = None
+        self._previous_words: list[str] = []
+        self._stable: list[str] = []
+        self._stable_task: asyncio.Task | None = None
+        # Transcription started at the last pause, and the speech it covers
+        self._candidate: asyncio.Task[str] | None = None
+        self._candidate_speech = 0
+
+    @property
+    def duration_ms(self) -> int:
+        return len(self.pcm) // _SAMPLE_BYTES * 1000 // self.sample_rate
+
+    def feed(self, pcm: bytes | memoryview) -> bool:
+        """Add audio, returns True once the end of the utterance is detected or it is too long."""
+        # Audio past the longest utterance is dropped
+        pcm = pcm[: self._max_bytes - len(self.pcm)]
+        self.pcm += pcm
+        self.endpointer.feed(bytes(pcm))
+        endpointer = self.endpointer
+
+        if endpointer.paused:
+            if self._candidate is None or self._candidate_speech != endpointer.speech_frames:
+                # The driver may be done, transcribe everything right away
+                if self._candidate is not None:
+                    self._candidate.cancel()
+                self._candidate = asyncio.create_task(self.transcribe(bytes(self.pcm)))
+                self._candidate_speech = endpointer.speech_frames
+        elif (
+            endpointer.speaking
+            and (self._partial is None or self._partial.done())
+            and self.duration_ms - self._partial_at >= self.partial_interval_ms
+        ):
+            self._partial_at = self.duration_ms
+            self._partial = asyncio.create_task(self._run_partial(bytes(self.pcm)))
+
+        if len(self.pcm) >= self._max_bytes:
+            print(f"[AUDIO] Utterance reached {self.max_duration_ms}ms, ending it")
+            return True
+        return endpointer.ended
+
+    async def _run_partial(self, pcm: bytes) -> None:
+        try:
+            text = await self.transcribe(pcm)
+        except Exception as e:
+            # Partial transcripts are only a preview
+            print(f"[AUDIO] Partial ASR failed: {e}")
+            return
+
+        words = text.split()
+        # Local agreement: words transcribed the same way twice in a row are unlikely to change
+        stable = _common_prefix(self._previous_words, words)
+        self._previous_words = words
+        if self.on_partial is not None:
+            await self.on_partial(text, " ".join(stable))
+        if len(stable) > len(self._stable) and self.on_stable is not None:
+            self._stable = stable
+            if self._stable_task is None or self._stable_task.done():
+                self._stable_task = asyncio.create_task(self.on_stable(" ".join(stable)))
+
+    def close(self) -> None:
+        for task in (self._partial, self._stable_task, self._candidate):
+            if task is not None:
+                task.cancel()
+
+    async def finish(self) -> str:
+        """Final transcript, from the transcription started at the last pause when nothing was said since."""
+        if self._partial is not None:
+            self._partial.cancel()
+        if self._stable_task is not None:
+            # Short, and the slot it prefills is the one the turn should get
+            await asyncio.wait([self._stable_task], timeout=0.5)
+            self._stable_task.cancel()
+
+        candidate = self._candidate
+        if candidate is not None and self._candidate_speech == self.endpointer.speech_frames:
+            try:
+                return await candidate
+            except Exception as e:
+                print(f"[AUDIO] ASR at the pause failed, retrying: {e}")
+        elif candidate is not None:
+            candidate.cancel()
+        return await self.transcribe(bytes(self.pcm))
@@ -0,0 +1,258 @@
+"""Local stand-ins for the inference runtimes and the cockpit UI, used by `benchmark.py`.
+
+- `create_audio_stub`: OpenAI-compatible audio server, ASR returns scripted transcripts and TTS silent PCM.
+  Streamed audio is recognized too: a prefix of an utterance gets the same share of its words.
+- `create_lm_stub`: llama-server with scripted tool-call completions, e.g. recorded by `evaluate.py`
+- `FakeCockpit`: headless cockpit answering JSON-RPC over `/ws`
+
+Delays are configurable to emulate the speed of the real models.
+"""
+
+import asyncio
+import base64
+import hashlib
+import io
+import json
+import re
+import threading
+import time
+import wave
+from dataclasses import dataclass, field
+
+import uvicorn
+import websockets
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from src.audio_transport import TTS_SAMPLE_RATE
+
+
+@dataclass(kw_only=True)
+class Utterance:
+    transcript: str
+    tool_call: str | None
+    response: str
+    # WAV bytes sent as driver audio, the stub ASR recognizes it by its hash
+    wav: bytes = b""
+
+    @property
+    def audio_hash(self) -> str:
+        return hashlib.sha256(self.wav).hexdigest()
+
+    @property
+    def pcm(self) -> bytes:
+        return wav_frames(self.wav)
+
+    def completion(self) -> str:
+        """Raw LFM2 tool calling output for this utterance."""
+        tool_call = f"<|tool_call_start|>[{self.tool_call}]<|tool_call_end|>" if self.tool_call else ""
+        return f"{tool_call}{self.response}<|im_end|>"
+
+
+@dataclass(kw_only=True)
+class StubDelays:
+    asr_token_s: float = 0.01
+    lm_token_s: float = 0.015
+    tts_chunk_s: float = 0.04
+    # Synthesized audio per TTS chunk
+    tts_chunk_audio_s: float = 0.08
+    # Characters of text per TTS chunk
+    tts_chars_per_chunk: int = 8
+
+
+_TOKENS = re.compile(r"<\|[a-z_]+\|>|\S+\s*|\s+")
+
+
+def _tokens(text: str) -> list[str]:
+    """Word-level tokens, special tokens kept whole."""
+    return _TOKENS.findall(text)
+
+
+def wav_frames(wav: bytes) -> bytes:
+    with wave.open(io.BytesIO(wav), "rb") as reader:
+        return reader.readframes(reader.getnframes())
+
+
+def _sse(data: dict | str) -> str:
+    return f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n"
+
+
+def _chat_chunk(delta: dict, finish_reason: str | None = None) -> dict:
+    return {
+        "id": "stub",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": "stub",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def create_audio_stub(utterances: list[Utterance], delays: StubDelays) -> FastAPI:
+    app = FastAPI(title="Audio server stub")
+    transcripts = {u.audio_hash: u.transcript for u in utterances}
+    speech = [(u.transcript, u.pcm) for u in utterances]
+
+    def recognize(wav: bytes) -> str:
+        if (transcript := transcripts.get(hashlib.sha256(wav).hexdigest())) is not None:
+            return transcript
+        # Audio streamed by the server: the whole utterance then silence, or only its beginning
+        pcm = wav_frames(wav)
+        for transcript, utterance_pcm in speech:
+            if pcm.startswith(utterance_pcm):
+                return transcript
+            if pcm and utterance_pcm.startswith(pcm):
+                words = transcript.split()
+                return " ".join(words[: len(words) * len(pcm) // len(utterance_pcm)])
+        return ""
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        system, user = body["messages"][0]["content"], body["messages"][-1]["content"]
+
+        async def asr():
+            transcript = recognize(base64.b64decode(user[0]["input_audio"]["data"]))
+            for token in _tokens(transcript):
+                await asyncio.sleep(delays.asr_token_s)
+                yield _sse(_chat_chunk({"content": token}))
+            yield _sse(_chat_chunk({}, finish_reason="stop"))
+            yield _sse("[DONE]")
+
+        async def tts():
+            n_chunks = max(1, len(user) // delays.tts_chars_per_chunk)
+            pcm = bytes(int(TTS_SAMPLE_RATE * delays.tts_chunk_audio_s) * 4)
+            chunk_b64 = base64.b64encode(pcm).decode("utf-8")
+            for _ in range(n_chunks):
+                await asyncio.sleep(delays.tts_chunk_s)
+                yield _sse(_chat_chunk({"audio_chunk": {"data": chunk_b64}}))
+            yield _sse(_chat_chunk({}, finish_reason="stop"))
+            yield _sse("[DONE]")
+
+        stream = asr() if system.startswith("Perform ASR") else tts()
+        return StreamingResponse(stream, media_type="text/event-stream")
+
+    return app
+
+
+def create_lm_stub(completions: dict[str, str], delays: StubDelays) -> FastAPI:
+    """llama-server answering each user message with its raw completion in `completions`.
+
+    Token counts are reported like llama-server does, in word-level tokens.
+    """
+    app = FastAPI(title="llama-server stub")
+    # Used by the warmup of `ToolCallingRuntime`
+    fallback = "<|tool_call_start|>[media.play()]<|tool_call_end|>Playing.<|im_end|>"
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.post("/apply-template")
+    async def apply_template(request: Request):
+        body = await request.json()
+        # The "prompt" is the user message, to look up the scripted completion
+        return {"prompt": body["messages"][-1]["content"]}
+
+    @app.post("/completion")
+    async def completion(request: Request):
+        body = await request.json()
+        if body.get("n_predict") == 0:
+            # Prompt evaluation only, not emulated
+            return JSONResponse({"content": ""})
+        content = completions.get(body["prompt"], fallback)
+
+        if not body.get("stream"):
+            await asyncio.sleep(delays.lm_token_s * len(_tokens(content)))
+            return JSONResponse({"content": content})
+
+        async def stream():
+            tokens = _tokens(content)
+            for token in tokens:
+                await asyncio.sleep(delays.lm_token_s)
+                yield _sse({"content": token, "stop": False})
+            n_prompt = len(_tokens(body["prompt"]))
+            yield _sse(
+                {
+                    "content": "",
+                    "stop": True,
+                    "tokens_evaluated": n_prompt,
+                    "tokens_predicted": len(tokens),
+                    "timings": {"prompt_n": n_prompt, "predicted_n": len(tokens)},
+                }
+            )
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+class BackgroundServer:
+    """Run an ASGI app with uvicorn in a thread, with its own event loop."""
+
+    def __init__(self, app, port: int, host: str = "127.0.0.1"):
+        self.server = uvicorn.Server(uvicorn.Config(app, host=host, port=port, log_level="warning"))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+
+@dataclass(kw_only=True)
+class FakeCockpit:
+    """Headless cockpit: keeps a minimal state and answers JSON-RPC requests on `/ws`."""
+
+    url: str
+    state: dict = field(
+        default_factory=lambda: {
+            "windows": {"fl": False, "fr": False, "rl": False, "rr": False},
+            "media": {"isPlaying": False, "currentIndex": 0, "currentTime": 0},
+            "climate": {"currentTemp": 23, "targetTemp": 23, "fanLevel": 2},
+            "navigation": {"destination": None, "isRunning": False, "currentIndex": -1, "totalSteps": 0},
+            "audio": {"selectedVoice": "US female"},
+        }
+    )
+    rpc_count: int = 0
+
+    def _execute(self, method: str, params: dict):
+        section, _, action = method.partition(".")
+        if action == "get" or method == "system.getState":
+            return self.state if method == "system.getState" else self.state.get(section)
+        if method == "carWindows.openAll":
+            self.state["windows"] = dict.fromkeys(self.state["windows"], True)
+        elif method == "carWindows.closeAll":
+            self.state["windows"] = dict.fromkeys(self.state["windows"], False)
+        elif method == "climate.setTarget":
+            self.state["climate"]["targetTemp"] = params.get("temperature")
+        elif method in ("media.play", "media.pause"):
+            self.state["media"]["isPlaying"] = method == "media.play"
+        return True
+
+    def _handle(self, request: dict) -> dict:
+        self.rpc_count += 1
+        try:
+            result = self._execute(request["method"], request.get("params") or {})
+            return {"jsonrpc": "2.0", "id": request.get("id"), "result": result}
+        except Exception as e:
+            return {"jsonrpc": "2.0", "id": request.get("id"), "error": {"code": -32603, "message": str(e)}}
+
+    async def run(self, ready: asyncio.Event) -> None:
+        async with websockets.connect(self.url) as ws:
+            await ws.send(
+                json.dumps(
+                    {"jsonrpc": "2.0", "method": "state.snapshot", "params": {"version": 1, "state": self.state}}
+                )
+            )
+            ready.set()
+            async for data in ws:
+                message = json.loads(data)
+                if isinstance(message, list):
+                    await ws.send(json.dumps([self._handle(m) for m in message]))
+                elif "method" in message:
+                    await ws.send(json.dumps(self._handle(message)))
@@ -0,0 +1,92 @@
+import functools
+import json
+import re
+
+# Shared value rules, Python literals as parsed by `function_to_args`
+_VALUE_RULES = {
+    "string": r"""string ::= "\"" [^"\\\n]* "\"" | "'" [^'\\\n]* "'" """.strip(),
+    "number": r"""number ::= "-"? [0-9]+ ("." [0-9]+)?""",
+    "integer": r"""integer ::= "-"? [0-9]+""",
+    "boolean": r"""boolean ::= "True" | "False" """.strip(),
+}
+
+
+def _literal(text: str) -> str:
+    # JSON escapes are valid in GBNF string literals
+    return json.dumps(text, ensure_ascii=False)
+
+
+def _rule_name(function_name: str) -> str:
+    return "fn-" + re.sub(r"[^A-Za-z0-9]+", "-", function_name)
+
+
+def _value(schema: dict, used: set[str]) -> str:
+    if "enum" in schema:
+        # Either quote, as the model prefers
+        options = []
+        for value in schema["enum"]:
+            if isinstance(value, str):
+                options += [_literal(f'"{value}"'), _literal(f"'{value}'")]
+            else:
+                options.append(_literal(repr(value)))
+        return "(" + " | ".join(options) + ")"
+
+    kind = schema.get("type", "string")
+    if kind not in _VALUE_RULES:
+        raise ValueError(f"Unsupported parameter type in the function catalog: {kind}")
+    used.add(kind)
+    return kind
+
+
+def _arguments(parameters: dict, used: set[str]) -> str:
+    """Keyword arguments in declaration order, the optional ones may be left out."""
+    properties = parameters.get("properties", {})
+    required = set(parameters.get("required", []))
+    names = list(properties)
+    pairs = [f"{_literal(name + '=')} {_value(properties[name], used)}" for name in names]
+
+    # One alternative per possible first argument: up to the first required one
+    alternatives: list[str] = []
+    for i, (name, pair) in enumerate(zip(names, pairs, strict=True)):
+        sequence = pair
+        for later_name, later_pair in zip(names[i + 1 :], pairs[i + 1 :], strict=True):
+            item = f'"," " "? {later_pair}'
+            sequence += " " + (item if later_name in required else f"({item})?")
+        alternatives.append(sequence)
+        if name in required:
+            break
+
+    if not alternatives:
+        return ""
+    # Without required arguments, there may be none at all
+    return "(" + " | ".join(alternatives) + (")? " if not required else ") ")
+
+
+@functools.lru_cache(maxsize=4)
+def tool_call_grammar(catalog: str) -> str:
+    """GBNF grammar of an LFM2 tool completion, for the functions of `catalog` (JSON list).
+
+    `<|tool_call_start|>[name(arg=value, ...)]<|tool_call_end|>` then the message for the
+    user, the tool call being optional. Only functions of the catalog can be called, with
+    their declared arguments, in order, and values of the declared types or enums.
+
+    Compiled once per catalog, llama-server parses it with each request.
+    """
+    functions = json.loads(catalog)
+    used: set[str] = set()
+    rules = []
+    for function in functions:
+        arguments = _arguments(function.get("parameters", {}), used)
+        rules.append(f'{_rule_name(function["name"])} ::= {_literal(function["name"] + "(")} {arguments}")"')
+
+    calls = " | ".join(_rule_name(function["name"]) for function in functions)
+    return "\n".join(
+        [
+            'root ::= ("<|tool_call_start|>[" call "]<|tool_call_end|>")? text',
+            # The end of turn token is allowed by llama-server once the grammar is complete
+            "text ::= [^<]*",
+            f"call ::= {calls}",
+            *rules,
+            *(_VALUE_RULES[kind] for kind in sorted(used)),
+        ]
+    )
@@ -0,0 +1,135 @@
+import json
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import TextIO
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+METRIC = "cockpit_stage_duration_seconds"
+
+
+class Histogram:
+    """Cumulative histogram in the Prometheus layout: one count per upper bound, plus +Inf."""
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+def _format_float(value: float) -> str:
+    return repr(float(value))
+
+
+class Tracer:
+    """Spans of the voice pipeline stages, keyed by session and request id.
+
+    Durations are aggregated into one histogram per stage, rendered in the Prometheus
+    text format for `/metrics`. With `trace_file`, each span is also appended to it as
+    a JSON line, to look at single requests.
+
+    Stages:
+        asr_first_token, asr_total   audio received -> first / last transcribed text
+        lm_queue                     waiting for a free tool calling slot
+        tool_call                    slot acquired -> tool call complete in the model stream
+        rpc                          tool call round trip to the cockpit
+        tts_first_audio              sentence sent to TTS -> first audio chunk
+        first_audio, turn            audio received -> first synthesized audio / turn done
+    """
+
+    def __init__(self, trace_file: Path | None = None, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.trace_file = trace_file
+        self.buckets = buckets
+        self.histograms: dict[str, Histogram] = {}
+        self.errors: dict[str, int] = {}
+        self._trace: TextIO | None = None
+
+    def record(
+        self,
+        stage: str,
+        start: float,
+        end: float | None = None,
+        *,
+        session: str | None = None,
+        request_id: str | None = None,
+        error: str | None = None,
+    ) -> None:
+        """Record a span between two `time.perf_counter()` values, ending now by default."""
+        if end is None:
+            end = time.perf_counter()
+        duration = end - start
+
+        if error is None:
+            if (histogram := self.histograms.get(stage)) is None:
+                histogram = self.histograms[stage] = Histogram(self.buckets)
+            histogram.observe(duration)
+        else:
+            self.errors[stage] = self.errors.get(stage, 0) + 1
+
+        if self.trace_file is not None:
+            if self._trace is None:
+                self.trace_file.parent.mkdir(parents=True, exist_ok=True)
+                # Line buffered, spans are readable while the server runs
+                self._trace = self.trace_file.open("a", buffering=1)
+            span = {
+                "stage": stage,
+                "session": session,
+                "request_id": request_id,
+                # Wall clock time of the start, for correlation with other logs
+                "start": round(time.time() - (time.perf_counter() - start), 6),
+                "duration_ms": round(duration * 1000, 3),
+            }
+            if error is not None:
+                span["error"] = error
+            self._trace.write(json.dumps(span) + "\n")
+
+    @contextmanager
+    def span(self, stage: str, *, session: str | None = None, request_id: str | None = None) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.record(stage, start, session=session, request_id=request_id, error=type(e).__name__)
+            raise
+        self.record(stage, start, session=session, request_id=request_id)
+
+    def render(self) -> str:
+        """Histograms and error counts in the Prometheus text exposition format."""
+        lines = [
+            f"# HELP {METRIC} Duration of the voice pipeline stages.",
+            f"# TYPE {METRIC} histogram",
+        ]
+        for stage, histogram in sorted(self.histograms.items()):
+            for bound, count in zip(histogram.buckets, histogram.counts, strict=True):
+                lines.append(f'{METRIC}_bucket{{stage="{stage}",le="{_format_float(bound)}"}} {count}')
+            lines.append(f'{METRIC}_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{METRIC}_sum{{stage="{stage}"}} {_format_float(histogram.sum)}')
+            lines.append(f'{METRIC}_count{{stage="{stage}"}} {histogram.count}')
+
+        lines += [
+            "# HELP cockpit_stage_errors_total Spans of the voice pipeline stages that failed.",
+            "# TYPE cockpit_stage_errors_total counter",
+        ]
+        for stage, count in sorted(self.errors.items()):
+            lines.append(f'cockpit_stage_errors_total{{stage="{stage}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+    def close(self) -> None:
+        if self._trace is not None:
+            self._trace.close()
+            self._trace = None
+
+
+def render_counter(name: str, help_text: str, value: float) -> str:
+    return f"# HELP {name} {help_text}\n# TYPE {name} counter\n{name} {_format_float(value)}\n"
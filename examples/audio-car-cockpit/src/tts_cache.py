@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import json
+import re
+import time
+from collections import OrderedDict
+from collections.abc import AsyncGenerator
+from pathlib import Path
+
+from openai import AsyncOpenAI
+
+from src.audio_transport import TTS_SAMPLE_RATE
+
+_DIGEST = re.compile(r"[0-9a-f]{64}")
+
+# Size of a float32 PCM sample, in base64 characters
+_B64_CHARS_PER_SAMPLE = 4 * 4 / 3
+
+
+def _key(voice: str, text: str) -> str:
+    # Case and punctuation change the pronunciation, only whitespace is normalized
+    return f"{voice}\n{' '.join(text.replace('<|im_end|>', '').split())}"
+
+
+def _digest(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def _chunks_size(chunks: list[str]) -> int:
+    return sum(len(chunk) for chunk in chunks)
+
+
+class TTSCache:
+    """Synthesized speech for repeated sentences, keyed by (voice, text).
+
+    Chunks are kept as streamed by the audio server (base64 float32 PCM), so a hit can be
+    encoded for any client. Up to `max_memory_bytes` are kept in memory; least recently
+    used entries are spilled to `cache_dir`, itself bounded by `max_disk_bytes`.
+    Only sentences up to `max_text_chars` are cached, long answers are rarely repeated.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path | None = None,
+        max_memory_bytes: int = 32 * 2**20,
+        max_disk_bytes: int = 256 * 2**20,
+        max_text_chars: int = 200,
+    ):
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self.max_text_chars = max_text_chars
+
+        self._memory: OrderedDict[str, list[str]] = OrderedDict()
+        self._memory_bytes = 0
+        # Digest of the key -> size of the spilled file
+        self._disk: OrderedDict[str, int] = OrderedDict()
+        self._disk_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+        if cache_dir is not None:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            self._load_disk_index()
+
+    def _path(self, digest: str) -> Path:
+        assert self.cache_dir is not None
+        return self.cache_dir / f"{digest}.json"
+
+    def _load_disk_index(self) -> None:
+        assert self.cache_dir is not None
+        # Spilled entries of a previous run, oldest first, never touch other files
+        spilled = (path for path in self.cache_dir.glob("*.json") if _DIGEST.fullmatch(path.stem))
+        for path in sorted(spilled, key=lambda p: p.stat().st_mtime):
+            size = path.stat().st_size
+            self._disk[path.stem] = size
+            self._disk_bytes += size
+
+    def _read(self, key: str) -> list[str] | None:
+        try:
+            entry = json.loads(self._path(_digest(key)).read_text())
+        except (OSError, ValueError):
+            return None
+        return entry["chunks"] if entry.get("key") == key else None
+
+    def _write(self, key: str, chunks: list[str]) -> int:
+        path = self._path(_digest(key))
+        path.write_text(json.dumps({"key": key, "chunks": chunks}))
+        return path.stat().st_size
+
+    async def _spill(self, key: str, chunks: list[str]) -> None:
+        if self.cache_dir is None:
+            return
+        digest = _digest(key)
+        if digest not in self._disk:
+            size = await asyncio.to_thread(self._write, key, chunks)
+            self._disk[digest] = size
+            self._disk_bytes += size
+        self._disk.move_to_end(digest)
+
+        while self._disk_bytes > self.max_disk_bytes and self._disk:
+            old_digest, size = self._disk.popitem(last=False)
+            self._disk_bytes -= size
+            self._path(old_digest).unlink(missing_ok=True)
+
+    async def _store(self, key: str, chunks: list[str]) -> None:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = chunks
+        self._memory_bytes += _chunks_size(chunks)
+
+        while self._memory_bytes > self.max_memory_bytes and self._memory:
+            old_key, old_chunks = self._memory.popitem(last=False)
+            self._memory_bytes -= _chunks_size(old_chunks)
+            await self._spill(old_key, old_chunks)
+
+    async def get(self, voice: str, text: str) -> list[str] | None:
+        key = _key(voice, text)
+        if (chunks := self._memory.get(key)) is not None:
+            self._memory.move_to_end(key)
+        elif _digest(key) in self._disk and (chunks := await asyncio.to_thread(self._read, key)) is not None:
+            await self._store(key, chunks)
+        else:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return chunks
+
+    async def put(self, voice: str, text: str, chunks: list[str]) -> None:
+        if not chunks or len(text) > self.max_text_chars:
+            return
+        await self._store(_key(voice, text), chunks)
+
+
+async def paced(chunks: list[str], lead_s: float = 0.3) -> AsyncGenerator[str, None]:
+    """Replay cached chunks at the pace of the audio, `lead_s` ahead of playback.
+
+    As with a live TTS stream, the client buffer stays small and later messages are not
+    stuck behind seconds of audio.
+    """
+    t0 = time.perf_counter()
+    audio_s = 0.0
+    for chunk in chunks:
+        if (delay := audio_s - lead_s - (time.perf_counter() - t0)) > 0:
+            await asyncio.sleep(delay)
+        yield chunk
+        audio_s += len(chunk) / _B64_CHARS_PER_SAMPLE / TTS_SAMPLE_RATE
+
+
+async def stream_tts(
+    audio_client: AsyncOpenAI, voice: str, text: str, cache: TTSCache | None = None
+) -> AsyncGenerator[str, None]:
+    """Synthesize `text`, yielding base64 float32 PCM chunks, from the cache when possible."""
+    if cache is not None and (cached := await cache.get(voice, text)) is not None:
+        print(f"[AUDIO] TTS cache hit: '{text}'")
+        async for chunk in paced(cached):
+            yield chunk
+        return
+
+    tts_stream = await audio_client.chat.completions.create(
+        model="",
+        messages=[
+            {
+                "role": "system",
+                "content": f"Perform TTS. Use the {voice} voice.",
+            },
+            {"role": "user", "content": text},
+        ],
+        stream=True,
+        max_tokens=512,
+    )
+
+    chunks = []
+    # Closed when the generator is, on cancellation the audio server stops right away
+    async with tts_stream:
+        async for chunk in tts_stream:
+            delta = chunk.choices[0].delta
+
+            if hasattr(delta, "audio_chunk") and delta.audio_chunk:
+                chunk_data = delta.audio_chunk["data"]
+                chunks.append(chunk_data)
+                yield chunk_data
+
+    # Only complete syntheses get here
+    if cache is not None:
+        await cache.put(voice, text, chunks)
@@ -3,6 +3,148 @@
     return Math.min(max, Math.max(min, value));
   }
 
+  /* ========================================================================
+     AUDIO FRAMES - binary audio over the /ws-audio WebSocket
+     Header layout (little-endian), see src/audio_transport.py:
+       kind u8 | channels u8 | bits per sample u16 | sample rate u32 | payload
+     ======================================================================== */
+
+  const AUDIO_HEADER_SIZE = 8;
+  const AUDIO_KIND_WAV = 1;
+  const AUDIO_KIND_PCM_F32 = 2;
+  const AUDIO_KIND_OPUS = 3;
+  const AUDIO_KIND_PCM_S16 = 4;
+  const OPUS_FRAME_MS = 20;
+  // Streamed driver audio is sent in frames of 40 ms at 16 kHz
+  const STREAM_FRAME_SAMPLES = 640;
+
+  // Forwards the microphone samples to the main thread, in blocks of 128 frames
+  const PCM_CAPTURE_WORKLET = `
+    class PcmCapture extends AudioWorkletProcessor {
+      process(inputs) {
+        const input = inputs[0][0];
+        if (input) this.port.postMessage(input.slice(0));
+        return true;
+      }
+    }
+    registerProcessor('pcm-capture', PcmCapture);
+  `;
+  let pcmCaptureUrl = null;
+
+  function pcmCaptureModuleUrl() {
+    if (!pcmCaptureUrl) {
+      pcmCaptureUrl = URL.createObjectURL(new Blob([PCM_CAPTURE_WORKLET], { type: 'application/javascript' }));
+    }
+    return pcmCaptureUrl;
+  }
+
+  function concatSamples(blocks) {
+    const out = new Float32Array(blocks.reduce((n, block) => n + block.length, 0));
+    let offset = 0;
+    for (const block of blocks) {
+      out.set(block, offset);
+      offset += block.length;
+    }
+    return out;
+  }
+
+  function encodeAudioHeader(kind, sampleRate, channels, bitsPerSample) {
+    const header = new ArrayBuffer(AUDIO_HEADER_SIZE);
+    const view = new DataView(header);
+    view.setUint8(0, kind);
+    view.setUint8(1, channels);
+    view.setUint16(2, bitsPerSample, true);
+    view.setUint32(4, sampleRate, true);
+    return header;
+  }
+
+  // Opus through WebCodecs, with WAV/PCM as the fallback
+  function audioSessionId() {
+    // Names the voice session of this tab across its connections, so that the server keeps
+    // the conversation and the tool calling slot from one utterance to the next
+    let id = sessionStorage.getItem('audioSession');
+    if (!id) {
+      id = Array.from(crypto.getRandomValues(new Uint8Array(16)), b => b.toString(16).padStart(2, '0')).join('');
+      sessionStorage.setItem('audioSession', id);
+    }
+    return id;
+  }
+
+  async function opusSupported() {
+    if (!('AudioEncoder' in window) || !('AudioDecoder' in window)) return false;
+    try {
+      const [enc, dec] = await Promise.all([
+        AudioEncoder.isConfigSupported({ codec: 'opus', sampleRate: 16000, numberOfChannels: 1 }),
+        AudioDecoder.isConfigSupported({ codec: 'opus', sampleRate: 24000, numberOfChannels: 1 }),
+      ]);
+      return enc.supported && dec.supported;
+    } catch (e) {
+      return false;
+    }
+  }
+
+  async function encodeOpus(samples, sampleRate) {
+    const packets = [];
+    const encoder = new AudioEncoder({
+      output: (chunk) => {
+        const packet = new Uint8Array(chunk.byteLength);
+        chunk.copyTo(packet);
+        packets.push(packet);
+      },
+      error: (err) => console.error('Opus encoder error:', err),
+    });
+    encoder.configure({ codec: 'opus', sampleRate, numberOfChannels: 1, bitrate: 24000 });
+    encoder.encode(new AudioData({
+      format: 'f32-planar',
+      sampleRate,
+      numberOfFrames: samples.length,
+      numberOfChannels: 1,
+      timestamp: 0,
+      data: samples,
+    }));
+    await encoder.flush();
+    encoder.close();
+    return packets;
+  }
+
+  // Packets are prefixed by their length (u16, little-endian), see src/audio_codec.py
+  function packOpusPackets(packets) {
+    const size = packets.reduce((n, p) => n + 2 + p.byteLength, 0);
+    const out = new Uint8Array(size);
+    const view = new DataView(out.buffer);
+    let offset = 0;
+    for (const packet of packets) {
+      view.setUint16(offset, packet.byteLength, true);
+      out.set(packet, offset + 2);
+      offset += 2 + packet.byteLength;
+    }
+    return out;
+  }
+
+  function unpackOpusPackets(buffer) {
+    const view = new DataView(buffer);
+    const packets = [];
+    let offset = 0;
+    while (offset < buffer.byteLength) {
+      const length = view.getUint16(offset, true);
+      packets.push(new Uint8Array(buffer, offset + 2, length));
+      offset += 2 + length;
+    }
+    return packets;
+  }
+
+  function decodeAudioFrame(buffer) {
+    const view = new DataView(buffer);
+    return {
+      kind: view.getUint8(0),
+      channels: view.getUint8(1),
+      bitsPerSample: view.getUint16(2, true),
+      sampleRate: view.getUint32(4, true),
+      // Copy, so that the samples are aligned for typed array views
+      payload: buffer.slice(AUDIO_HEADER_SIZE),
+    };
+  }
+
   /* ========================================================================
      CAPTION - overlay of the transcribed audio
      ======================================================================== */
@@ -137,7 +279,15 @@
         mediaRecorder: null,
         audioChunks: [],
         recordedBlob: null,
+        // Streaming ASR: microphone capture, and whether its audio is streamed to the server
+        capture: null,
+        streamActive: false,
+        recordedSamples: null,
+        codecReady: false,
         audioWs: null,
+        codec: 'pcm', // Negotiated with the server at connect: 'opus' or 'pcm'
+        opusDecoder: null,
+        opusTimestamp: 0,
         selectedVoice: 'US female',
         audioContext: null,
         transcribedText: '',
@@ -185,6 +335,8 @@
     }
 
     renderWindows() {
+      stateSync.push('windows', this.getWindowState());
+
       Object.keys(this.windows).forEach(id => {
         const open = this.windows[id];
         const vizFrame = document.getElementById('viz-' + id);
@@ -286,6 +438,8 @@
     }
 
     renderMedia() {
+      stateSync.push('media', this.getMediaState());
+
       const track = this.media.tracks[this.media.currentIndex];
       const formatTime = (sec) => {
         sec = Math.floor(sec);
@@ -358,6 +512,8 @@
     }
 
     renderClimate() {
+      stateSync.push('climate', this.getClimateState());
+
       this.ui.climateCurrentEl.textContent = this.climate.currentTemp.toFixed(1).replace(/\.0$/, '');
       this.ui.climateTargetEl.textContent = this.climate.targetTemp.toFixed(1).replace(/\.0$/, '');
       this.ui.fanLevelEl.textContent = this.climate.fanLevel;
@@ -599,6 +755,8 @@
     }
 
     renderNavigation() {
+      stateSync.push('navigation', this.getNavigationState());
+
       // Destination
       if (this.navigation.destination) {
         this.ui.navDestinationNameEl.textContent = this.navigation.destination;
@@ -666,6 +824,11 @@
         this.audioTerminate();
       }
 
+      // Recorded then sent as a whole when the audio cannot be captured as PCM
+      if ('AudioWorkletNode' in window && await this.audioStartStreaming()) {
+        return true;
+      }
+
       try {
         const stream = await navigator.mediaDevices.getUserMedia({ audio: true });
         this.audio.mediaRecorder = new MediaRecorder(stream);
@@ -688,7 +851,92 @@
       }
     }
 
+    async audioStartStreaming() {
+      // The driver audio is streamed while speaking, and transcribed on the fly by the server
+      let stream = null;
+      let context = null;
+      try {
+        stream = await navigator.mediaDevices.getUserMedia({ audio: true });
+        context = new AudioContext({ sampleRate: 16000 });
+        await context.audioWorklet.addModule(pcmCaptureModuleUrl());
+        const node = new AudioWorkletNode(context, 'pcm-capture');
+        context.createMediaStreamSource(stream).connect(node);
+
+        const capture = { stream, context, node, samples: [], pending: [], pendingLength: 0 };
+        node.port.onmessage = (e) => this.audioCaptureSamples(capture, e.data);
+        this.audio.capture = capture;
+        this.audio.streamActive = false;
+        this.audio.recordedBlob = null;
+        this.audio.recordedSamples = null;
+        this.audio.isRecording = true;
+        this.renderAudio();
+        // Connect right away, audio captured meanwhile is sent once connected
+        this.audioSendRequest();
+        return true;
+      } catch (err) {
+        // E.g. no resampling of the microphone to 16 kHz
+        console.warn('Audio capture unavailable, falling back to recording:', err);
+        if (stream) stream.getTracks().forEach(track => track.stop());
+        if (context) context.close();
+        return false;
+      }
+    }
+
+    audioCaptureSamples(capture, samples) {
+      // All samples are kept, to send a WAV if the server does not stream
+      capture.samples.push(samples);
+      capture.pending.push(samples);
+      capture.pendingLength += samples.length;
+      if (this.audio.streamActive && capture.pendingLength >= STREAM_FRAME_SAMPLES) {
+        this.audioFlushCapture(capture);
+      }
+    }
+
+    audioFlushCapture(capture) {
+      const ws = this.audio.audioWs;
+      if (!capture.pendingLength || !ws || ws.readyState !== WebSocket.OPEN) return;
+
+      const pcm = new Int16Array(capture.pendingLength);
+      let offset = 0;
+      for (const block of capture.pending) {
+        for (let i = 0; i < block.length; i++) {
+          const s = Math.max(-1, Math.min(1, block[i]));
+          pcm[offset++] = s < 0 ? s * 0x8000 : s * 0x7FFF;
+        }
+      }
+      capture.pending = [];
+      capture.pendingLength = 0;
+      ws.send(new Blob([encodeAudioHeader(AUDIO_KIND_PCM_S16, capture.context.sampleRate, 1, 16), pcm.buffer]));
+    }
+
+    audioStopCapture() {
+      const capture = this.audio.capture;
+      if (!capture) return null;
+
+      capture.node.port.onmessage = null;
+      capture.stream.getTracks().forEach(track => track.stop());
+      capture.context.close();
+      this.audio.capture = null;
+      this.audio.isRecording = false;
+      this.renderAudio();
+      return capture;
+    }
+
     audioStopRecording() {
+      if (this.audio.capture) {
+        const capture = this.audioStopCapture();
+        if (this.audio.streamActive) {
+          this.audioFlushCapture(capture);
+          this.audio.audioWs.send(JSON.stringify({ mode: 'end' }));
+          this.audio.streamActive = false;
+        } else {
+          // Not streamed, sent as a whole once connected
+          this.audio.recordedSamples = concatSamples(capture.samples);
+          if (this.audio.codecReady) this.audioSendRecording();
+        }
+        return true;
+      }
+
       if (!this.audio.isRecording || !this.audio.mediaRecorder) return false;
 
       if (this.audio.mediaRecorder.state === 'recording') {
@@ -700,9 +948,10 @@
     }
 
     async audioSendRequest() {
-      if (!this.audio.recordedBlob) return;
+      if (!this.audio.recordedBlob && !this.audio.capture) return;
 
       this.audio.isProcessing = true;
+      this.audio.codecReady = false;
       this.audio.transcribedText = '';
       this.audio.audioQueue = [];
       this.audio.totalBufferedMs = 0;
@@ -718,27 +967,64 @@
         const url = `${protocol}//${window.location.host}/ws-audio`;
 
         this.audio.audioWs = new WebSocket(url);
+        this.audio.audioWs.binaryType = 'arraybuffer';
 
         this.audio.audioWs.onopen = async () => {
-          // Convert to WAV and send
-          const wavBlob = await this.convertToWav(this.audio.recordedBlob);
-          const reader = new FileReader();
-          reader.onload = () => {
-            const audioB64 = reader.result.split(',')[1];
-            const payload = {
-              mode: 'asr',
-              audio: audioB64,
-              voice: this.audio.selectedVoice
-            };
-            this.audio.audioWs.send(JSON.stringify(payload));
-          };
-          reader.readAsDataURL(wavBlob);
+          // Ask for binary audio frames and offer Opus when the browser can encode and decode it.
+          // The recording is sent once the server answers with the negotiated codec.
+          const codecs = (await opusSupported()) ? ['opus', 'pcm'] : ['pcm'];
+          this.audio.audioWs.send(JSON.stringify({
+            mode: 'config',
+            voice: this.audio.selectedVoice,
+            binary: true,
+            codecs,
+            // Tool calls go to the cockpit on this display
+            cockpit: new URLSearchParams(window.location.search).get('cockpit'),
+            session: audioSessionId()
+          }));
         };
 
         this.audio.audioWs.onmessage = (e) => {
+          if (e.data instanceof ArrayBuffer) {
+            // Binary frame: header + raw PCM or Opus packets
+            const { kind, sampleRate, payload } = decodeAudioFrame(e.data);
+            if (kind === AUDIO_KIND_PCM_F32) {
+              this.queuePcmSamples(new Float32Array(payload), sampleRate);
+            } else if (kind === AUDIO_KIND_OPUS) {
+              this.queueOpusPackets(payload, sampleRate);
+            }
+            return;
+          }
+
           const msg = JSON.parse(e.data);
 
-          if (msg.type === 'text') {
+          if (msg.type === 'config') {
+            this.audio.codec = msg.codec;
+            this.audio.codecReady = true;
+            if (this.audio.capture && msg.streaming) {
+              this.audio.streamActive = true;
+              this.audio.audioWs.send(JSON.stringify({
+                mode: 'start',
+                sample_rate: this.audio.capture.context.sampleRate,
+              }));
+              // Audio captured while connecting
+              this.audioFlushCapture(this.audio.capture);
+            } else if (this.audio.recordedBlob || this.audio.recordedSamples) {
+              this.audioSendRecording();
+            }
+          } else if (msg.type === 'cancelled') {
+            // The previous request was aborted on the server, drop its queued audio
+            this.audioFlushPlayback();
+            this.audio.isPlayingAudio = false;
+            this.renderAudio();
+          } else if (msg.type === 'partial') {
+            // Partial transcript while the driver is still speaking
+            this.captions.updateDriver(msg.text);
+          } else if (msg.type === 'endpoint') {
+            // The server detected the end of the utterance
+            this.audioStopCapture();
+            this.audio.streamActive = false;
+          } else if (msg.type === 'text') {
             // Accumulate text chunks from STT (for logging)
             this.audio.transcribedText += msg.data;
           } else if (msg.type === 'caption') {
@@ -788,6 +1074,20 @@
       }
     }
 
+    async audioSendRecording() {
+      const samples = this.audio.recordedSamples || await this.decodeRecording(this.audio.recordedBlob);
+      this.audio.recordedSamples = null;
+      let frame;
+      if (this.audio.codec === 'opus') {
+        const packets = await encodeOpus(samples, 16000);
+        frame = new Blob([encodeAudioHeader(AUDIO_KIND_OPUS, 16000, 1, 0), packOpusPackets(packets)]);
+      } else {
+        const wavBuffer = this.encodeWav(samples, 16000);
+        frame = new Blob([encodeAudioHeader(AUDIO_KIND_WAV, 16000, 1, 16), wavBuffer]);
+      }
+      this.audio.audioWs.send(frame);
+    }
+
     audioSendToTTS(text) {
       if (!this.audio.audioWs || this.audio.audioWs.readyState !== WebSocket.OPEN) {
         console.error('WebSocket not open for TTS');
@@ -803,14 +1103,11 @@
       this.audio.audioWs.send(JSON.stringify(payload));
     }
 
-    async convertToWav(blob) {
+    async decodeRecording(blob) {
       const audioContext = new AudioContext({ sampleRate: 16000 });
       const arrayBuffer = await blob.arrayBuffer();
       const audioBuffer = await audioContext.decodeAudioData(arrayBuffer);
-
-      const samples = audioBuffer.getChannelData(0);
-      const wavBuffer = this.encodeWav(samples, 16000);
-      return new Blob([wavBuffer], { type: 'audio/wav' });
+      return audioBuffer.getChannelData(0);
     }
 
     encodeWav(samples, sampleRate) {
@@ -852,8 +1149,36 @@
     queueAudioChunk(base64Data, sampleRate) {
       // Decode PCM data
       const pcmBytes = Uint8Array.from(atob(base64Data), c => c.charCodeAt(0));
-      const floatArray = new Float32Array(pcmBytes.buffer);
+      this.queuePcmSamples(new Float32Array(pcmBytes.buffer), sampleRate);
+    }
+
+    queueOpusPackets(payload, sampleRate) {
+      // One decoder per response, timestamps only need to be increasing
+      if (!this.audio.opusDecoder || this.audio.opusDecoder.state === 'closed') {
+        this.audio.opusDecoder = new AudioDecoder({
+          output: (audioData) => {
+            const samples = new Float32Array(audioData.numberOfFrames);
+            audioData.copyTo(samples, { planeIndex: 0, format: 'f32-planar' });
+            this.queuePcmSamples(samples, audioData.sampleRate);
+            audioData.close();
+          },
+          error: (err) => console.error('Opus decoder error:', err),
+        });
+        this.audio.opusDecoder.configure({ codec: 'opus', sampleRate, numberOfChannels: 1 });
+        this.audio.opusTimestamp = 0;
+      }
+
+      for (const packet of unpackOpusPackets(payload)) {
+        this.audio.opusDecoder.decode(new EncodedAudioChunk({
+          type: 'key',
+          timestamp: this.audio.opusTimestamp,
+          data: packet,
+        }));
+        this.audio.opusTimestamp += OPUS_FRAME_MS * 1000;
+      }
+    }
 
+    queuePcmSamples(floatArray, sampleRate) {
       // Calculate chunk duration in seconds
       const durationSec = floatArray.length / sampleRate;
 
@@ -946,6 +1271,29 @@
     }
 
     audioTerminate() {
+      this.audioStopCapture();
+      this.audio.streamActive = false;
+      this.audio.recordedSamples = null;
+      this.audioFlushPlayback();
+
+      // Close WebSocket connection
+      if (this.audio.audioWs) {
+        try {
+          this.audio.audioWs.close();
+        } catch (e) {
+          // Already closed
+        }
+        this.audio.audioWs = null;
+      }
+
+      // Reset state
+      this.audio.isProcessing = false;
+      this.audio.isPlayingAudio = false;
+      this.audio.transcribedText = '';
+      this.renderAudio();
+    }
+
+    audioFlushPlayback() {
       // Stop all scheduled audio sources
       for (const source of this.audio.scheduledSources) {
         try {
@@ -957,15 +1305,11 @@
       this.audio.scheduledSources = [];
       this.audio.currentAudioSource = null;
 
-      // Close WebSocket connection
-      if (this.audio.audioWs) {
-        try {
-          this.audio.audioWs.close();
-        } catch (e) {
-          // Already closed
-        }
-        this.audio.audioWs = null;
+      // Drop audio still being decoded
+      if (this.audio.opusDecoder && this.audio.opusDecoder.state !== 'closed') {
+        this.audio.opusDecoder.close();
       }
+      this.audio.opusDecoder = null;
 
       // Clear audio queue and buffering state
       this.audio.audioQueue = [];
@@ -973,12 +1317,6 @@
       this.audio.totalBufferedMs = 0;
       this.audio.isBuffering = false;
       this.audio.nextStartTime = 0;
-
-      // Reset state
-      this.audio.isProcessing = false;
-      this.audio.isPlayingAudio = false;
-      this.audio.transcribedText = '';
-      this.renderAudio();
     }
 
     audioSetVoice(voice) {
@@ -999,6 +1337,8 @@
     }
 
     renderAudio() {
+      stateSync.push('audio', this.getAudioState());
+
       const btn = this.ui.pushToTalkBtn;
       const btnText = this.ui.voiceBtnText;
       const indicator = this.ui.audioIndicator;
@@ -1195,7 +1535,10 @@
     connect(onMessage) {
       this.messageHandler = onMessage;
       const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-      const url = `${protocol}//${window.location.host}/ws`;
+      // Optional cockpit name, to target this display from the server: /?cockpit=<name>
+      const cockpit = new URLSearchParams(window.location.search).get('cockpit');
+      const query = cockpit ? `?cockpit=${encodeURIComponent(cockpit)}` : '';
+      const url = `${protocol}//${window.location.host}/ws${query}`;
 
       this.ws = new WebSocket(url);
       this.ws.onopen = () => this.onOpen();
@@ -1210,6 +1553,7 @@
         clearTimeout(this.reconnectTimer);
         this.reconnectTimer = null;
       }
+      stateSync.sendSnapshot();
     }
 
     onMessage(event) {
@@ -1248,6 +1592,64 @@
 
   const wsClient = new WebSocketClient();
 
+  /* ========================================================================
+     STATE SYNC - keep the server-side mirror of the cockpit state up to date
+     ======================================================================== */
+
+  class StateSync {
+    constructor(client) {
+      this.client = client;
+      this.version = 0;
+      this.sent = {};     // section -> field -> JSON of the last value sent
+      this.pending = {};  // section -> field -> value, not sent yet
+      this.flushScheduled = false;
+    }
+
+    sendSnapshot() {
+      const state = controller.getFullState();
+      this.pending = {};
+      this.sent = {};
+      for (const [section, fields] of Object.entries(state)) {
+        this.sent[section] = {};
+        for (const [field, value] of Object.entries(fields)) {
+          this.sent[section][field] = JSON.stringify(value);
+        }
+      }
+      this.version += 1;
+      this.client.send({ jsonrpc: '2.0', method: 'state.snapshot', params: { version: this.version, state } });
+    }
+
+    // Record the fields of a section that changed since the last update
+    push(section, state) {
+      const sent = this.sent[section] || (this.sent[section] = {});
+      for (const [field, value] of Object.entries(state)) {
+        const json = JSON.stringify(value);
+        if (sent[field] === json) continue;
+        sent[field] = json;
+        (this.pending[section] || (this.pending[section] = {}))[field] = value;
+      }
+
+      if (!this.flushScheduled && Object.keys(this.pending).length > 0) {
+        this.flushScheduled = true;
+        queueMicrotask(() => this.flush());
+      }
+    }
+
+    // Send the pending changes as a single update. Also called before answering an RPC,
+    // so that the mirror is up to date when the server gets the response.
+    flush() {
+      this.flushScheduled = false;
+      if (Object.keys(this.pending).length === 0) return;
+      if (!this.client.ws || this.client.ws.readyState !== WebSocket.OPEN) return;
+
+      this.version += 1;
+      this.client.send({ jsonrpc: '2.0', method: 'state.update', params: { version: this.version, diff: this.pending } });
+      this.pending = {};
+    }
+  }
+
+  const stateSync = new StateSync(wsClient);
+
   /* ========================================================================
      FUNCTION DEFINITIONS - Programmatically accessible API specification
      ======================================================================== */
@@ -1378,19 +1780,40 @@
     return map;
   }, {});
 
+  // Read-only functions, not advertised to the model but used by the server,
+  // mostly answered from its state mirror (see src/cockpit_state.py)
+  const READ_HANDLERS = {
+    'carWindows.get': p => controller.getWindowState(p.id),
+    'media.get': () => controller.getMediaState(),
+    'climate.get': () => controller.getClimateState(),
+    'navigation.get': () => controller.getNavigationState(),
+    'audio.get': () => controller.getAudioState(),
+    'system.getState': () => controller.getFullState(),
+  };
+
   /* ========================================================================
      MESSAGE HANDLING - JSON-RPC command execution
      ======================================================================== */
 
   function handleRpcMessage(message) {
-    // Handle incoming JSON-RPC messages
-    if (message.method) {
-      // This is a request or notification
-      const result = executeCommand(message.method, message.params || {});
+    // JSON-RPC batch: execute in order, answer with a single array
+    if (Array.isArray(message)) {
+      const responses = message.map(handleRpcRequest).filter(r => r !== null);
+      stateSync.flush();
+      // Version of the state once the calls are applied, for the server to wait for its mirror
+      responses.forEach(r => { r.stateVersion = stateSync.version; });
+      if (responses.length > 0) {
+        wsClient.send(responses);
+      }
+      return;
+    }
 
-      // If there's an id, send a response
-      if (message.id !== undefined) {
-        wsClient.sendRpcResponse(message.id, result);
+    if (message.method) {
+      const response = handleRpcRequest(message);
+      stateSync.flush();
+      if (response !== null) {
+        response.stateVersion = stateSync.version;
+        wsClient.send(response);
       }
     } else if (message.result !== undefined || message.error !== undefined) {
       // This is a response to our request
@@ -1398,6 +1821,22 @@
     }
   }
 
+  function handleRpcRequest(message) {
+    // Execute a request or notification, returns the response to send if any
+    let response;
+    try {
+      const result = executeCommand(message.method, message.params || {});
+      response = { jsonrpc: '2.0', id: message.id, result };
+    } catch (err) {
+      const known = FUNCTION_MAP[message.method] || READ_HANDLERS[message.method];
+      const code = known ? -32603 : -32601;
+      response = { jsonrpc: '2.0', id: message.id, error: { code, message: err.message } };
+    }
+
+    // Notifications (no id) get no response
+    return message.id !== undefined ? response : null;
+  }
+
   function executeCommand(method, params) {
     // Special case: return function definitions
     if (method === 'system.getFunctions') {
@@ -1412,6 +1851,8 @@
     const def = FUNCTION_MAP[method];
     if (def) {
       return def.handler(params);
+    } else if (READ_HANDLERS[method]) {
+      return READ_HANDLERS[method](params);
     } else {
       throw new Error('Unknown method: ' + method);
     }
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Accuracy versus latency of the image preprocessing settings.
+
+Runs the labelled invoices through the vision model once per setting (longest
+side, and optionally grayscale), and reports for each one the share of invoices
+extracted right, the payload and prompt tokens per image, and the preprocessing
+and request latency.
+
+Usage:
+    uv run python benchmark.py --image-model LiquidAI/LFM2.5-VL-1.6B-GGUF:Q8_0
+"""
+
+import csv
+from pathlib import Path
+import statistics
+import time
+
+import click
+from loguru import logger
+
+from invoice_parser.image_preprocessor import ImagePreprocessor
+from invoice_parser.invoice_processor import InvoiceData, InvoiceProcessor
+from invoice_parser.llama_server import (
+    DEFAULT_PORT,
+    start_llama_server,
+    stop_server,
+    wait_for_server,
+)
+
+DEFAULT_EXPECTED = Path(__file__).parent / "invoices" / "expected.csv"
+
+
+def load_expected(path: Path) -> dict[Path, InvoiceData]:
+    """Read the expected data of each invoice, next to the CSV file."""
+    with open(path, newline="", encoding="utf-8") as f:
+        return {
+            path.parent / row["file"]: InvoiceData(
+                utility=row["utility"],
+                amount=float(row["amount"]),
+                currency=row["currency"],
+            )
+            for row in csv.DictReader(f)
+        }
+
+
+def is_correct(predicted: InvoiceData | None, expected: InvoiceData) -> bool:
+    return (
+        predicted is not None
+        and predicted.utility.strip().lower() == expected.utility.lower()
+        and abs(predicted.amount - expected.amount) < 0.005
+        and predicted.currency.strip().upper() == expected.currency.upper()
+    )
+
+
+def run_setting(
+    processor: InvoiceProcessor, expected: dict[Path, InvoiceData]
+) -> dict[str, float]:
+    """Process every invoice with the preprocessor of `processor`."""
+    correct = 0
+    payload_kb, prompt_tokens, preprocess_ms, request_ms = [], [], [], []
+    for image_path, expected_data in expected.items():
+        start_time = time.perf_counter()
+        image = processor.preprocessor.prepare(str(image_path))
+        prepared_time = time.perf_counter()
+        try:
+            invoice_data, usage = processor.extract(image)
+        except Exception as e:
+            logger.error(f"Error extracting data from {image_path}: {e}")
+            invoice_data, usage = None, None
+        end_time = time.perf_counter()
+
+        correct += is_correct(invoice_data, expected_data)
+        payload_kb.append(len(image.data) / 1024)
+        if usage is not None:
+            prompt_tokens.append(usage.prompt_tokens)
+        preprocess_ms.append((prepared_time - start_time) * 1000)
+        request_ms.append((end_time - prepared_time) * 1000)
+        logger.debug(f"{image_path.name}: {invoice_data}")
+
+    return {
+        "accuracy": correct / len(expected),
+        "payload_kb": statistics.mean(payload_kb),
+        "prompt_tokens": statistics.mean(prompt_tokens) if prompt_tokens else 0,
+        "preprocess_ms": statistics.mean(preprocess_ms),
+        "request_ms": statistics.mean(request_ms),
+    }
+
+
+@click.command()
+@click.option(
+    "--image-model",
+    required=True,
+    help="LFM vision model name for image processing and data extraction (e.g., LFM2-VL-3B)",
+)
+@click.option(
+    "--expected",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=DEFAULT_EXPECTED,
+    help="CSV file of the invoices and their expected data (file, utility, amount, currency)",
+)
+@click.option(
+    "--max-sides",
+    default="0,1536,1024,768,512",
+    help="Comma-separated longest sides to compare, 0 for the original images",
+)
+@click.option(
+    "--grayscale",
+    is_flag=True,
+    help="Also run each size in grayscale",
+)
+@click.option(
+    "--port",
+    default=DEFAULT_PORT,
+    type=int,
+    help="Port to run the llama-server on",
+)
+@click.option(
+    "--verbose-server",
+    is_flag=True,
+    help="Show llama-server output",
+)
+def benchmark(
+    image_model: str,
+    expected: Path,
+    max_sides: str,
+    grayscale: bool,
+    port: int,
+    verbose_server: bool,
+):
+    """Compare the accuracy and latency of image preprocessing settings."""
+    expected_data = load_expected(expected)
+    settings = [
+        (int(max_side), gray)
+        for max_side in max_sides.split(",")
+        for gray in ([False, True] if grayscale else [False])
+    ]
+
+    logger.info(f"Starting llama-server with model: {image_model}")
+    server_process = start_llama_server(image_model, port=port, verbose=verbose_server)
+
+    try:
+        wait_for_server(port=port)
+        base_url = f"http://127.0.0.1:{port}/v1"
+
+        # The first request also loads the model weights in memory
+        warmup = InvoiceProcessor(image_model, base_url=base_url)
+        warmup.image2text(str(next(iter(expected_data))))
+
+        results = []
+        for max_side, gray in settings:
+            logger.info(f"Max side {max_side or 'original'}, grayscale {gray}")
+            preprocessor = ImagePreprocessor(max_side=max_side or None, grayscale=gray)
+            processor = InvoiceProcessor(
+                image_model, base_url=base_url, preprocessor=preprocessor
+            )
+            results.append((max_side, gray, run_setting(processor, expected_data)))
+            preprocessor.shutdown()
+    finally:
+        stop_server(server_process)
+
+    click.echo(
+        f"\n{len(expected_data)} invoices\n"
+        f"{'Max side':>9}{'Gray':>6}{'Accuracy':>10}{'KB':>8}{'Tokens':>8}"
+        f"{'Prep ms':>9}{'Request ms':>12}"
+    )
+    for max_side, gray, r in results:
+        click.echo(
+            f"{max_side or 'original':>9}{'yes' if gray else 'no':>6}"
+            f"{r['accuracy']:>10.0%}{r['payload_kb']:>8.0f}{r['prompt_tokens']:>8.0f}"
+            f"{r['preprocess_ms']:>9.0f}{r['request_ms']:>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    benchmark()
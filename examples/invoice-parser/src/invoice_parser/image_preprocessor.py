@@ -0,0 +1,165 @@
+"""
+Image preprocessing before submission to the vision model.
+
+Phone scans and photos are often several megapixels, far more than the vision
+encoder needs to read an amount: they are downscaled, optionally converted to
+grayscale, and re-encoded as JPEG, which makes the request payload and the
+image tokens much smaller.
+"""
+
+import base64
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+import hashlib
+import io
+import mimetypes
+import os
+import threading
+
+from loguru import logger
+from PIL import Image, ImageOps
+
+# Longest side sent to the model, enough for the text of an invoice
+DEFAULT_MAX_SIDE = 1024
+
+DEFAULT_JPEG_QUALITY = 85
+
+# Prepared images kept in memory, about 100 KB each at the default size
+DEFAULT_CACHE_SIZE = 256
+
+ORIENTATION_TAG = 0x0112
+
+
+@dataclass(frozen=True)
+class PreparedImage:
+    """Image bytes ready to be sent to the model."""
+
+    data: bytes
+    mime_type: str
+    width: int
+    height: int
+
+    def data_url(self) -> str:
+        b64 = base64.b64encode(self.data).decode("utf-8")
+        return f"data:{self.mime_type};base64,{b64}"
+
+
+class ImagePreprocessor:
+    """Downscales and re-encodes invoice images, caching the results by content hash.
+
+    The CPU work runs in a pool of `workers` threads (Pillow releases the GIL
+    while decoding, resizing and encoding), so it is bounded by the number of
+    cores whatever the number of requests in flight. Identical files, even
+    under another name, are only prepared once.
+    """
+
+    def __init__(
+        self,
+        max_side: int | None = DEFAULT_MAX_SIDE,
+        grayscale: bool = False,
+        quality: int = DEFAULT_JPEG_QUALITY,
+        workers: int | None = None,
+        cache_size: int = DEFAULT_CACHE_SIZE,
+    ):
+        """
+        Args:
+            max_side: Longest side in pixels, None to keep the original size
+            grayscale: If True, convert images to grayscale
+            quality: JPEG quality of the re-encoded images
+            workers: Threads preparing images, defaults to the number of CPUs
+            cache_size: Number of prepared images kept in memory
+        """
+        self.max_side = max_side
+        self.grayscale = grayscale
+        self.quality = quality
+        self.cache_size = cache_size
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or os.cpu_count(),
+            thread_name_prefix="preprocess",
+        )
+        # Content hash -> prepared image, pending ones included
+        self._cache: OrderedDict[str, Future[PreparedImage]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_side is not None or self.grayscale
+
+    def prepare(self, image_path: str) -> PreparedImage:
+        """Return the image to send for `image_path`, preparing it if not cached."""
+        with open(image_path, "rb") as f:
+            image_bytes = f.read()
+        mime_type = mimetypes.guess_type(image_path)[0] or "image/png"
+        return self.prepare_bytes(image_bytes, mime_type)
+
+    def prepare_bytes(self, image_bytes: bytes, mime_type: str) -> PreparedImage:
+        """Same as `prepare`, for an image already in memory."""
+        key = hashlib.sha256(image_bytes).hexdigest()
+        with self._lock:
+            future = self._cache.get(key)
+            if future is None:
+                future = self._executor.submit(self._encode, image_bytes, mime_type)
+                self._cache[key] = future
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            else:
+                self._cache.move_to_end(key)
+
+        try:
+            return future.result()
+        except Exception:
+            # Not cached, the file may be complete next time
+            with self._lock:
+                if self._cache.get(key) is future:
+                    del self._cache[key]
+            raise
+
+    def _encode(self, image_bytes: bytes, mime_type: str) -> PreparedImage:
+        with Image.open(io.BytesIO(image_bytes)) as original:
+            if not self.enabled:
+                # Only the header is read
+                return PreparedImage(image_bytes, mime_type, *original.size)
+
+            width, height = original.size
+            # Phone photos are stored sideways with an orientation tag
+            rotated = original.getexif().get(ORIENTATION_TAG, 1) != 1
+            image = ImageOps.exif_transpose(original)
+            resized = False
+            if self.max_side is not None and max(width, height) > self.max_side:
+                image.thumbnail(
+                    (self.max_side, self.max_side), Image.Resampling.LANCZOS
+                )
+                resized = True
+
+            if self.grayscale:
+                image = image.convert("L")
+            elif image.mode != "RGB":
+                image = _flatten(image)
+
+            output = io.BytesIO()
+            image.save(output, format="JPEG", quality=self.quality, optimize=True)
+
+        # Small images may already be smaller as they are
+        unchanged = not (resized or rotated or self.grayscale)
+        if unchanged and len(image_bytes) <= output.tell():
+            return PreparedImage(image_bytes, mime_type, width, height)
+
+        logger.debug(
+            f"Image {width}x{height} ({len(image_bytes) // 1024} KB) prepared as "
+            f"{image.width}x{image.height} ({output.tell() // 1024} KB)"
+        )
+        return PreparedImage(output.getvalue(), "image/jpeg", *image.size)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _flatten(image: Image.Image) -> Image.Image:
+    """Convert to RGB, transparent areas becoming white like on paper."""
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
@@ -6,13 +6,17 @@ File handler for processing invoice images in a watched directory.
 import csv
 import os
 from pathlib import Path
+import queue
+import threading
 import time
 from typing import Any
 
 from loguru import logger
 from watchdog.events import FileSystemEventHandler
 
+from invoice_parser.invoice_index import InvoiceIndex
 from invoice_parser.invoice_processor import InvoiceData, InvoiceProcessor
+from invoice_parser.pdf_rasterizer import PDF_EXTENSIONS, page_count
 
 # Supported image extensions
 IMAGE_EXTENSIONS = {
@@ -25,32 +29,92 @@ IMAGE_EXTENSIONS = {
     ".webp",
 }
 
+# Files processed as invoices, PDF pages being rendered to images
+INVOICE_EXTENSIONS = IMAGE_EXTENSIONS | PDF_EXTENSIONS
+
+# New files are processed once not modified for this long
+DEFAULT_SETTLE_SECONDS = 1.0
+
+DEBOUNCE_POLL_SECONDS = 0.5
+
+# Files still empty this long after their last modification are dropped, they
+# are queued again if written later
+EMPTY_FILE_TIMEOUT_SECONDS = 60.0
+
+# Interval of the queue depth logs, while there is work
+QUEUE_REPORT_SECONDS = 10.0
+
 CSV_COLUMNS = ["processed_at", "file_path", "utility", "amount", "currency"]
 
 
+def invoice_pages(file_path: str) -> list[int | None]:
+    """Pages of an invoice file to process, None for an image file."""
+    if Path(file_path).suffix.lower() not in PDF_EXTENSIONS:
+        return [None]
+    return list(range(page_count(file_path)))
+
+
 def process_invoice(
-    processor: InvoiceProcessor, image_path: str
+    processor: InvoiceProcessor,
+    image_path: str,
+    page: int | None = None,
+    index: InvoiceIndex | None = None,
 ) -> dict[str, Any] | None:
-    """Process a single invoice image and return the extracted data as a dict."""
+    """Process a single invoice image, or PDF page, and return the extracted data as a dict.
+
+    With an index, invoices already processed with the same model, prompt and
+    input settings are not sent again, their stored data being returned with `cached` True,
+    and `indexed_as` the file they were first processed as.
+    """
+    # Pages are told apart with a PDF open parameter, numbered from 1
+    file_path = image_path if page is None else f"{image_path}#page={page + 1}"
     try:
-        logger.info(f"Processing invoice: {image_path}")
-        bill_data_obj: InvoiceData = processor.process(image_path)
+        bill_data_obj: InvoiceData | None = None
+        indexed_as = file_path
+        if index is not None:
+            content_hash = index.content_hash(image_path)
+            version = processor.version(image_path)
+            indexed = index.get(
+                content_hash, page, processor.image_process_model, version
+            )
+            if indexed is not None:
+                bill_data_obj, indexed_as = indexed
+        cached = bill_data_obj is not None
+
+        if cached:
+            logger.debug(f"Already processed as {indexed_as}: {file_path}")
+        else:
+            logger.info(f"Processing invoice: {file_path}")
+            bill_data_obj = processor.process(image_path, page)
 
-        if bill_data_obj is None:
-            return None
+            if bill_data_obj is None:
+                return None
+
+            if index is not None:
+                index.put(
+                    content_hash,
+                    page,
+                    processor.image_process_model,
+                    version,
+                    bill_data_obj,
+                    file_path,
+                )
 
         bill_data = bill_data_obj.model_dump()
         bill_data.update(
             {
-                "file_path": image_path,
+                "file_path": file_path,
                 "processed_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "cached": cached,
+                "indexed_as": indexed_as,
             }
         )
-        logger.info(f"Structured data extracted: {bill_data}")
+        if not cached:
+            logger.info(f"Structured data extracted: {bill_data}")
         return bill_data
 
     except Exception as e:
-        logger.error(f"Error processing invoice {image_path}: {e}")
+        logger.error(f"Error processing invoice {file_path}: {e}")
         return None
 
 
@@ -78,41 +142,209 @@ def append_to_csv(output_file: str, data: dict[str, Any]):
 
 
 class InvoiceFileHandler(FileSystemEventHandler):
-    """Handles file system events for new invoice images."""
+    """Handles file system events for new invoice images.
+
+    Events only queue the new files, so that the watchdog observer thread never
+    waits for the model. A debouncer thread polls the queued files until they
+    are completely written: same size and modification time on two polls, and
+    not modified for `settle_seconds`. They are then processed by a pool of
+    `workers` threads, one per llama-server slot. A file modified again, or
+    whose processing failed, is processed again on its next event.
+    """
 
-    def __init__(self, processor: InvoiceProcessor, output_file: str):
+    def __init__(
+        self,
+        processor: InvoiceProcessor,
+        output_file: str,
+        index: InvoiceIndex | None = None,
+        workers: int = 1,
+        settle_seconds: float = DEFAULT_SETTLE_SECONDS,
+    ):
         self.processor = processor
         self.output_file = output_file
+        self.index = index
+        self.workers = workers
+        self.settle_seconds = settle_seconds
         self.processed_files: set[str] = set()
         logger.info(f"Output will be saved to: {self.output_file}")
 
         # Keep for backwards compat with process_existing_files in main.py
-        self.image_extensions = IMAGE_EXTENSIONS
+        self.image_extensions = INVOICE_EXTENSIONS
+
+        # Files being written: path -> size and modification time at the last poll
+        self._settling: dict[str, tuple[int, int] | None] = {}
+        self._lock = threading.Lock()
+        self._queue: queue.Queue[str | None] = queue.Queue()
+        self._in_progress = 0
+        self._csv_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._threads: list[threading.Thread] = []
+
+    def start(self):
+        """Start the debouncer and the worker threads."""
+        self._threads = [
+            threading.Thread(target=self._debounce, name="debouncer", daemon=True)
+        ] + [
+            threading.Thread(target=self._work, name=f"worker-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """Finish the invoices in progress, leaving the queued ones for next time."""
+        self._stopping.set()
+        # Workers only see the sentinels once the queue is empty
+        left = len(self._settling)
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+            left += 1
+        if left:
+            logger.info(f"{left} queued invoice(s) left unprocessed")
+        for _ in range(self.workers):
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
 
     def on_created(self, event):
         """Handle new file creation events."""
         if event.is_directory:
             return
 
+        self.enqueue(str(event.src_path))
+
+    def on_modified(self, event):
+        """Handle files written again, e.g. overwritten by a new scan."""
+        if event.is_directory:
+            return
+
         file_path = str(event.src_path)
-        file_ext = Path(file_path).suffix.lower()
+        with self._lock:
+            self.processed_files.discard(file_path)
+        self.enqueue(file_path)
 
-        if file_ext in IMAGE_EXTENSIONS and file_path not in self.processed_files:
-            logger.info(f"New image detected: {file_path}")
-            self._process_and_save(file_path)
+    def on_moved(self, event):
+        """Handle files moved into the directory, or renamed once written."""
+        if event.is_directory:
+            return
 
-    def _process_and_save(self, image_path: str):
-        """Process an invoice and append to CSV."""
-        self.processed_files.add(image_path)
-        bill_data = process_invoice(self.processor, image_path)
-        if bill_data is None:
+        self.enqueue(str(event.dest_path))
+
+    def enqueue(self, file_path: str):
+        """Queue an invoice file, processed once completely written."""
+        file_ext = Path(file_path).suffix.lower()
+        if file_ext not in INVOICE_EXTENSIONS:
             return
 
-        append_to_csv(self.output_file, bill_data)
+        with self._lock:
+            if file_path in self.processed_files or file_path in self._settling:
+                return
+            self._settling[file_path] = None
+            settling = len(self._settling)
         logger.info(
-            f"Successfully processed {image_path}: {bill_data['utility']} - {bill_data['amount']}{bill_data['currency']}"
+            f"New image detected: {file_path} "
+            f"({settling} being written, {self._queue.qsize()} queued)"
         )
 
+    def _debounce(self):
+        last_report = 0.0
+        while not self._stopping.wait(DEBOUNCE_POLL_SECONDS):
+            with self._lock:
+                paths = list(self._settling)
+
+            ready = 0
+            for file_path in paths:
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    # Temporary file, renamed or deleted
+                    with self._lock:
+                        del self._settling[file_path]
+                    continue
+
+                observed = (stat.st_size, stat.st_mtime_ns)
+                settled = time.time() - stat.st_mtime >= self.settle_seconds
+                with self._lock:
+                    if self._settling[file_path] != observed or not settled:
+                        self._settling[file_path] = observed
+                        continue
+                    # Empty files are still being created
+                    if stat.st_size == 0:
+                        if time.time() - stat.st_mtime >= EMPTY_FILE_TIMEOUT_SECONDS:
+                            logger.warning(f"Still empty, not processed: {file_path}")
+                            del self._settling[file_path]
+                        continue
+                    del self._settling[file_path]
+                    self.processed_files.add(file_path)
+                self._queue.put(file_path)
+                ready += 1
+
+            if ready or time.monotonic() - last_report >= QUEUE_REPORT_SECONDS:
+                last_report = time.monotonic()
+                self._report_queue()
+
+    def _report_queue(self):
+        queued = self._queue.qsize()
+        if queued or self._settling or self._in_progress:
+            logger.info(
+                f"Queue: {queued} queued, {self._in_progress} in progress, "
+                f"{len(self._settling)} being written"
+            )
+
+    def _work(self):
+        while (image_path := self._queue.get()) is not None:
+            with self._lock:
+                self._in_progress += 1
+            try:
+                self._process_and_save(image_path)
+            finally:
+                with self._lock:
+                    self._in_progress -= 1
+
+    def _process_and_save(self, image_path: str):
+        """Process an invoice, each page of a PDF, and append to CSV."""
+        if not self._save_pages(image_path):
+            # Processed again on its next event
+            with self._lock:
+                self.processed_files.discard(image_path)
+
+    def _save_pages(self, image_path: str) -> bool:
+        """Process the pages of an invoice file, False if any of them failed."""
+        if self._stopping.is_set():
+            return False
+        try:
+            pages = invoice_pages(image_path)
+        except Exception as e:
+            logger.error(f"Error reading {image_path}: {e}")
+            return False
+
+        success = True
+        for page in pages:
+            if self._stopping.is_set():
+                return False
+            bill_data = process_invoice(self.processor, image_path, page, self.index)
+            if bill_data is None:
+                success = False
+            if bill_data is None:
+                continue
+            # Already in the CSV under this name, renamed or copied invoices get
+            # their own row
+            if (
+                bill_data["cached"]
+                and bill_data["indexed_as"] == bill_data["file_path"]
+            ):
+                continue
+
+            with self._csv_lock:
+                append_to_csv(self.output_file, bill_data)
+            logger.info(
+                f"Successfully processed {bill_data['file_path']}: {bill_data['utility']} - {bill_data['amount']}{bill_data['currency']}"
+            )
+        return success
+
     def process_invoice(self, image_path: str):
-        """Process a single invoice image (used by process_existing_files)."""
-        self._process_and_save(image_path)
+        """Queue a single invoice image (used by process_existing_files)."""
+        self.enqueue(image_path)
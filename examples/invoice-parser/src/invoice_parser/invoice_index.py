@@ -0,0 +1,129 @@
+"""
+Persistent index of the invoices already processed, keyed by content hash.
+
+Results are stored in SQLite with the model and version (prompt and input
+settings, see `InvoiceProcessor.version`) that produced them: after a restart,
+or for a renamed or copied file, an invoice costs only the hashing of its file.
+Changing the model, the prompt or the image and PDF settings processes invoices
+again.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from loguru import logger
+
+from invoice_parser.invoice_processor import InvoiceData
+
+DEFAULT_INDEX_PATH = "invoice_index.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS invoices (
+    content_hash TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    model TEXT NOT NULL,
+    -- Prompt and input settings, see InvoiceProcessor.version
+    prompt_version TEXT NOT NULL,
+    utility TEXT NOT NULL,
+    amount REAL NOT NULL,
+    currency TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    processed_at TEXT NOT NULL,
+    PRIMARY KEY (content_hash, page, model, prompt_version)
+)
+"""
+
+
+def file_hash(path: str) -> str:
+    """SHA-256 of the content of a file."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+
+class InvoiceIndex:
+    """Extracted invoice data by content hash, page, model and version.
+
+    Safe to use from several threads. File hashes are remembered by path, size
+    and modification time, so the pages of a PDF hash it once.
+    """
+
+    def __init__(self, path: str = DEFAULT_INDEX_PATH, reuse: bool = True):
+        """
+        Args:
+            path: SQLite database file, created if needed
+            reuse: If False, results are stored but never looked up
+        """
+        self.path = path
+        self.reuse = reuse
+        self._lock = threading.Lock()
+        self._hashes: dict[tuple[str, int, int], str] = {}
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        # Readers do not wait for the writer, and a crash does not corrupt
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(_SCHEMA)
+        self._connection.commit()
+        count = self._connection.execute("SELECT COUNT(*) FROM invoices").fetchone()[0]
+        logger.info(f"Invoice index {path}: {count} result(s)")
+
+    def content_hash(self, file_path: str) -> str:
+        stat = os.stat(file_path)
+        key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if key in self._hashes:
+                return self._hashes[key]
+        content_hash = file_hash(file_path)
+        with self._lock:
+            self._hashes[key] = content_hash
+        return content_hash
+
+    def get(
+        self, content_hash: str, page: int | None, model: str, version: str
+    ) -> tuple[InvoiceData, str] | None:
+        """Stored result of an invoice and the file it was processed as, or None."""
+        if not self.reuse:
+            return None
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT utility, amount, currency, file_path FROM invoices"
+                " WHERE content_hash = ? AND page = ? AND model = ?"
+                " AND prompt_version = ?",
+                (content_hash, page or 0, model, version),
+            ).fetchone()
+        if row is None:
+            return None
+        utility, amount, currency, file_path = row
+        return InvoiceData(utility=utility, amount=amount, currency=currency), file_path
+
+    def put(
+        self,
+        content_hash: str,
+        page: int | None,
+        model: str,
+        version: str,
+        invoice_data: InvoiceData,
+        file_path: str,
+    ) -> None:
+        """Store the result of an invoice, replacing any previous one."""
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO invoices VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    content_hash,
+                    page or 0,
+                    model,
+                    version,
+                    invoice_data.utility,
+                    invoice_data.amount,
+                    invoice_data.currency,
+                    file_path,
+                    time.strftime("%Y-%m-%d %H:%M:%S"),
+                ),
+            )
+            self._connection.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
@@ -2,13 +2,30 @@
 Invoice processor module for handling image processing and data extraction.
 """
 
-import base64
-import mimetypes
+import hashlib
+import json
+from pathlib import Path
+import threading
+import time
 
 from loguru import logger
 from openai import OpenAI
+from openai.types import CompletionUsage
 from pydantic import BaseModel
 
+from invoice_parser.image_preprocessor import ImagePreprocessor, PreparedImage
+from invoice_parser.pdf_rasterizer import PDF_EXTENSIONS, PdfRasterizer
+from invoice_parser.text_layer import check_extraction, clean_text
+
+INVOICE_PROMPT = (
+    "What is the amount to pay in the invoice? "
+    "Please provide the amount, currency and type of bill "
+    "in a concise format. Present as a JSON object. "
+    "utility: Type of utility (e.g., electricity, water, gas). "
+    "amount: Amount shown on the bill. Only provide the numeric value. "
+    "currency: Currency of the amount (e.g., USD, EUR)."
+)
+
 
 class InvoiceData(BaseModel):
     utility: str
@@ -16,74 +33,233 @@ class InvoiceData(BaseModel):
     currency: str
 
 
+# Changes with the prompt or the schema, stored results of another version are
+# not reused
+PROMPT_VERSION = hashlib.sha256(
+    (INVOICE_PROMPT + json.dumps(InvoiceData.model_json_schema())).encode()
+).hexdigest()[:12]
+
+
+class ExtractionStats:
+    """Counts of the pages extracted from their text layer or by the vision model."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.text_pages = 0
+        self.text_seconds = 0.0
+        self.vision_pages = 0
+        self.vision_seconds = 0.0
+        # Text layer attempts that fell back to the vision model
+        self.fallback_seconds = 0.0
+
+    def add(self, kind: str, seconds: float) -> None:
+        with self._lock:
+            if kind == "text":
+                self.text_pages += 1
+                self.text_seconds += seconds
+            elif kind == "vision":
+                self.vision_pages += 1
+                self.vision_seconds += seconds
+            else:
+                self.fallback_seconds += seconds
+
+    def summary(self) -> str | None:
+        """Share of the fast path and time saved, None if no PDF page had text."""
+        total = self.text_pages + self.vision_pages
+        if not self.text_pages:
+            return None
+        summary = (
+            f"Text layer fast path: {self.text_pages}/{total} page(s) "
+            f"({self.text_pages / total:.0%}), "
+            f"{self.text_seconds / self.text_pages:.2f}s per page"
+        )
+        if not self.vision_pages:
+            return summary + ", no page went to the vision model to compare with"
+        vision_per_page = self.vision_seconds / self.vision_pages
+        saved = (
+            self.text_pages * vision_per_page
+            - self.text_seconds
+            - self.fallback_seconds
+        )
+        return (
+            f"{summary} against {vision_per_page:.2f}s with the vision model, "
+            f"about {abs(saved):.1f}s {'saved' if saved >= 0 else 'lost'}"
+        )
+
+
 class InvoiceProcessor:
-    """Handles invoice image processing and data extraction."""
+    """Handles invoice image processing and data extraction.
+
+    Invoices are image files, or pages of PDF files rendered by `rasterizer`.
+    With `text_fast_path`, the text embedded in digital PDFs is read by the
+    model with a text-only prompt, and pages only go to the vision model when
+    they have no text layer or the answer is not found in the text.
+    """
 
     def __init__(
         self,
         image_process_model: str,
         base_url: str = "http://127.0.0.1:8080/v1",
+        preprocessor: ImagePreprocessor | None = None,
+        rasterizer: PdfRasterizer | None = None,
+        text_fast_path: bool = True,
     ):
         self.image_process_model = image_process_model
         self.client = OpenAI(base_url=base_url, api_key="not-needed")
+        self.preprocessor = preprocessor or ImagePreprocessor()
+        self.rasterizer = rasterizer or PdfRasterizer(
+            max_side=self.preprocessor.max_side
+        )
+        self.text_fast_path = text_fast_path
+        self.stats = ExtractionStats()
+
+    def version(self, path: str) -> str:
+        """Version of the results for an invoice file: prompt and input settings.
 
-    def process(self, image_path: str) -> InvoiceData | None:
-        """Process an invoice image to extract structured data."""
-        invoice_data = self.image2text(image_path)
+        Results of another version are not reused, e.g. those of a trial run with
+        smaller or grayscale images. For PDFs, it also covers the rendering and
+        whether the text layer is read, which decides between text and vision.
+        """
+        settings = {
+            "prompt": PROMPT_VERSION,
+            "max_side": self.preprocessor.max_side,
+            "grayscale": self.preprocessor.grayscale,
+            "quality": self.preprocessor.quality,
+        }
+        if _is_pdf(path):
+            settings |= {
+                "pdf_dpi": self.rasterizer.dpi,
+                "pdf_max_side": self.rasterizer.max_side,
+                "text_fast_path": self.text_fast_path,
+            }
+        return hashlib.sha256(
+            json.dumps(settings, sort_keys=True).encode()
+        ).hexdigest()[:12]
+
+    def process(self, image_path: str, page: int | None = None) -> InvoiceData | None:
+        """Process an invoice image, or a page of a PDF, to extract structured data."""
+        invoice_data = None
+        if self.text_fast_path and _is_pdf(image_path):
+            invoice_data = self.pdf_text2text(image_path, page or 0)
+        if invoice_data is None:
+            invoice_data = self.image2text(image_path, page)
         if not invoice_data:
             logger.warning(f"No data extracted from {image_path}")
             return None
 
         return invoice_data
 
-    def image2text(self, image_path: str) -> InvoiceData | None:
-        """Extract structured data directly from invoice image using vision model."""
+    def pdf_text2text(self, pdf_path: str, page: int) -> InvoiceData | None:
+        """Extract structured data from the text layer of a PDF page, if it backs it."""
+        start_time = time.perf_counter()
         try:
-            with open(image_path, "rb") as f:
-                image_bytes = f.read()
-            b64 = base64.b64encode(image_bytes).decode("utf-8")
-            mime_type = mimetypes.guess_type(image_path)[0] or "image/png"
-
-            response = self.client.chat.completions.create(
-                model=self.image_process_model,
-                messages=[
-                    {
-                        "role": "user",
-                        "content": [
-                            {
-                                "type": "text",
-                                "text": (
-                                    "What is the amount to pay in the invoice? "
-                                    "Please provide the amount, currency and type of bill "
-                                    "in a concise format. Present as a JSON object. "
-                                    "utility: Type of utility (e.g., electricity, water, gas). "
-                                    "amount: Amount shown on the bill. Only provide the numeric value. "
-                                    "currency: Currency of the amount (e.g., USD, EUR)."
-                                ),
-                            },
-                            {
-                                "type": "image_url",
-                                "image_url": {
-                                    "url": f"data:{mime_type};base64,{b64}",
-                                },
-                            },
-                        ],
-                    }
-                ],
-                temperature=0.0,
-                response_format={
-                    "type": "json_schema",
-                    "json_schema": {
-                        "name": "InvoiceData",
-                        "schema": InvoiceData.model_json_schema(),
-                    },
-                },
+            text = clean_text(self.rasterizer.text(pdf_path, page).result())
+            if text is None:
+                logger.debug(f"No text layer in {pdf_path} page {page + 1}")
+                problem = "no text layer"
+                invoice_data = None
+            else:
+                invoice_data, _ = self.extract_from_text(text)
+                problem = (
+                    "no answer"
+                    if invoice_data is None
+                    else check_extraction(**invoice_data.model_dump(), text=text)
+                )
+        except Exception as e:
+            problem = str(e)
+
+        elapsed = time.perf_counter() - start_time
+        if problem is not None:
+            logger.info(
+                f"Text layer of {pdf_path} page {page + 1} not used ({problem}), "
+                "falling back to the vision model"
             )
-            content = response.choices[0].message.content
-            if content is None:
-                return None
-            return InvoiceData.model_validate_json(content)
+            self.stats.add("fallback", elapsed)
+            return None
+
+        logger.info(f"Extracted {pdf_path} page {page + 1} from its text layer")
+        self.stats.add("text", elapsed)
+        return invoice_data
+
+    def image2text(
+        self, image_path: str, page: int | None = None
+    ) -> InvoiceData | None:
+        """Extract structured data directly from invoice image using vision model."""
+        start_time = time.perf_counter()
+        try:
+            image = self.load_image(image_path, page)
+            invoice_data, _ = self.extract(image)
+            self.stats.add("vision", time.perf_counter() - start_time)
+            return invoice_data
 
         except Exception as e:
             logger.error(f"Error extracting data from {image_path}: {e}")
             return None
+
+    def load_image(self, image_path: str, page: int | None = None) -> PreparedImage:
+        """Read an image file, or render a page of a PDF file, ready to be sent."""
+        if _is_pdf(image_path):
+            png = self.rasterizer.render(image_path, page or 0).result()
+            return self.preprocessor.prepare_bytes(png, "image/png")
+        return self.preprocessor.prepare(image_path)
+
+    def extract(
+        self, image: PreparedImage
+    ) -> tuple[InvoiceData | None, CompletionUsage | None]:
+        """Send a prepared image to the vision model.
+
+        Returns the extracted data, and the token usage reported by the server.
+        """
+        return self._complete(
+            [
+                {"type": "text", "text": INVOICE_PROMPT},
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": image.data_url(),
+                    },
+                },
+            ]
+        )
+
+    def extract_from_text(
+        self, text: str
+    ) -> tuple[InvoiceData | None, CompletionUsage | None]:
+        """Send the text of an invoice to the model, without image."""
+        return self._complete(
+            [
+                {
+                    "type": "text",
+                    "text": f"{INVOICE_PROMPT}\n\nText of the invoice:\n{text}",
+                },
+            ]
+        )
+
+    def _complete(
+        self, content: list[dict]
+    ) -> tuple[InvoiceData | None, CompletionUsage | None]:
+        response = self.client.chat.completions.create(
+            model=self.image_process_model,
+            messages=[
+                {
+                    "role": "user",
+                    "content": content,
+                }
+            ],
+            temperature=0.0,
+            response_format={
+                "type": "json_schema",
+                "json_schema": {
+                    "name": "InvoiceData",
+                    "schema": InvoiceData.model_json_schema(),
+                },
+            },
+        )
+        answer = response.choices[0].message.content
+        if answer is None:
+            return None, response.usage
+        return InvoiceData.model_validate_json(answer), response.usage
+
+
+def _is_pdf(path: str) -> bool:
+    return Path(path).suffix.lower() in PDF_EXTENSIONS
@@ -9,11 +9,15 @@ from loguru import logger
 
 DEFAULT_PORT = 8080
 
+# Context of each parallel slot, enough for the image tokens of an invoice and the answer
+CTX_SIZE_PER_SLOT = 4096
+
 
 def start_llama_server(
     model_id: str,
     port: int = DEFAULT_PORT,
     verbose: bool = False,
+    parallel: int = 1,
 ) -> subprocess.Popen:
     """Start llama-server as a subprocess.
 
@@ -21,11 +25,25 @@ def start_llama_server(
         model_id: HuggingFace model ID to load
         port: Port to run the server on
         verbose: If True, show server output; otherwise suppress it
+        parallel: Number of slots, requests decoded together with continuous batching
 
     Returns:
         The subprocess handle
     """
-    cmd = ["llama-server", "-hf", model_id, "--jinja", "--port", str(port)]
+    cmd = [
+        "llama-server",
+        "-hf",
+        model_id,
+        "--jinja",
+        "--port",
+        str(port),
+        "--parallel",
+        str(parallel),
+        "--cont-batching",
+        # The context is split between the slots
+        "--ctx-size",
+        str(CTX_SIZE_PER_SLOT * parallel),
+    ]
     if verbose:
         process = subprocess.Popen(cmd)
     else:
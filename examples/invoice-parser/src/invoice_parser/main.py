@@ -4,6 +4,8 @@ Invoice extraction tool that processes bill/invoice images using a small Vision
 Extracts bill type and amount information and appends to CSV files for expense tracking.
 """
 
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import time
 
@@ -11,12 +13,16 @@ import click
 from loguru import logger
 from watchdog.observers import Observer
 
+from invoice_parser.image_preprocessor import DEFAULT_MAX_SIDE, ImagePreprocessor
 from invoice_parser.invoice_file_handler import (
-    IMAGE_EXTENSIONS,
+    DEFAULT_SETTLE_SECONDS,
+    INVOICE_EXTENSIONS,
     InvoiceFileHandler,
     append_to_csv,
+    invoice_pages,
     process_invoice,
 )
+from invoice_parser.invoice_index import DEFAULT_INDEX_PATH, InvoiceIndex
 from invoice_parser.invoice_processor import InvoiceProcessor
 from invoice_parser.llama_server import (
     DEFAULT_PORT,
@@ -24,11 +30,12 @@ from invoice_parser.llama_server import (
     stop_server,
     wait_for_server,
 )
+from invoice_parser.pdf_rasterizer import DEFAULT_PDF_DPI, PdfRasterizer
 from invoice_parser.table_printer import print_results_table
 
 
 def process_existing_files(directory: str, handler: InvoiceFileHandler):
-    """Process any existing image files in the directory."""
+    """Queue any existing image files in the directory for processing."""
     logger.info(f"Processing existing files in {directory}")
 
     for file_path in Path(directory).rglob("*"):
@@ -39,24 +46,46 @@ def process_existing_files(directory: str, handler: InvoiceFileHandler):
 
 
 def collect_image_paths(paths: tuple[str, ...]) -> list[Path]:
-    """Collect image file paths from the given files and directories."""
+    """Collect image and PDF file paths from the given files and directories."""
     image_paths: list[Path] = []
     for p in paths:
         path = Path(p)
         if path.is_dir():
             for file_path in path.rglob("*"):
-                if file_path.is_file() and file_path.suffix.lower() in IMAGE_EXTENSIONS:
+                if (
+                    file_path.is_file()
+                    and file_path.suffix.lower() in INVOICE_EXTENSIONS
+                ):
                     image_paths.append(file_path)
         elif path.is_file():
-            if path.suffix.lower() in IMAGE_EXTENSIONS:
+            if path.suffix.lower() in INVOICE_EXTENSIONS:
                 image_paths.append(path)
             else:
-                logger.warning(f"Skipping non-image file: {path}")
+                logger.warning(f"Skipping file that is not an image or PDF: {path}")
         else:
             logger.warning(f"Path does not exist: {path}")
     return image_paths
 
 
+def collect_pages(
+    image_paths: list[Path], unreadable: list[Path] | None = None
+) -> Iterator[tuple[str, int | None]]:
+    """Yield each invoice to process: image files, and each page of PDF files.
+
+    Files whose pages cannot be read are logged, and added to `unreadable`.
+    """
+    for image_path in image_paths:
+        try:
+            pages = invoice_pages(str(image_path))
+        except Exception as e:
+            logger.error(f"Error reading {image_path}: {e}")
+            if unreadable is not None:
+                unreadable.append(image_path)
+            continue
+        for page in pages:
+            yield str(image_path), page
+
+
 @click.group()
 def cli():
     """Invoice extraction tool using Large Foundation Models.
@@ -94,26 +123,97 @@ def cli():
     is_flag=True,
     help="Show llama-server output",
 )
+@click.option(
+    "--parallel",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Invoices processed at once, one llama-server slot each",
+)
+@click.option(
+    "--settle-seconds",
+    default=DEFAULT_SETTLE_SECONDS,
+    type=click.FloatRange(min=0),
+    help="Time without modification after which a new file is considered completely written",
+)
+@click.option(
+    "--max-side",
+    default=DEFAULT_MAX_SIDE,
+    type=click.IntRange(min=0),
+    help="Downscale images to this longest side in pixels before sending them, 0 to send them as they are",
+)
+@click.option(
+    "--grayscale",
+    is_flag=True,
+    help="Convert images to grayscale before sending them",
+)
+@click.option(
+    "--pdf-dpi",
+    default=DEFAULT_PDF_DPI,
+    type=click.IntRange(min=1),
+    help="Resolution to render PDF pages at",
+)
+@click.option(
+    "--text-fast-path/--no-text-fast-path",
+    default=True,
+    help="Read digital PDFs from their text layer, the vision model only reading scanned pages",
+)
+@click.option(
+    "--index",
+    default=DEFAULT_INDEX_PATH,
+    type=click.Path(dir_okay=False),
+    help="SQLite file of the invoices already processed, which are not sent again",
+)
+@click.option(
+    "--reprocess",
+    is_flag=True,
+    help="Process invoices again even if they are in the index",
+)
 def watch(
     dir: Path,
     image_model: str,
     process_existing: bool,
     port: int,
     verbose_server: bool,
+    parallel: int,
+    settle_seconds: float,
+    max_side: int,
+    grayscale: bool,
+    pdf_dpi: int,
+    text_fast_path: bool,
+    index: str,
+    reprocess: bool,
 ):
-    """Watch a directory for new invoice images and process them continuously."""
+    """Watch a directory for new invoice images and process them continuously.
+
+    New files are queued, and processed once completely written by --parallel
+    workers, so that large batches dropped at once do not hold back the watcher.
+    """
     logger.info(f"Starting llama-server with model: {image_model}")
-    server_process = start_llama_server(image_model, port=port, verbose=verbose_server)
+    server_process = start_llama_server(
+        image_model, port=port, verbose=verbose_server, parallel=parallel
+    )
 
     try:
         wait_for_server(port=port)
 
         base_url = f"http://127.0.0.1:{port}/v1"
-        processor = InvoiceProcessor(image_model, base_url=base_url)
-        handler = InvoiceFileHandler(processor, str(dir / "bills.csv"))
-
-        if process_existing:
-            process_existing_files(str(dir), handler)
+        preprocessor = ImagePreprocessor(max_side=max_side or None, grayscale=grayscale)
+        rasterizer = PdfRasterizer(dpi=pdf_dpi, max_side=max_side or None)
+        processor = InvoiceProcessor(
+            image_model,
+            base_url=base_url,
+            preprocessor=preprocessor,
+            rasterizer=rasterizer,
+            text_fast_path=text_fast_path,
+        )
+        handler = InvoiceFileHandler(
+            processor,
+            str(dir / "bills.csv"),
+            index=InvoiceIndex(index, reuse=not reprocess),
+            workers=parallel,
+            settle_seconds=settle_seconds,
+        )
+        handler.start()
 
         observer = Observer()
         observer.schedule(handler, str(dir), recursive=True)
@@ -124,6 +224,10 @@ def watch(
 
         observer.start()
 
+        # Once watching, so that no file is missed in between
+        if process_existing:
+            process_existing_files(str(dir), handler)
+
         try:
             while True:
                 time.sleep(1)
@@ -132,6 +236,9 @@ def watch(
             observer.stop()
 
         observer.join()
+        handler.stop()
+        if summary := processor.stats.summary():
+            logger.info(summary)
         logger.info("Invoice extraction tool stopped.")
     finally:
         stop_server(server_process)
@@ -160,53 +267,137 @@ def watch(
     is_flag=True,
     help="Show llama-server output",
 )
+@click.option(
+    "--parallel",
+    default=1,
+    type=click.IntRange(min=1),
+    help="Invoices processed at once, one llama-server slot each",
+)
+@click.option(
+    "--max-side",
+    default=DEFAULT_MAX_SIDE,
+    type=click.IntRange(min=0),
+    help="Downscale images to this longest side in pixels before sending them, 0 to send them as they are",
+)
+@click.option(
+    "--grayscale",
+    is_flag=True,
+    help="Convert images to grayscale before sending them",
+)
+@click.option(
+    "--pdf-dpi",
+    default=DEFAULT_PDF_DPI,
+    type=click.IntRange(min=1),
+    help="Resolution to render PDF pages at",
+)
+@click.option(
+    "--text-fast-path/--no-text-fast-path",
+    default=True,
+    help="Read digital PDFs from their text layer, the vision model only reading scanned pages",
+)
+@click.option(
+    "--index",
+    default=DEFAULT_INDEX_PATH,
+    type=click.Path(dir_okay=False),
+    help="SQLite file of the invoices already processed, which are not sent again",
+)
+@click.option(
+    "--reprocess",
+    is_flag=True,
+    help="Process invoices again even if they are in the index",
+)
 @click.argument("paths", nargs=-1, required=True)
 def process(
     image_model: str,
     output: Path | None,
     port: int,
     verbose_server: bool,
+    parallel: int,
+    max_side: int,
+    grayscale: bool,
+    pdf_dpi: int,
+    text_fast_path: bool,
+    index: str,
+    reprocess: bool,
     paths: tuple[str, ...],
 ):
     """Process specific invoice files or folders and exit.
 
     Accepts one or more file paths or directory paths. Directories are scanned
-    recursively for image files. Results are printed to the console, and
+    recursively for image and PDF files, each page of a PDF being an invoice. Results are printed to the console, and
     optionally appended to a CSV file via --output.
+
+    With --parallel, several invoices are sent to llama-server at once and
+    decoded together, results are still reported in input order.
     """
     image_paths = collect_image_paths(paths)
 
     if not image_paths:
-        logger.warning("No image files found in the provided paths.")
+        logger.warning("No image or PDF files found in the provided paths.")
         return
 
-    logger.info(f"Found {len(image_paths)} image(s) to process")
+    logger.info(f"Found {len(image_paths)} file(s) to process")
     logger.info(f"Image processing model: {image_model}")
 
     logger.info(f"Starting llama-server with model: {image_model}")
-    server_process = start_llama_server(image_model, port=port, verbose=verbose_server)
+    server_process = start_llama_server(
+        image_model, port=port, verbose=verbose_server, parallel=parallel
+    )
 
     try:
         wait_for_server(port=port)
 
         base_url = f"http://127.0.0.1:{port}/v1"
-        processor = InvoiceProcessor(image_model, base_url=base_url)
+        preprocessor = ImagePreprocessor(max_side=max_side or None, grayscale=grayscale)
+        rasterizer = PdfRasterizer(dpi=pdf_dpi, max_side=max_side or None)
+        processor = InvoiceProcessor(
+            image_model,
+            base_url=base_url,
+            preprocessor=preprocessor,
+            rasterizer=rasterizer,
+            text_fast_path=text_fast_path,
+        )
+
+        invoice_index = InvoiceIndex(index, reuse=not reprocess)
 
         results = []
-        for image_path in image_paths:
-            bill_data = process_invoice(processor, str(image_path))
-            if bill_data is None:
-                continue
-
-            results.append(bill_data)
-
-            if output is not None:
-                append_to_csv(str(output), bill_data)
+        # Pages read by the model, the throughput leaving out index hits and failures
+        processed = 0
+        cached = 0
+        failed = 0
+        unreadable: list[Path] = []
+        start_time = time.perf_counter()
+        # One request in flight per server slot, map() yields in input order.
+        # PDF pages are rendered when their request starts.
+        with ThreadPoolExecutor(max_workers=parallel) as executor:
+            for bill_data in executor.map(
+                lambda item: process_invoice(processor, *item, index=invoice_index),
+                collect_pages(image_paths, unreadable),
+            ):
+                if bill_data is None:
+                    failed += 1
+                    continue
+                if bill_data["cached"]:
+                    cached += 1
+                else:
+                    processed += 1
+
+                results.append(bill_data)
+
+                if output is not None:
+                    append_to_csv(str(output), bill_data)
+        elapsed = time.perf_counter() - start_time
 
         if results:
             print_results_table(results)
 
-        logger.info("Processing complete.")
+        logger.info(
+            f"Processing complete: {processed} image(s) in {elapsed:.1f}s "
+            f"({processed / elapsed * 60:.1f} images/min, {parallel} slot(s)), "
+            f"{cached} already in the index, {failed + len(unreadable)} failed"
+        )
+        if summary := processor.stats.summary():
+            logger.info(summary)
     finally:
         stop_server(server_process)
 
@@ -0,0 +1,124 @@
+"""
+Rendering of PDF invoice pages to images for the vision model.
+
+Pages are rendered in memory, on demand, in a pool of processes: PDFium is not
+thread-safe, and rendering is CPU-bound. No intermediate image is written to
+disk. The text layer of pages is extracted in the same pool.
+"""
+
+from concurrent.futures import Future, ProcessPoolExecutor
+import io
+import multiprocessing
+import os
+import threading
+
+import pypdfium2 as pdfium
+
+PDF_EXTENSIONS = {".pdf"}
+
+# Enough for the small print of an invoice, pages are rendered smaller when the
+# image sent to the model is limited to a longest side anyway
+DEFAULT_PDF_DPI = 150
+
+# PDF units per inch
+POINTS_PER_INCH = 72
+
+
+def page_count(pdf_path: str) -> int:
+    """Number of pages of a PDF file."""
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+
+def render_page(
+    pdf_path: str, page_index: int, dpi: int, max_side: int | None = None
+) -> bytes:
+    """Render a page of a PDF file as PNG bytes.
+
+    Args:
+        pdf_path: Path of the PDF file
+        page_index: Index of the page, from 0
+        dpi: Resolution to render the page at
+        max_side: Longest side in pixels, lowering the resolution if needed
+
+    Returns:
+        The PNG encoded page
+    """
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        page = pdf[page_index]
+        scale = dpi / POINTS_PER_INCH
+        if max_side is not None:
+            scale = min(scale, max_side / max(page.get_size()))
+        image = page.render(scale=scale, may_draw_forms=True).to_pil()
+        page.close()
+    finally:
+        pdf.close()
+
+    output = io.BytesIO()
+    # Fast compression, the image is re-encoded before it is sent anyway
+    image.save(output, format="PNG", compress_level=1)
+    return output.getvalue()
+
+
+def extract_text(pdf_path: str, page_index: int) -> str:
+    """Text embedded in a page of a PDF file, empty for a scanned page."""
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        page = pdf[page_index]
+        text_page = page.get_textpage()
+        text = text_page.get_text_bounded()
+        text_page.close()
+        page.close()
+    finally:
+        pdf.close()
+    return text
+
+
+class PdfRasterizer:
+    """Renders PDF pages in a pool of worker processes, started on first use."""
+
+    def __init__(
+        self,
+        dpi: int = DEFAULT_PDF_DPI,
+        max_side: int | None = None,
+        workers: int | None = None,
+    ):
+        """
+        Args:
+            dpi: Resolution to render pages at
+            max_side: Longest side in pixels of the rendered pages, None for no limit
+            workers: Processes rendering pages, defaults to the number of CPUs
+        """
+        self.dpi = dpi
+        self.max_side = max_side
+        self.workers = workers or os.cpu_count()
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Forking a process with running threads is unsafe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self._executor
+
+    def render(self, pdf_path: str, page_index: int) -> Future[bytes]:
+        """Start rendering a page, the future giving its PNG bytes."""
+        return self._pool().submit(
+            render_page, pdf_path, page_index, self.dpi, self.max_side
+        )
+
+    def text(self, pdf_path: str, page_index: int) -> Future[str]:
+        """Start extracting the text layer of a page."""
+        return self._pool().submit(extract_text, pdf_path, page_index)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,109 @@
+"""
+Checks for the text-layer fast path of digital PDF invoices.
+
+Born-digital PDFs embed their text: the model can read the amount from it with
+a text-only prompt, much faster than from a rendered image. The answer is only
+trusted when the text backs it, otherwise the page goes to the vision model.
+"""
+
+import re
+
+# Fewer characters mean a scanned page, or a page with barely any text
+MIN_TEXT_CHARS = 50
+
+# Keeps the prompt well within the context of a llama-server slot
+MAX_TEXT_CHARS = 6000
+
+CURRENCY_SYMBOLS = {
+    "USD": "$",
+    "AUD": "$",
+    "CAD": "$",
+    "NZD": "$",
+    "GBP": "£",
+    "EUR": "€",
+    "JPY": "¥",
+    "CNY": "¥",
+    "INR": "₹",
+    "CHF": "Fr",
+}
+
+# Numbers as printed on invoices: 1234.5, 1,234.56, 1.234,56, 1 234,56. Only whole
+# tokens: neither 1.23 nor 4.56 are read in 1,234.56, nor 2024 in 01/01/2024
+_NUMBER = re.compile(
+    r"(?<![\d.,/])(?:\d{1,3}(?:[ ,.'\u00a0]\d{3})+(?:[.,]\d{1,2})?(?![\d/])"
+    r"|\d+(?:[.,]\d{1,2})?(?![\d.,]?\d|/))"
+)
+
+# Labels of the amount to pay
+_AMOUNT_LABEL = re.compile(r"\b(?:total|amount|balance|due|pay|payable|sum)\b", re.I)
+
+# Characters around an amount searched for its currency or label
+CONTEXT_CHARS = 40
+
+
+def clean_text(text: str) -> str | None:
+    """Whitespace-normalized text of a page, None if there is no usable text layer."""
+    text = re.sub(r"[ \t\u00a0]+", " ", text)
+    text = re.sub(r"\s*\n\s*", "\n", text).strip()
+    if len(text) < MIN_TEXT_CHARS:
+        return None
+    return text[:MAX_TEXT_CHARS]
+
+
+def _parse_number(number: str) -> float:
+    """Value of a printed number, the last separator followed by 1-2 digits being decimal."""
+    match = re.fullmatch(r"(.*?)[.,](\d{1,2})", number)
+    integer, decimals = match.groups() if match else (number, "0")
+    return float(re.sub(r"\D", "", integer) + "." + decimals)
+
+
+def amounts_in(text: str) -> list[tuple[float, int, int]]:
+    """Numbers printed in the text, with their start and end offsets."""
+    return [
+        (_parse_number(match.group()), match.start(), match.end())
+        for match in _NUMBER.finditer(text)
+    ]
+
+
+def _currency_pattern(code: str) -> re.Pattern:
+    """The currency code or symbol, as a word of its own, not inside "From"."""
+    markers = [rf"\b{code}\b"]
+    symbol = CURRENCY_SYMBOLS.get(code)
+    if symbol is not None:
+        markers.append(
+            rf"\b{re.escape(symbol)}\b\.?" if symbol.isalpha() else re.escape(symbol)
+        )
+    return re.compile("|".join(markers))
+
+
+def check_extraction(
+    utility: str, amount: float, currency: str, text: str
+) -> str | None:
+    """Reason not to trust data extracted from `text`, None if the text backs it.
+
+    The amount must be printed as a whole number next to the currency or to a
+    label like "Total" or "Amount due", not only somewhere on the page.
+    """
+    if not utility.strip():
+        return "no utility"
+    if amount <= 0:
+        return f"amount {amount} is not positive"
+    code = currency.strip().upper()
+    if not re.fullmatch(r"[A-Z]{3}", code):
+        return f"currency {currency!r} is not a currency code"
+    currency_marker = _currency_pattern(code)
+    if not currency_marker.search(text):
+        return f"currency {code} is not in the text"
+
+    printed = [
+        (start, end)
+        for value, start, end in amounts_in(text)
+        if abs(amount - value) < 0.005
+    ]
+    if not printed:
+        return f"amount {amount} is not in the text"
+    for start, end in printed:
+        context = text[max(0, start - CONTEXT_CHARS) : end + CONTEXT_CHARS]
+        if currency_marker.search(context) or _AMOUNT_LABEL.search(context):
+            return None
+    return f"amount {amount} is not next to the currency or a total"